@@ -1,11 +1,13 @@
 import uuid
 import time
+import hashlib
 import asyncio
 import json
 import os
 from pathlib import Path
 from transformers import AutoTokenizer
-from typing import List, Literal, Union, Dict, Optional
+from typing import List, Literal, Union, Dict, Optional, Tuple
+from collections import OrderedDict
 from aiohttp import web
 import aiohttp_cors
 import traceback
@@ -13,8 +15,12 @@ import signal
 from exo import DEBUG, VERSION
 from exo.download.download_progress import RepoProgressEvent
 from exo.helpers import PrefixDict, shutdown, get_exo_images_dir
-from exo.inference.tokenizers import resolve_tokenizer
+from exo.inference.tokenizers import resolve_tokenizer, tokenizer_cache
 from exo.orchestration import Node
+from exo.orchestration.generation import generation_params, truncate_at_stop, StopStringFilter
+from exo.inference.detokenizer import IncrementalDetokenizer
+from exo.orchestration.request_store import RequestStore
+from exo.orchestration.admission import AdmissionController, QueueFull, PRIORITIES
 from exo.models import build_base_shard, model_cards, get_repo, pretty_name
 from typing import Callable, Optional
 from PIL import Image
@@ -33,7 +39,6 @@ from exo.download.hf.hf_shard_download import HFShardDownloader
 import shutil
 from exo.download.hf.hf_helpers import get_hf_home, get_repo_root
 from exo.apputil import create_animation_mp4
-from collections import defaultdict
 
 
 class Message:
@@ -50,22 +55,45 @@ class Message:
 
 
 class ChatCompletionRequest:
-  def __init__(self, model: str, messages: List[Message], temperature: float, tools: Optional[List[Dict]] = None):
+  def __init__(
+    self,
+    model: str,
+    messages: List[Message],
+    temperature: Optional[float],
+    tools: Optional[List[Dict]] = None,
+    max_tokens: Optional[int] = None,
+    top_p: Optional[float] = None,
+    stop: Optional[List[str]] = None,
+  ):
     self.model = model
     self.messages = messages
     self.temperature = temperature
     self.tools = tools
+    self.max_tokens = max_tokens
+    self.top_p = top_p
+    self.stop = stop
 
   def to_dict(self):
-    return {"model": self.model, "messages": [message.to_dict() for message in self.messages], "temperature": self.temperature, "tools": self.tools}
+    return {
+      "model": self.model,
+      "messages": [message.to_dict() for message in self.messages],
+      "temperature": self.temperature,
+      "tools": self.tools,
+      "max_tokens": self.max_tokens,
+      "top_p": self.top_p,
+      "stop": self.stop,
+    }
+
+  def generation_params(self) -> dict:
+    return generation_params(max_tokens=self.max_tokens, temperature=self.temperature, top_p=self.top_p, stop=self.stop)
 
 
 def generate_completion(
   chat_request: ChatCompletionRequest,
-  tokenizer,
-  prompt: str,
+  prompt_tokens: Optional[int],
   request_id: str,
   tokens: List[int],
+  content: str,
   stream: bool,
   finish_reason: Union[Literal["length", "stop"], None],
   object_type: Literal["chat.completion", "text_completion"],
@@ -78,7 +106,7 @@ def generate_completion(
     "system_fingerprint": f"exo_{VERSION}",
     "choices": [{
       "index": 0,
-      "message": {"role": "assistant", "content": tokenizer.decode(tokens)},
+      "message": {"role": "assistant", "content": content},
       "logprobs": None,
       "finish_reason": finish_reason,
     }],
@@ -86,17 +114,17 @@ def generate_completion(
 
   if not stream:
     completion["usage"] = {
-      "prompt_tokens": len(tokenizer.encode(prompt)),
+      "prompt_tokens": prompt_tokens,
       "completion_tokens": len(tokens),
-      "total_tokens": len(tokenizer.encode(prompt)) + len(tokens),
+      "total_tokens": prompt_tokens + len(tokens),
     }
 
   choice = completion["choices"][0]
   if object_type.startswith("chat.completion"):
     key_name = "delta" if stream else "message"
-    choice[key_name] = {"role": "assistant", "content": tokenizer.decode(tokens)}
+    choice[key_name] = {"role": "assistant", "content": content}
   elif object_type == "text_completion":
-    choice["text"] = tokenizer.decode(tokens)
+    choice["text"] = content
   else:
     ValueError(f"Unsupported response type: {object_type}")
 
@@ -166,14 +194,46 @@ def parse_message(data: dict):
 
 
 def parse_chat_request(data: dict, default_model: str):
+  stop = data.get("stop", None)
   return ChatCompletionRequest(
     data.get("model", default_model),
     [parse_message(msg) for msg in data["messages"]],
-    data.get("temperature", 0.0),
+    data.get("temperature", None),
     data.get("tools", None),
+    max_tokens=data.get("max_completion_tokens", data.get("max_tokens", None)),
+    top_p=data.get("top_p", None),
+    stop=[stop] if isinstance(stop, str) else stop,
   )
 
 
+class PromptTokenCounts:
+  """
+  Token counts of recent prompts, so a prompt that was already encoded (e.g. by /chat/token/encode while the
+  user was typing) is not encoded again for usage accounting.
+  """
+  def __init__(self, max_entries: int = 1024):
+    self.max_entries = max_entries
+    self.counts: OrderedDict[Tuple[str, str], int] = OrderedDict()
+
+  def key(self, model_id: str, prompt: str) -> Tuple[str, str]:
+    return model_id, hashlib.sha1(prompt.encode()).hexdigest()
+
+  def put(self, model_id: str, prompt: str, count: int) -> None:
+    key = self.key(model_id, prompt)
+    self.counts[key] = count
+    self.counts.move_to_end(key)
+    if len(self.counts) > self.max_entries: self.counts.popitem(last=False)
+
+  def count(self, model_id: str, prompt: str, tokenizer) -> int:
+    key = self.key(model_id, prompt)
+    if key in self.counts:
+      self.counts.move_to_end(key)
+      return self.counts[key]
+    count = len(tokenizer.encode(prompt))
+    self.put(model_id, prompt, count)
+    return count
+
+
 class PromptSession:
   def __init__(self, request_id: str, timestamp: int, prompt: str):
     self.request_id = request_id
@@ -189,9 +249,12 @@ class ChatGPTAPI:
     response_timeout: int = 90,
     on_chat_completion_request: Callable[[str, ChatCompletionRequest, str], None] = None,
     default_model: Optional[str] = None,
-    system_prompt: Optional[str] = None
+    system_prompt: Optional[str] = None,
+    max_concurrent_requests: int = 8,
+    max_queued_requests: int = 64,
   ):
     self.node = node
+    self.admission = AdmissionController(max_concurrent_requests, max_queued_requests)
     self.inference_engine_classname = inference_engine_classname
     self.response_timeout = response_timeout
     self.on_chat_completion_request = on_chat_completion_request
@@ -200,7 +263,8 @@ class ChatGPTAPI:
     self.prev_token_lens: Dict[str, int] = {}
     self.stream_tasks: Dict[str, asyncio.Task] = {}
     self.default_model = default_model or "llama-3.2-1b"
-    self.token_queues = defaultdict(asyncio.Queue)
+    self.token_queues: Dict[str, asyncio.Queue] = RequestStore(default_factory=asyncio.Queue)
+    self.prompt_token_counts = PromptTokenCounts()
 
     # Get the callback system and register our handler
     self.token_callback = node.on_token.register("chatgpt-api-token-handler")
@@ -224,6 +288,7 @@ class ChatGPTAPI:
     cors.add(self.app.router.add_get("/v1/download/progress", self.handle_get_download_progress), {"*": cors_options})
     cors.add(self.app.router.add_get("/modelpool", self.handle_model_support), {"*": cors_options})
     cors.add(self.app.router.add_get("/healthcheck", self.handle_healthcheck), {"*": cors_options})
+    cors.add(self.app.router.add_get("/v1/stats", self.handle_get_stats), {"*": cors_options})
     cors.add(self.app.router.add_post("/quit", self.handle_quit), {"*": cors_options})
     cors.add(self.app.router.add_delete("/models/{model_name}", self.handle_delete_model), {"*": cors_options})
     cors.add(self.app.router.add_get("/initial_models", self.handle_get_initial_models), {"*": cors_options})
@@ -275,6 +340,15 @@ class ChatGPTAPI:
   async def handle_healthcheck(self, request):
     return web.json_response({"status": "ok"})
 
+  async def handle_get_stats(self, request):
+    return web.json_response({
+      "request_states": {**self.node.request_state_stats(), "token_queues": self.token_queues.stats()},
+      "admission": self.admission.stats(),
+      "status_bus": self.node.status_bus.stats(),
+      "inference_engine": self.node.inference_engine.stats(),
+      "tokenizers": tokenizer_cache.stats(),
+    })
+
   async def handle_model_support(self, request):
     try:
       response = web.StreamResponse(status=200, reason='OK', headers={
@@ -334,9 +408,10 @@ class ChatGPTAPI:
       model = self.default_model
     shard = build_base_shard(model, self.inference_engine_classname)
     messages = [parse_message(msg) for msg in data.get("messages", [])]
-    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname))
+    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname), self.inference_engine_classname)
     prompt = build_prompt(tokenizer, messages, data.get("tools", None))
     tokens = tokenizer.encode(prompt)
+    self.prompt_token_counts.put(shard.model_id, prompt, len(tokens))
     return web.json_response({
       "length": len(prompt),
       "num_tokens": len(tokens),
@@ -355,6 +430,22 @@ class ChatGPTAPI:
 
   async def handle_post_chat_completions(self, request):
     data = await request.json()
+    priority = data.get("priority", "interactive")
+    if priority not in PRIORITIES:
+      return web.json_response({"detail": f"Invalid priority: {priority}. Supported: {list(PRIORITIES)}"}, status=400)
+    try:
+      await asyncio.wait_for(self.admission.acquire(priority), timeout=self.response_timeout)
+    except QueueFull as e:
+      if DEBUG >= 1: print(f"[ChatGPTAPI] Rejecting request from {request.remote}: {e}")
+      return web.json_response({"detail": f"Too many requests: {e}"}, status=429, headers={"Retry-After": "1"})
+    except asyncio.TimeoutError:
+      return web.json_response({"detail": "Timed out waiting for a free slot"}, status=503, headers={"Retry-After": "1"})
+    try:
+      return await self.chat_completion(request, data)
+    finally:
+      self.admission.release()
+
+  async def chat_completion(self, request, data: dict):
     if DEBUG >= 2: print(f"[ChatGPTAPI] Handling chat completions request from {request.remote}: {data}")
     stream = data.get("stream", False)
     chat_request = parse_chat_request(data, self.default_model)
@@ -371,7 +462,7 @@ class ChatGPTAPI:
         status=400,
       )
 
-    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname))
+    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.inference_engine_classname), self.inference_engine_classname)
     if DEBUG >= 4: print(f"[ChatGPTAPI] Resolved tokenizer: {tokenizer}")
 
     # Add system prompt if set
@@ -379,6 +470,8 @@ class ChatGPTAPI:
       chat_request.messages.insert(0, Message("system", self.system_prompt))
 
     prompt = build_prompt(tokenizer, chat_request.messages, chat_request.tools)
+    # only non-streaming responses report usage, count the prompt once now instead of for every response
+    prompt_tokens = None if stream else self.prompt_token_counts.count(shard.model_id, prompt, tokenizer)
     request_id = str(uuid.uuid4())
     if self.on_chat_completion_request:
       try:
@@ -388,8 +481,10 @@ class ChatGPTAPI:
 
     if DEBUG >= 2: print(f"[ChatGPTAPI] Processing prompt: {request_id=} {shard=} {prompt=}")
 
+    is_finished = False
     try:
-      await asyncio.wait_for(asyncio.shield(asyncio.create_task(self.node.process_prompt(shard, prompt, request_id=request_id))), timeout=self.response_timeout)
+      inference_state = {"generation": chat_request.generation_params()}
+      await asyncio.wait_for(asyncio.shield(asyncio.create_task(self.node.process_prompt(shard, prompt, request_id=request_id, inference_state=inference_state))), timeout=self.response_timeout)
 
       if DEBUG >= 2: print(f"[ChatGPTAPI] Waiting for response to finish. timeout={self.response_timeout}s")
 
@@ -405,6 +500,9 @@ class ChatGPTAPI:
         await response.prepare(request)
 
         try:
+          generated = []
+          detokenizer = IncrementalDetokenizer(tokenizer)
+          stop_filter = StopStringFilter(chat_request.stop)
           # Stream tokens while waiting for inference to complete
           while True:
             if DEBUG >= 2: print(f"[ChatGPTAPI] Waiting for token from queue: {request_id=}")
@@ -413,21 +511,26 @@ class ChatGPTAPI:
               timeout=self.response_timeout
             )
             if DEBUG >= 2: print(f"[ChatGPTAPI] Got token from queue: {request_id=} {tokens=} {is_finished=}")
+            generated.extend(tokens)
+            content = stop_filter.feed(detokenizer.add(tokens))
+            if is_finished: content += stop_filter.feed(detokenizer.flush()) + stop_filter.flush()
 
             eos_token_id = None
             if not eos_token_id and hasattr(tokenizer, "eos_token_id"): eos_token_id = tokenizer.eos_token_id
             if not eos_token_id and hasattr(tokenizer, "_tokenizer"): eos_token_id = tokenizer.special_tokens_map.get("eos_token_id")
 
             finish_reason = None
-            if is_finished: finish_reason = "stop" if tokens[-1] == eos_token_id else "length"
-            if DEBUG >= 2: print(f"{eos_token_id=} {tokens[-1]=} {finish_reason=}")
+            if is_finished:
+              stopped = (generated and generated[-1] == eos_token_id) or stop_filter.stopped
+              finish_reason = "stop" if stopped else "length"
+            if DEBUG >= 2: print(f"{eos_token_id=} {generated[-1:]=} {finish_reason=}")
 
             completion = generate_completion(
               chat_request,
-              tokenizer,
-              prompt,
+              None,
               request_id,
               tokens,
+              content,
               stream,
               finish_reason,
               "chat.completion",
@@ -461,25 +564,35 @@ class ChatGPTAPI:
             del self.token_queues[request_id]
       else:
         tokens = []
+        detokenizer = IncrementalDetokenizer(tokenizer)
+        # decode while waiting for the next tokens instead of all at once at the end
+        chunks = []
         while True:
           _tokens, is_finished = await asyncio.wait_for(self.token_queues[request_id].get(), timeout=self.response_timeout)
           tokens.extend(_tokens)
+          chunks.append(detokenizer.add(_tokens))
           if is_finished:
             break
+        chunks.append(detokenizer.flush())
+        content, stopped = truncate_at_stop("".join(chunks), chat_request.stop)
         finish_reason = "length"
         eos_token_id = None
         if not eos_token_id and hasattr(tokenizer, "eos_token_id"): eos_token_id = tokenizer.eos_token_id
         if not eos_token_id and hasattr(tokenizer, "_tokenizer"): eos_token_id = tokenizer.special_tokens_map.get("eos_token_id")
-        if DEBUG >= 2: print(f"Checking if end of tokens result {tokens[-1]=} is {eos_token_id=}")
-        if tokens[-1] == eos_token_id:
+        if DEBUG >= 2: print(f"Checking if end of tokens result {tokens[-1:]=} is {eos_token_id=}")
+        if (tokens and tokens[-1] == eos_token_id) or stopped:
           finish_reason = "stop"
 
-        return web.json_response(generate_completion(chat_request, tokenizer, prompt, request_id, tokens, stream, finish_reason, "chat.completion"))
+        return web.json_response(generate_completion(chat_request, prompt_tokens, request_id, tokens, content, stream, finish_reason, "chat.completion"))
     except asyncio.TimeoutError:
       return web.json_response({"detail": "Response generation timed out"}, status=408)
     except Exception as e:
       if DEBUG >= 2: traceback.print_exc()
       return web.json_response({"detail": f"Error processing prompt (see logs with DEBUG>=2): {str(e)}"}, status=500)
+    finally:
+      if not is_finished:
+        # the client disconnected or we gave up on it, stop generating for it across the ring
+        asyncio.create_task(self.node.cancel(request_id))
 
   async def handle_post_image_generations(self, request):
     data = await request.json()
@@ -681,12 +794,20 @@ class ChatGPTAPI:
 
   async def handle_tokens(self, request_id: str, tokens: List[int], is_finished: bool):
     await self.token_queues[request_id].put((tokens, is_finished))
+    # queues of requests nobody waits for, e.g. ones this node only computed the last shard of, go after the ttl
+    if is_finished: self.token_queues.finish(request_id)
 
   async def run(self, host: str = "0.0.0.0", port: int = 52415):
     runner = web.AppRunner(self.app)
     await runner.setup()
     site = web.TCPSite(runner, host, port)
     await site.start()
+    asyncio.create_task(self.periodic_token_queue_sweep(10.0))
+
+  async def periodic_token_queue_sweep(self, interval: float):
+    while True:
+      await asyncio.sleep(interval)
+      self.token_queues.sweep()
 
   def base64_decode(self, base64_string):
     #decode and reshape image
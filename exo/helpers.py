@@ -204,6 +204,18 @@ def get_or_create_node_id():
     return str(uuid.uuid4())
 
 
+def get_host_id() -> str:
+  """Identifies the machine this process runs on, so co-located nodes can recognise each other."""
+  for path in ("/etc/machine-id", "/var/lib/dbus/machine-id"):
+    try:
+      with open(path, "r") as f:
+        machine_id = f.read().strip()
+      if machine_id: return f"{machine_id}-{platform.node()}"
+    except OSError:
+      pass
+  return f"{uuid.getnode():012x}-{platform.node()}"
+
+
 def pretty_print_bytes(size_in_bytes: int) -> str:
   if size_in_bytes < 1024:
     return f"{size_in_bytes} B"
@@ -0,0 +1,33 @@
+from typing import List
+
+
+class IncrementalDetokenizer:
+  """
+  Turns a stream of token ids into a stream of text without decoding the whole sequence every step. Only the
+  tokens since the last emitted text are decoded, together with a few before them so merges across the
+  boundary (sentencepiece spaces, byte fallback, multi-byte characters) come out as they would in a full
+  decode. Text ending in an incomplete character is held back until the bytes that complete it arrive.
+  """
+  def __init__(self, tokenizer):
+    self.tokenizer = tokenizer
+    self.tokens: List[int] = []
+    # tokens[prefix_offset:read_offset] is the context decoded with the new tokens, tokens[read_offset:] are not emitted yet
+    self.prefix_offset = 0
+    self.read_offset = 0
+
+  def add(self, tokens: List[int]) -> str:
+    """Adds tokens and returns the text they complete, possibly empty."""
+    self.tokens.extend(int(token) for token in tokens)
+    prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset])
+    text = self.tokenizer.decode(self.tokens[self.prefix_offset:])
+    if len(text) <= len(prefix_text) or text.endswith("�"): return ""
+    self.prefix_offset, self.read_offset = self.read_offset, len(self.tokens)
+    return text[len(prefix_text):]
+
+  def flush(self) -> str:
+    """Returns the text still held back, e.g. once generation ends in the middle of a character."""
+    if self.read_offset == len(self.tokens): return ""
+    prefix_text = self.tokenizer.decode(self.tokens[self.prefix_offset:self.read_offset])
+    text = self.tokenizer.decode(self.tokens[self.prefix_offset:])
+    self.prefix_offset, self.read_offset = self.read_offset, len(self.tokens)
+    return text[len(prefix_text):]
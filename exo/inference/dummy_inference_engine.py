@@ -1,4 +1,4 @@
-from typing import Optional, Tuple, TYPE_CHECKING
+from typing import Optional, Tuple, List, TYPE_CHECKING
 import numpy as np
 from exo.inference.inference_engine import InferenceEngine
 from exo.inference.shard import Shard
@@ -29,6 +29,15 @@ class DummyInferenceEngine(InferenceEngine):
     await self.ensure_shard(shard)
     return input_data + 1 if self.shard.is_last_layer() else input_data, None
 
+  async def trim_cache(self, request_id: str, n: int) -> None:
+    pass
+
+  async def infer_tensor_batch(self, request_ids: List[str], shard: Shard, input_datas: List[np.ndarray], inference_states: List[Optional[dict]]) -> List[tuple[np.ndarray, Optional[dict]]]:
+    if len({x.shape for x in input_datas}) > 1:
+      return await super().infer_tensor_batch(request_ids, shard, input_datas, inference_states)
+    output_data, _ = await self.infer_tensor(request_ids[0], shard, np.concatenate(input_datas, axis=0))
+    return [(output_data[i:i + 1], None) for i in range(len(input_datas))]
+
   async def ensure_shard(self, shard: Shard):
     if self.shard == shard: return
     self.shard = shard
@@ -2,7 +2,7 @@ import numpy as np
 import os
 from exo.helpers import DEBUG  # Make sure to import DEBUG
 
-from typing import Tuple, Optional
+from typing import Tuple, Optional, List
 from abc import ABC, abstractmethod
 from .shard import Shard
 from exo.download.shard_download import ShardDownloader
@@ -25,8 +25,26 @@ class InferenceEngine(ABC):
 
   @abstractmethod
   async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> tuple[np.ndarray, Optional[dict]]:
+    # input_data received from a peer is a read-only view of the message, upload it to the device once and never write to it.
     pass
 
+  async def infer_tensor_batch(self, request_ids: List[str], shard: Shard, input_datas: List[np.ndarray], inference_states: List[Optional[dict]]) -> List[tuple[np.ndarray, Optional[dict]]]:
+    # Engines that can run several requests in one forward pass override this. The default runs them one after another,
+    # and BatchScheduler does not hold requests back for engines that keep it.
+    return [await self.infer_tensor(request_id, shard, input_data, inference_state) for request_id, input_data, inference_state in zip(request_ids, input_datas, inference_states)]
+
+  async def cached_prefix_length(self, shard: Shard, tokens: np.ndarray) -> int:
+    # How many leading tokens of a prompt the engine's prefix cache holds, the node pipelines only the rest. Engines without one hold none.
+    return 0
+
+  async def evict_request(self, request_id: str) -> None:
+    # Frees whatever the engine keeps for a request, e.g. its kv cache once the request is cancelled. Engines without per-request state have nothing to do.
+    pass
+
+  async def trim_cache(self, request_id: str, n: int) -> None:
+    # Drops the last n positions of a request's kv cache, e.g. draft tokens that speculative decoding rejected.
+    raise NotImplementedError(f"{self.__class__.__name__} cannot trim kv caches")
+
   @abstractmethod
   async def load_checkpoint(self, shard: Shard, path: str):
     pass
@@ -34,6 +52,9 @@ class InferenceEngine(ABC):
   async def save_checkpoint(self, shard: Shard, path: str):
     pass
 
+  def stats(self) -> dict:
+    return {}
+
   async def save_session(self, key, value):
     self.session[key] = value
 
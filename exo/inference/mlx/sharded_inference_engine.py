@@ -5,20 +5,49 @@ from mlx_lm.sample_utils import top_p_sampling, make_sampler
 import mlx.optimizers as optim
 from ..inference_engine import InferenceEngine
 from .sharded_utils import load_shard, get_image_from_str
+from .models.base import IdentityBlock
 from .losses import loss_fns
 from ..shard import Shard
-from typing import Dict, Optional, Tuple
+from typing import Any, Dict, Optional, Tuple, List
 from exo.download.shard_download import ShardDownloader
+from exo.helpers import DEBUG
 import asyncio
+import os
 from collections import OrderedDict
-from mlx_lm.models.cache import make_prompt_cache
+from mlx_lm.models.cache import make_prompt_cache, trim_prompt_cache, KVCache
+from ..prefix_cache import PrefixCache, PrefixCacheMiss, prefix_key
+from ..model_cache import ModelCache, model_cache_budget
+from exo.topology.device_capabilities import device_capabilities
 from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from mlx.utils import tree_flatten
+
+# Number of requests a loaded shard keeps a kv cache for, at least as many as generate at once on every node sending requests through
+# this one (--max-concurrent-requests). the least recently used request loses its cache, and fails, beyond that
+MAX_KV_CACHES = int(os.getenv("MLX_MAX_KV_CACHES", 16))
+# Number of evicted requests remembered, so their next step fails instead of starting over from an empty cache
+MAX_EVICTED_REQUESTS = 1024
+
+
+@dataclass
+class LoadedShard:
+  model: nn.Module
+  tokenizer: Any
+  caches: OrderedDict = field(default_factory=OrderedDict)
+  prefix_cache: PrefixCache = field(default_factory=PrefixCache)
+  session: dict = field(default_factory=dict)
+
 
 class MLXDynamicShardInferenceEngine(InferenceEngine):
   def __init__(self, shard_downloader: ShardDownloader):
     self.shard = None
     self.shard_downloader = shard_downloader
     self.caches = OrderedDict()
+    self.prefix_cache = PrefixCache()
+    # loaded shards, the budget is set from the device's memory when the first one is loaded
+    self.model_cache = ModelCache(max_bytes=None, on_evict=lambda shard, loaded: self.mark_evicted(loaded.caches))
+    # requests whose kv cache was dropped with their shard, their next step fails instead of starting over from an empty cache
+    self.evicted = OrderedDict()
     self.sampler_params: tuple[float, float] = (0.0, 0.0, 0.0, 1)
     self.sampler = make_sampler(*self.sampler_params)
     self._mlx_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mlx")
@@ -28,16 +57,35 @@ class MLXDynamicShardInferenceEngine(InferenceEngine):
   async def _eval_mlx(self, *args):
     await asyncio.get_running_loop().run_in_executor(self._mlx_thread, mx.eval, *args)
 
-  async def poll_state(self, request_id: str, max_caches=2):
+  def make_cache(self, model) -> list:
+    # layers outside the shard never touch their cache, but the attention mask takes the offset of the first one. they share the
+    # cache of the shard's first layer, so a prompt that continues a cache (a restored prefix, the next chunk) is masked right
+    cache = make_prompt_cache(model)
+    first = next((i for i, layer in enumerate(model.layers) if not isinstance(layer, IdentityBlock)), None)
+    if first is None: return cache
+    return [c if not isinstance(layer, IdentityBlock) else cache[first] for layer, c in zip(model.layers, cache)]
+
+  def mark_evicted(self, request_ids) -> None:
+    for request_id in list(request_ids):
+      self.evicted[request_id] = None
+      self.evicted.move_to_end(request_id)
+    while len(self.evicted) > MAX_EVICTED_REQUESTS: self.evicted.popitem(last=False)
+
+  async def poll_state(self, request_id: str, max_caches: int = MAX_KV_CACHES):
     if request_id in self.caches:
       self.caches.move_to_end(request_id)
     else:
-      newcache = make_prompt_cache(self.model)
-      if len(self.caches) > max_caches:
-        self.caches.popitem(last=False)
+      newcache = self.make_cache(self.model)
+      if len(self.caches) >= max_caches:
+        evicted, _ = self.caches.popitem(last=False)
+        self.mark_evicted([evicted])
+        if DEBUG >= 1: print(f"Evicted the kv cache of request_id={evicted!r} to make room for {request_id=}, raise MLX_MAX_KV_CACHES to keep more")
       self.caches[request_id] = newcache
     return {"cache": self.caches[request_id]}
 
+  def stats(self) -> dict:
+    return {"prefix_cache": self.prefix_cache.stats(), "model_cache": self.model_cache.stats()}
+
   async def sample(self, x: np.ndarray, temp: float = 0.0, top_p: float = 1.0) -> np.ndarray:
     if (temp, top_p, 0.0, 1) != self.sampler_params:
       self.sampler_params = (temp, top_p, 0.0, 1)
@@ -50,52 +98,123 @@ class MLXDynamicShardInferenceEngine(InferenceEngine):
     return np.asarray(result, dtype=int)
 
   async def encode(self, shard: Shard, prompt: str) -> np.ndarray:
-    await self.ensure_shard(shard)
+    loaded = await self.ensure_shard(shard)
     return np.asarray(
       await asyncio.get_running_loop().run_in_executor(
         self._tokenizer_thread,
-        self.tokenizer.encode,
+        loaded.tokenizer.encode,
         prompt
       )
     )
 
   async def decode(self, shard: Shard, tokens) -> str:
-    await self.ensure_shard(shard)
+    loaded = await self.ensure_shard(shard)
     return await asyncio.get_running_loop().run_in_executor(
       self._tokenizer_thread,
-      self.tokenizer.decode,
+      loaded.tokenizer.decode,
       tokens
     )
 
   async def save_checkpoint(self, shard: Shard, path: str):
-    await self.ensure_shard(shard)
-    await asyncio.get_running_loop().run_in_executor(self._mlx_thread, lambda: self.model.save_weights(path))
+    loaded = await self.ensure_shard(shard)
+    await asyncio.get_running_loop().run_in_executor(self._mlx_thread, lambda: loaded.model.save_weights(path))
 
   async def load_checkpoint(self, shard: Shard, path: str):
-    await self.ensure_shard(shard)
-    await asyncio.get_running_loop().run_in_executor(self._mlx_thread, lambda: self.model.load_weights(path))
+    loaded = await self.ensure_shard(shard)
+    await asyncio.get_running_loop().run_in_executor(self._mlx_thread, lambda: loaded.model.load_weights(path))
 
-  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> tuple[np.ndarray, Optional[dict]]:
-    await self.ensure_shard(shard)
-    state = await self.poll_state(request_id) if self.model.model_type != 'StableDiffusionPipeline' else {}
-    x = mx.array(input_data)
+  def restore_prefix(self, shard: Shard, cache: list, input_data: np.ndarray, prefix: Optional[dict]) -> Tuple[Optional[dict], np.ndarray]:
+    # a new request's prefill: reuse the KV cache of the longest cached prompt it starts with
+    if not all(type(c) is KVCache for c in cache): return None, input_data
+    if shard.is_first_layer() and prefix is not None and prefix.get("restart"):
+      # a restarted prompt goes through every shard without the prefix cache, it is only stored again
+      return {"store": prefix_key(input_data[0]), "restart": True}, input_data
+    if shard.is_first_layer():
+      length, key, snapshot = self.prefix_cache.lookup(input_data[0])
+      # a prompt prefilled chunk by chunk is stored after its last chunk, the node passes store=None and the whole prompt with the first
+      prompt = prefix["tokens"] if prefix is not None and "tokens" in prefix else input_data[0].tolist()
+      prefix = {"store": prefix["store"] if prefix is not None and "store" in prefix else prefix_key(input_data[0])}
+      if length > 0:
+        # a later shard that misses the entry hands the prompt back to be prefilled again
+        prefix.update(key=key, length=length, tokens=prompt)
+        input_data = input_data[:, length:]
+    elif prefix is not None and prefix.get("length"):
+      length, snapshot = prefix["length"], self.prefix_cache.get(prefix["key"])
+      if snapshot is None: raise PrefixCacheMiss(prefix["key"], prefix.get("tokens"))
+    else:
+      return prefix, input_data
+    if prefix.get("length"):
+      # mlx arrays are never written in place by KVCache, so restored caches can share the snapshot's arrays
+      for c, (keys, values) in zip(cache, snapshot):
+        c.state = (keys[..., :length, :], values[..., :length, :])
+    return prefix, input_data
 
-    if self.model.model_type != 'StableDiffusionPipeline':
-      output_data = await asyncio.get_running_loop().run_in_executor(
-        self._mlx_thread,
-        lambda: self.model(x, **state, **(inference_state or {}))
-      )
-      inference_state = None
+  def store_prefix(self, prefix_cache: PrefixCache, cache: list, tokens: Optional[np.ndarray], prefix: dict):
+    snapshot = [c.state for c in cache]
+    mx.eval(snapshot)
+    prefix_cache.insert(prefix["store"], snapshot, tokens)
+
+  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> tuple[np.ndarray, Optional[dict]]:
+    loaded = await self.ensure_shard(shard)
+    # the mlx thread runs this after calls queued for other shards, which may have activated another one by then
+    model, prefix_cache = loaded.model, loaded.prefix_cache
+    if model.model_type != 'StableDiffusionPipeline':
+      inference_state = dict(inference_state or {})
+      prefix = inference_state.pop("prefix_cache", None)
+      # a later shard missed the prefix this request was restored from, its prompt is prefilled again from scratch
+      if prefix is not None and prefix.get("restart"):
+        loaded.caches.pop(request_id, None)
+        self.evicted.pop(request_id, None)
+      is_prefill = request_id not in loaded.caches
+      if is_prefill and request_id in self.evicted: raise RuntimeError(f"kv cache of {request_id=} was evicted mid-generation")
+      state = await self.poll_state(request_id)
+      tokens = input_data[0] if is_prefill and shard.is_first_layer() else None
+      if is_prefill:
+        prefix, input_data = self.restore_prefix(shard, state["cache"], input_data, prefix)
+      elif prefix is not None and all(type(c) is KVCache for c in state["cache"]):
+        # the last chunk of a prompt prefilled chunk by chunk, the first shard gets the whole prompt to index the snapshot by
+        prefix = dict(prefix)
+        if "tokens" in prefix: tokens = np.asarray(prefix.pop("tokens"))
+      else:
+        prefix = None
+      x = mx.array(input_data)
+      def infer():
+        output = model(x, **state, **inference_state)
+        if prefix is not None and prefix.get("store"):
+          mx.eval(output)
+          self.store_prefix(prefix_cache, state["cache"], tokens, prefix)
+        return output
+      output_data = await asyncio.get_running_loop().run_in_executor(self._mlx_thread, infer)
+      inference_state = {"prefix_cache": prefix} if prefix is not None and not shard.is_last_layer() else None
     else:
+      state = {}
+      x = mx.array(input_data)
       result = await asyncio.get_running_loop().run_in_executor(
         self._mlx_thread,
-        lambda: self.model(x, **state, **(inference_state or {}))
+        lambda: model(x, **state, **(inference_state or {}))
       )
       output_data, inference_state = result
 
     output_data = np.array(output_data, copy=False)
     return output_data, inference_state
 
+  async def cached_prefix_length(self, shard: Shard, tokens: np.ndarray) -> int:
+    loaded = await self.ensure_shard(shard)
+    return await asyncio.get_running_loop().run_in_executor(self._mlx_thread, lambda: loaded.prefix_cache.match(tokens)[0])
+
+  async def evict_request(self, request_id: str) -> None:
+    # the request lives in whichever loaded shard it ran on
+    for loaded in self.model_cache.entries.values():
+      loaded.caches.pop(request_id, None)
+    self.evicted.pop(request_id, None)
+
+  async def trim_cache(self, request_id: str, n: int) -> None:
+    cache = next((loaded.caches[request_id] for loaded in self.model_cache.entries.values() if request_id in loaded.caches), None)
+    if cache is None: return
+    # layers outside the shard share a cache, which must only be trimmed once
+    trimmed = await asyncio.get_running_loop().run_in_executor(self._mlx_thread, trim_prompt_cache, list({id(c): c for c in cache}.values()), n)
+    if trimmed != n: raise RuntimeError(f"Could only trim {trimmed} of {n} positions from the cache of {request_id=}")
+
   async def evaluate(self, request_id: str, shard: Shard, inputs, targets, lengths, loss: str = "length_masked_ce"):
     await self.ensure_shard(shard)
     await self.save_session('loss', loss_fns[loss])
@@ -152,16 +271,26 @@ class MLXDynamicShardInferenceEngine(InferenceEngine):
     await self._eval_mlx(first_layer)
     return score, first_layer
 
-  async def ensure_shard(self, shard: Shard):
-    if self.shard == shard:
-      return
+  def activate(self, shard: Shard, loaded: LoadedShard) -> LoadedShard:
+    self.shard, self.model, self.tokenizer = shard, loaded.model, loaded.tokenizer
+    self.caches, self.prefix_cache, self.session = loaded.caches, loaded.prefix_cache, loaded.session
+    return loaded
+
+  async def ensure_shard(self, shard: Shard) -> LoadedShard:
+    loaded = self.model_cache.get(shard)
+    if loaded is not None: return self.activate(shard, loaded)
     model_path = await self.shard_downloader.ensure_shard(shard, self.__class__.__name__)
-    if self.shard != shard:
-      model_shard, self.tokenizer = await load_shard(model_path, shard)
-      self.shard = shard
-      self.model = model_shard
-      self.caches = OrderedDict()
-      self.session = {}
+    # another request may have loaded it during the download
+    loaded = self.model_cache.get(shard)
+    if loaded is None:
+      if self.model_cache.max_bytes is None: self.model_cache.max_bytes = model_cache_budget((await device_capabilities()).memory)
+      donor = self.model_cache.overlapping(shard)
+      model_shard, tokenizer = await load_shard(model_path, shard, donor=None if donor is None else donor[1].model)
+      loaded = LoadedShard(model_shard, tokenizer)
+      # evicted shards' weights are freed once their in-flight calls, which hold the model, finish
+      self.model_cache.put(shard, loaded, sum(v.nbytes for _, v in tree_flatten(model_shard.parameters())))
+      if DEBUG >= 1: print(f"Loaded {shard}, model cache: {self.model_cache.stats()}")
+    return self.activate(shard, loaded)
 
   async def cleanup(self):
     self._mlx_thread.shutdown(wait=True)
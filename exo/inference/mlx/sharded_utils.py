@@ -16,12 +16,14 @@ import traceback
 
 import mlx.core as mx
 import mlx.nn as nn
+from mlx.utils import tree_flatten
 from transformers import AutoProcessor
 
 from mlx_lm.tokenizer_utils import load_tokenizer, TokenizerWrapper
 
 from exo import DEBUG
 from exo.inference.tokenizers import resolve_tokenizer
+from exo.models import get_repo
 from ..shard import Shard
 
 
@@ -82,6 +84,7 @@ def load_model_shard(
   shard: Shard,
   lazy: bool = False,
   model_config: dict = {},
+  donor: Optional[nn.Module] = None,
 ) -> nn.Module:
   """
   Load and initialize the model from a given path.
@@ -93,6 +96,8 @@ def load_model_shard(
     when needed. Default: ``False``
    model_config(dict, optional): Configuration parameters for the model.
     Defaults to an empty dictionary.
+   donor (nn.Module, optional): A loaded shard of the same model whose
+    layers the new shard shares instead of loading them again.
 
   Returns:
    nn.Module: The loaded and initialized model.
@@ -176,6 +181,12 @@ def load_model_shard(
       class_predicate=class_predicate,
     )
 
+  if donor is not None:
+    # mlx arrays are immutable, so both shards can hold the same layer arrays and the lazily loaded copies are never read
+    shared = {k: v for k, v in tree_flatten(donor.parameters()) if ".layers." in f".{k}" and k in weights}
+    if DEBUG >= 2: print(f"Reusing {len(shared)} layer weights of {donor.shard} for {shard}")
+    weights.update(shared)
+
   model.load_weights(list(weights.items()), strict=True)
 
   if not lazy:
@@ -191,8 +202,9 @@ async def load_shard(
   model_config={},
   adapter_path: Optional[str] = None,
   lazy: bool = False,
+  donor: Optional[nn.Module] = None,
 ) -> Tuple[nn.Module, TokenizerWrapper]:
-  model = load_model_shard(model_path, shard, lazy, model_config)
+  model = load_model_shard(model_path, shard, lazy, model_config, donor)
 
   # TODO: figure out a generic solution
   if model.model_type == "llava":
@@ -204,7 +216,7 @@ async def load_shard(
     tokenizer = model.tokenizer
     return model, tokenizer
   else:
-    tokenizer = await resolve_tokenizer(model_path)
+    tokenizer = await resolve_tokenizer(get_repo(shard.model_id, "MLXDynamicShardInferenceEngine") or model_path, "MLXDynamicShardInferenceEngine", local_path=model_path)
     return model, tokenizer
 
 
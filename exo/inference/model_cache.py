@@ -0,0 +1,75 @@
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+from .shard import Shard
+
+# Share of the device memory the weights of all shards an engine keeps loaded may take up
+MODEL_CACHE_MEMORY_FRACTION = float(os.getenv("MODEL_CACHE_MEMORY_FRACTION", 0.6))
+
+
+def model_cache_budget(memory_mb: int) -> int:
+  """Bytes of weights an engine may keep loaded on a device with memory_mb of memory, 0 if that is unknown."""
+  return int(memory_mb*2**20*MODEL_CACHE_MEMORY_FRACTION)
+
+
+def layer_overlap(a: Shard, b: Shard) -> int:
+  if a.model_id != b.model_id or a.n_layers != b.n_layers: return 0
+  return max(0, min(a.end_layer, b.end_layer) - max(a.start_layer, b.start_layer) + 1)
+
+
+class ModelCache:
+  """
+  Shards an inference engine keeps loaded, least recently used first, so switching between models or back
+  to an earlier partition does not reload the weights from disk. Shards are evicted once their weights
+  take more than max_bytes together, but the shard loaded last always stays. A max_bytes of 0 keeps
+  only that one, like an engine without a cache, None keeps every shard until a budget is set.
+  """
+  def __init__(self, max_bytes: Optional[int] = 0, on_evict: Optional[Callable[[Shard, Any], None]] = None):
+    self.max_bytes = max_bytes
+    self.on_evict = on_evict
+    self.entries: OrderedDict[Shard, Any] = OrderedDict()
+    self.sizes: Dict[Shard, int] = {}
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def __contains__(self, shard: Shard) -> bool:
+    return shard in self.entries
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  @property
+  def nbytes(self) -> int:
+    return sum(self.sizes.values())
+
+  def get(self, shard: Shard) -> Optional[Any]:
+    if shard not in self.entries:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.entries.move_to_end(shard)
+    return self.entries[shard]
+
+  def put(self, shard: Shard, entry: Any, nbytes: int) -> None:
+    self.entries[shard] = entry
+    self.entries.move_to_end(shard)
+    self.sizes[shard] = nbytes
+    while self.max_bytes is not None and len(self.entries) > 1 and (self.max_bytes <= 0 or self.nbytes > self.max_bytes):
+      victim, victim_entry = self.entries.popitem(last=False)
+      del self.sizes[victim]
+      self.evictions += 1
+      if self.on_evict is not None: self.on_evict(victim, victim_entry)
+
+  def overlapping(self, shard: Shard) -> Optional[Tuple[Shard, Any]]:
+    """The loaded shard of the same model sharing the most layers with shard, whose weights can be reused for them."""
+    best = max(self.entries, key=lambda cached: layer_overlap(cached, shard), default=None)
+    if best is None or layer_overlap(best, shard) == 0: return None
+    return best, self.entries[best]
+
+  def clear(self) -> None:
+    self.entries.clear()
+    self.sizes.clear()
+
+  def stats(self) -> dict:
+    return {"shards": len(self.entries), "bytes": self.nbytes, "max_bytes": self.max_bytes, "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
@@ -0,0 +1,157 @@
+import hashlib
+import numpy as np
+from collections import OrderedDict
+from typing import Any, Callable, Collection, Dict, Optional, Sequence, Tuple
+
+
+def prefix_key(tokens: Sequence[int]) -> str:
+  return hashlib.sha1(np.asarray(tokens, dtype=np.int64).tobytes()).hexdigest()
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+  n = min(len(a), len(b))
+  for i in range(n):
+    if a[i] != b[i]: return i
+  return n
+
+
+class PrefixCacheMiss(Exception):
+  """
+  A shard does not have the prefix cache entry the first shard matched, e.g. it was evicted there or the
+  node restarted. tokens is the whole prompt, which has to be prefilled again without the prefix cache.
+  """
+  def __init__(self, key: str, tokens: Optional[Sequence[int]]):
+    super().__init__(f"Prefix cache entry {key} matched by the first shard is not cached here")
+    self.key = key
+    self.tokens = tokens
+
+
+class RadixNode:
+  __slots__ = ("edge", "children", "keys")
+
+  def __init__(self, edge: Tuple[int, ...] = ()):
+    self.edge = edge
+    self.children: Dict[int, "RadixNode"] = {}
+    # keys of the entries whose tokens pass through this node
+    self.keys = set()
+
+
+class PrefixCache:
+  """
+  Prefix (prompt) cache shared by all requests on an inference engine.
+
+  Entries are snapshots of the KV cache taken right after a prompt was prefilled, indexed by a radix tree
+  over the prompt tokens. A new request looks up the longest prefix it shares with any cached prompt,
+  restores that many positions from the snapshot and only prefills the rest. Every entry is also addressable
+  by its key (a digest of its tokens), which is how shards that only ever see hidden states find the
+  snapshot the first shard matched. Entries are evicted least recently used beyond max_entries.
+  """
+  def __init__(self, max_entries: int = 8, on_evict: Optional[Callable[[Any], None]] = None):
+    self.max_entries = max_entries
+    self.on_evict = on_evict
+    self.root = RadixNode()
+    self.entries: OrderedDict[str, Tuple[Optional[Tuple[int, ...]], Any]] = OrderedDict()
+    self.lookups = 0
+    self.hits = 0
+    self.lookup_tokens = 0
+    self.hit_tokens = 0
+
+  def match(self, tokens: Sequence[int]) -> Tuple[int, Optional[str]]:
+    """Returns the length of the longest cached prefix of tokens and the key of an entry that shares it."""
+    tokens = tuple(int(t) for t in tokens)
+    node, matched, key = self.root, 0, None
+    while matched < len(tokens):
+      child = node.children.get(tokens[matched])
+      if child is None: break
+      n = common_prefix_length(child.edge, tokens[matched:])
+      matched += n
+      # every entry under child shares the matched tokens, prefer the most recently used one
+      key = next(k for k in reversed(self.entries) if k in child.keys)
+      if n < len(child.edge): break
+      node = child
+    return matched, key
+
+  def lookup(self, tokens: Sequence[int]) -> Tuple[int, Optional[str], Any]:
+    length, key = self.match(tokens)
+    # at least the last token has to go through the model to produce logits
+    length = min(length, len(tokens) - 1)
+    self.lookups += 1
+    self.lookup_tokens += len(tokens)
+    if key is None or length <= 0: return 0, None, None
+    self.hits += 1
+    self.hit_tokens += length
+    self.entries.move_to_end(key)
+    return length, key, self.entries[key][1]
+
+  def get(self, key: str) -> Any:
+    if key not in self.entries: return None
+    self.entries.move_to_end(key)
+    return self.entries[key][1]
+
+  def insert(self, key: str, value: Any, tokens: Optional[Sequence[int]] = None) -> None:
+    if key in self.entries:
+      # same key, same tokens: the snapshot we already have is just as good
+      self.entries.move_to_end(key)
+      return
+    tokens = None if tokens is None else tuple(int(t) for t in tokens)
+    self.entries[key] = (tokens, value)
+    if tokens is not None: self._insert_tokens(key, tokens)
+    while len(self.entries) > self.max_entries:
+      self._evict(next(iter(self.entries)))
+
+  def evict_oldest(self, keep: Collection[str] = ()) -> bool:
+    key = next((k for k in self.entries if k not in keep), None)
+    if key is None: return False
+    self._evict(key)
+    return True
+
+  def clear(self) -> None:
+    while self.evict_oldest():
+      pass
+
+  def _evict(self, key: str) -> None:
+    tokens, value = self.entries.pop(key)
+    if tokens is not None: self._remove_tokens(key, tokens)
+    if self.on_evict is not None: self.on_evict(value)
+
+  def _insert_tokens(self, key: str, tokens: Tuple[int, ...]) -> None:
+    node, i = self.root, 0
+    while i < len(tokens):
+      child = node.children.get(tokens[i])
+      if child is None:
+        child = RadixNode(tokens[i:])
+        node.children[tokens[i]] = child
+        child.keys.add(key)
+        return
+      n = common_prefix_length(child.edge, tokens[i:])
+      if n < len(child.edge):
+        # split the edge where the new tokens diverge
+        parent = RadixNode(child.edge[:n])
+        parent.keys = set(child.keys)
+        child.edge = child.edge[n:]
+        parent.children[child.edge[0]] = child
+        node.children[tokens[i]] = parent
+        child = parent
+      child.keys.add(key)
+      node, i = child, i + n
+
+  def _remove_tokens(self, key: str, tokens: Tuple[int, ...]) -> None:
+    node, i = self.root, 0
+    while i < len(tokens):
+      child = node.children[tokens[i]]
+      child.keys.discard(key)
+      if not child.keys:
+        del node.children[tokens[i]]
+        return
+      node, i = child, i + len(child.edge)
+
+  def stats(self) -> dict:
+    return {
+      "entries": len(self.entries),
+      "lookups": self.lookups,
+      "hits": self.hits,
+      "hit_rate": self.hits/self.lookups if self.lookups else 0.0,
+      "lookup_tokens": self.lookup_tokens,
+      "hit_tokens": self.hit_tokens,
+      "token_hit_rate": self.hit_tokens/self.lookup_tokens if self.lookup_tokens else 0.0,
+    }
@@ -0,0 +1,62 @@
+import unittest
+from exo.inference.detokenizer import IncrementalDetokenizer
+
+
+class ByteTokenizer:
+  """Every token is one byte of utf-8, like byte fallback tokens."""
+  def __init__(self):
+    self.decoded = 0
+
+  def decode(self, tokens):
+    self.decoded += len(tokens)
+    return bytes(tokens).decode("utf-8", errors="replace")
+
+
+class PieceTokenizer:
+  """Sentencepiece style: a space is part of the next piece, and the one at the start of the text is dropped."""
+  pieces = ["▁Hello", ",", "▁wor", "ld", "!", "▁"]
+
+  def decode(self, tokens):
+    text = "".join(self.pieces[t] for t in tokens).replace("▁", " ")
+    return text[1:] if text.startswith(" ") else text
+
+
+class TestIncrementalDetokenizer(unittest.TestCase):
+  def test_multi_byte_characters_wait_for_all_their_bytes(self):
+    tokenizer = ByteTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    tokens = list("añ€😀!".encode())
+    deltas = [detokenizer.add([token]) for token in tokens]
+    self.assertEqual("".join(deltas), "añ€😀!")
+    self.assertNotIn("�", "".join(deltas))
+    self.assertEqual(deltas[:3], ["a", "", "ñ"])
+
+  def test_pieces_merge_like_a_full_decode(self):
+    tokenizer = PieceTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    tokens = [0, 1, 2, 3, 4, 5, 0]
+    text = "".join(detokenizer.add([token]) for token in tokens) + detokenizer.flush()
+    self.assertEqual(text, tokenizer.decode(tokens))
+
+  def test_several_tokens_at_once(self):
+    tokenizer = PieceTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    self.assertEqual(detokenizer.add([0, 1]) + detokenizer.add([2, 3, 4]), "Hello, world!")
+
+  def test_flush_returns_incomplete_characters(self):
+    detokenizer = IncrementalDetokenizer(ByteTokenizer())
+    self.assertEqual(detokenizer.add([ord("a")]), "a")
+    self.assertEqual(detokenizer.add(list("€".encode())[:1]), "")
+    self.assertEqual(detokenizer.flush(), "�")
+    self.assertEqual(detokenizer.flush(), "")
+
+  def test_decoding_cost_does_not_grow_with_the_output(self):
+    tokenizer = ByteTokenizer()
+    detokenizer = IncrementalDetokenizer(tokenizer)
+    for _ in range(1000):
+      detokenizer.add([ord("a")])
+    self.assertLess(tokenizer.decoded, 4*1000)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+from exo.inference.model_cache import ModelCache, layer_overlap
+from exo.inference.shard import Shard
+
+FIRST = Shard("llama-3.2-1b", 0, 7, 16)
+LAST = Shard("llama-3.2-1b", 8, 15, 16)
+FULL = Shard("llama-3.2-1b", 0, 15, 16)
+OTHER = Shard("llama-3.2-3b", 0, 27, 28)
+
+
+class TestModelCache(unittest.TestCase):
+  def test_least_recently_used_shards_are_evicted_over_budget(self):
+    evicted = []
+    cache = ModelCache(max_bytes=250, on_evict=lambda shard, entry: evicted.append(entry))
+    cache.put(FIRST, "first", 100)
+    cache.put(LAST, "last", 100)
+    self.assertEqual(cache.get(FIRST), "first")
+    cache.put(OTHER, "other", 100)
+
+    self.assertEqual(evicted, ["last"])
+    self.assertEqual(list(cache.entries), [FIRST, OTHER])
+    self.assertIsNone(cache.get(LAST))
+    self.assertEqual(cache.stats(), {"shards": 2, "bytes": 200, "max_bytes": 250, "hits": 1, "misses": 1, "evictions": 1})
+
+  def test_the_last_shard_stays_even_over_budget(self):
+    cache = ModelCache(max_bytes=50)
+    cache.put(FIRST, "first", 100)
+    cache.put(LAST, "last", 100)
+    self.assertEqual(list(cache.entries), [LAST])
+
+  def test_no_budget_keeps_one_shard(self):
+    cache = ModelCache(max_bytes=0)
+    cache.put(FIRST, "first", 1)
+    cache.put(LAST, "last", 1)
+    self.assertEqual(list(cache.entries), [LAST])
+
+  def test_unknown_budget_keeps_every_shard(self):
+    cache = ModelCache(max_bytes=None)
+    for shard in [FIRST, LAST, OTHER]: cache.put(shard, shard, 2**40)
+    self.assertEqual(len(cache), 3)
+
+  def test_overlapping_shards_of_the_same_model(self):
+    cache = ModelCache(max_bytes=None)
+    self.assertIsNone(cache.overlapping(FULL))
+    cache.put(OTHER, "other", 1)
+    cache.put(FIRST, "first", 1)
+    self.assertEqual(cache.overlapping(Shard("llama-3.2-1b", 4, 11, 16)), (FIRST, "first"))
+    self.assertIsNone(cache.overlapping(LAST))
+    self.assertEqual(layer_overlap(FULL, LAST), 8)
+    self.assertEqual(layer_overlap(FIRST, Shard("llama-3.2-1b", 0, 7, 32)), 0)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from exo.inference.prefix_cache import PrefixCache, prefix_key
+
+
+class TestPrefixCache(unittest.TestCase):
+  def test_longest_shared_prefix(self):
+    cache = PrefixCache()
+    cache.insert(prefix_key([1, 2, 3, 4]), "a", [1, 2, 3, 4])
+    cache.insert(prefix_key([1, 2, 5]), "b", [1, 2, 5])
+
+    self.assertEqual(cache.lookup([1, 2, 3, 4, 9]), (4, prefix_key([1, 2, 3, 4]), "a"))
+    self.assertEqual(cache.lookup([1, 2, 5, 6]), (3, prefix_key([1, 2, 5]), "b"))
+    # diverging in the middle of a cached prompt still reuses the shared part
+    self.assertEqual(cache.lookup([1, 2, 3, 7])[0], 3)
+    self.assertEqual(cache.lookup([9, 1, 2]), (0, None, None))
+
+  def test_full_match_leaves_one_token_to_prefill(self):
+    cache = PrefixCache()
+    cache.insert(prefix_key([1, 2, 3]), "a", [1, 2, 3])
+    self.assertEqual(cache.lookup([1, 2, 3])[0], 2)
+    self.assertEqual(cache.lookup([1])[0], 0)
+
+  def test_eviction(self):
+    evicted = []
+    cache = PrefixCache(max_entries=2, on_evict=evicted.append)
+    cache.insert(prefix_key([1, 2]), "a", [1, 2])
+    cache.insert(prefix_key([1, 2, 3]), "b", [1, 2, 3])
+    cache.lookup([1, 9])
+    cache.insert(prefix_key([4]), "c", [4])
+
+    self.assertEqual(evicted, ["a"])
+    self.assertIsNone(cache.get(prefix_key([1, 2])))
+    self.assertEqual(cache.lookup([1, 2, 3, 4])[:2], (3, prefix_key([1, 2, 3])))
+    cache.clear()
+    self.assertEqual(cache.root.children, {})
+
+  def test_evict_oldest_skips_kept_entries(self):
+    cache = PrefixCache()
+    cache.insert("a", "a")
+    cache.insert("b", "b")
+    self.assertTrue(cache.evict_oldest(keep=["a"]))
+    self.assertEqual(list(cache.entries), ["a"])
+    self.assertFalse(cache.evict_oldest(keep=["a"]))
+
+  def test_entries_without_tokens_are_only_reachable_by_key(self):
+    cache = PrefixCache()
+    cache.insert("k", "a")
+    self.assertEqual(cache.get("k"), "a")
+    self.assertEqual(cache.lookup([1, 2])[0], 0)
+
+  def test_stats(self):
+    cache = PrefixCache()
+    cache.insert(prefix_key([1, 2, 3]), "a", [1, 2, 3])
+    cache.lookup([1, 2, 3, 4])
+    cache.lookup([5, 6, 7, 8])
+    stats = cache.stats()
+    self.assertEqual((stats["lookups"], stats["hits"], stats["hit_tokens"], stats["lookup_tokens"]), (2, 1, 3, 8))
+    self.assertEqual(stats["hit_rate"], 0.5)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+from unittest import mock
+from exo.inference import tokenizers
+from exo.inference.tokenizers import TokenizerCache, resolve_tokenizer
+
+
+class TestTokenizerCache(unittest.IsolatedAsyncioTestCase):
+  async def test_concurrent_callers_share_one_load(self):
+    cache = TokenizerCache()
+    loads = 0
+
+    async def load():
+      nonlocal loads
+      loads += 1
+      await asyncio.sleep(0.01)
+      return object()
+
+    results = await asyncio.gather(*[cache.get("llama", load) for _ in range(5)])
+    self.assertEqual(loads, 1)
+    self.assertTrue(all(result is results[0] for result in results))
+    self.assertIs(await cache.get("llama", load), results[0])
+    self.assertEqual(cache.stats(), {"size": 1, "loading": 0, "hits": 1, "misses": 1})
+
+  async def test_least_recently_used_tokenizer_is_dropped(self):
+    cache = TokenizerCache(max_size=2)
+
+    async def load():
+      return object()
+
+    a = await cache.get("a", load)
+    await cache.get("b", load)
+    await cache.get("a", load)
+    await cache.get("c", load)
+    self.assertEqual(list(cache.tokenizers), ["a", "c"])
+    self.assertIs(await cache.get("a", load), a)
+
+  async def test_failed_load_is_retried(self):
+    cache = TokenizerCache()
+    load = mock.AsyncMock(side_effect=[OSError("offline"), "tokenizer"])
+    with self.assertRaises(OSError):
+      await cache.get("a", load)
+    self.assertEqual(await cache.get("a", load), "tokenizer")
+    self.assertEqual(load.await_count, 2)
+
+  async def test_cancelled_caller_does_not_cancel_the_load(self):
+    cache = TokenizerCache()
+    loaded = asyncio.Event()
+
+    async def load():
+      await loaded.wait()
+      return "tokenizer"
+
+    waiter = asyncio.ensure_future(cache.get("a", load))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    loaded.set()
+    self.assertEqual(await cache.get("a", load), "tokenizer")
+
+  async def test_resolve_tokenizer_is_cached_per_model_and_engine(self):
+    with mock.patch.object(tokenizers, "tokenizer_cache", TokenizerCache()), \
+         mock.patch.object(tokenizers, "get_local_snapshot_dir", mock.AsyncMock(return_value=None)), \
+         mock.patch.object(tokenizers, "_resolve_tokenizer", mock.AsyncMock(side_effect=lambda path: object())) as load:
+      first = await resolve_tokenizer("org/model", "TinygradDynamicShardInferenceEngine")
+      self.assertIs(await resolve_tokenizer("org/model", "TinygradDynamicShardInferenceEngine", local_path="/models/org--model"), first)
+      self.assertIsNot(await resolve_tokenizer("org/model", "MLXDynamicShardInferenceEngine"), first)
+      self.assertEqual(load.await_count, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
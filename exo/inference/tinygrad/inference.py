@@ -4,18 +4,26 @@ import os
 from exo.inference.tinygrad.models.llama import Transformer, TransformerShard, convert_from_huggingface, fix_bf16, sample_logits
 from exo.inference.shard import Shard
 from exo.inference.tokenizers import resolve_tokenizer
+from exo.models import get_repo
 from tinygrad.nn.state import safe_save, safe_load, get_state_dict, load_state_dict
-from tinygrad import Tensor, nn, Context, TinyJit
+from tinygrad import Tensor, nn, Context, TinyJit, dtypes
 from exo.inference.inference_engine import InferenceEngine
 import numpy as np
 from exo.inference.tinygrad.tinygrad_helpers import concat_weights, load
 from exo.download.shard_download import ShardDownloader
 from concurrent.futures import ThreadPoolExecutor
-from .stateful_model import make_prompt_state
+from .stateful_model import KVCachePool, PagedModelState
+from exo.inference.prefix_cache import PrefixCache, PrefixCacheMiss, prefix_key
+from exo.inference.model_cache import ModelCache, model_cache_budget
+from exo.topology.device_capabilities import device_capabilities
 from .losses import length_masked_ce_loss
 from collections import OrderedDict
+from dataclasses import dataclass
+from exo.helpers import DEBUG
 import asyncio
-from typing import Optional
+import re
+import time
+from typing import Any, Collection, Optional, List, Tuple
 Tensor.no_grad = True 
 # default settings
 TEMPERATURE = int(os.getenv("TEMPERATURE", 0.85))
@@ -23,6 +31,17 @@ TOP_K = 25
 TOP_P = 0.9
 ALPHA_F = 0.1
 ALPHA_P = 0.0
+KV_PAGE_SIZE = int(os.getenv("KV_PAGE_SIZE", 256))
+# 0 keeps the old footprint: room for two full max_context caches, now shared by any number of requests
+KV_CACHE_BUDGET_MB = int(os.getenv("KV_CACHE_BUDGET_MB", 0))
+# prompts longer than this are prefilled this many tokens per forward, 0 runs them in one go
+PREFILL_CHUNK_SIZE = int(os.getenv("PREFILL_CHUNK_SIZE", 512))
+# decode steps run on a freshly loaded shard, after one prompt chunk, so their kernels are compiled and the jitted decode graph captured
+# before the first request. TinyJit captures on its second call, so at least two are run. 0 skips the warmup
+WARMUP_DECODE_STEPS = int(os.getenv("WARMUP_DECODE_STEPS", 4))
+MAX_EVICTED_REQUESTS = 1024
+# kv pool ids of prefix cache snapshots
+PREFIX_ENTRY = "prefix/"
 MODEL_PARAMS = {
   "1B": {
     "args": {
@@ -39,10 +58,19 @@ MODEL_PARAMS = {
 }
 
 
-def build_transformer(model_path: Path, shard: Shard, model_size="8B", device=None):
+def build_transformer(model_path: Path, shard: Shard, model_size="8B", device=None, donor: Optional[Tuple[Shard, "TransformerShard"]] = None):
   # build model
   linear = nn.Linear
   model = Transformer(**MODEL_PARAMS[model_size]["args"], linear=linear, max_context=8192, jit=True, shard=shard)
+  reused = set()
+  if donor is not None:
+    # a loaded shard of the same model already has these layers, take them over instead of reading them from disk again
+    donor_shard, donor_model = donor
+    for i, layer in zip(range(donor_shard.start_layer, donor_shard.end_layer + 1), donor_model.layers):
+      if shard.start_layer <= i <= shard.end_layer:
+        model.layers[i] = layer
+        reused.add(i)
+    if DEBUG >= 2: print(f"Reusing layers {sorted(reused)} of {donor_shard} for {shard}")
 
   # load weights
   if model_path.is_dir():
@@ -53,6 +81,8 @@ def build_transformer(model_path: Path, shard: Shard, model_size="8B", device=No
     weights = load(str(model_path), shard)
   weights = convert_from_huggingface(weights, model, MODEL_PARAMS[model_size]["args"]["n_heads"], MODEL_PARAMS[model_size]["args"]["n_kv_heads"])
   weights = fix_bf16(weights)
+  # weights load lazily, dropping the reused layers' entries skips reading them
+  weights = {k: v for k, v in weights.items() if not ((n := re.match(r"layers\.(\d+)\.", k)) and int(n.group(1)) in reused)}
 
   with Context(BEAM=0):
     # replace weights in model
@@ -61,60 +91,295 @@ def build_transformer(model_path: Path, shard: Shard, model_size="8B", device=No
 
   return model
 
+
+def shard_nbytes(model: TransformerShard, shard: Shard) -> int:
+  # the full Transformer the shard was cut from has every weight, only count the ones loaded for the shard
+  parts = [model.layers] + ([model.tok_embeddings] if shard.is_first_layer() else []) + ([model.norm, model.output] if shard.is_last_layer() else [])
+  return sum(t.nbytes() for t in get_state_dict(parts).values())
+
+
+@dataclass
+class LoadedShard:
+  model: Any
+  tokenizer: Any
+  states: OrderedDict
+  kv_pool: KVCachePool
+  prefix_cache: PrefixCache
+
+
 class TinygradDynamicShardInferenceEngine(InferenceEngine):
-  def __init__(self, shard_downloader: ShardDownloader):
+  def __init__(self, shard_downloader: ShardDownloader, prefill_chunk_size: int = PREFILL_CHUNK_SIZE):
     self.shard = None
     self.shard_downloader = shard_downloader
     self.executor = ThreadPoolExecutor(max_workers=1)
     self.states = OrderedDict()
+    self.kv_pool = None
+    self.prefix_cache = PrefixCache()
+    # loaded shards, the budget is set from the device's memory when the first one is loaded
+    self.model_cache = ModelCache(max_bytes=None, on_evict=lambda shard, loaded: self.mark_evicted(loaded.states))
+    self.prefill_chunk_size = prefill_chunk_size
+    # requests in the middle of a chunked prefill, their kv cache must not be evicted between chunks
+    self.prefilling = set()
+    # requests whose kv cache was evicted to make room, their next step fails instead of starting over from an empty cache
+    self.evicted = OrderedDict()
+
+  def make_kv_pool(self, model) -> KVCachePool:
+    if KV_CACHE_BUDGET_MB > 0: return KVCachePool(KV_PAGE_SIZE, max_bytes=KV_CACHE_BUDGET_MB*1024*1024)
+    return KVCachePool(KV_PAGE_SIZE, max_pages=-(-2*model.max_context // KV_PAGE_SIZE))
+
+  def activate(self, shard: Shard) -> None:
+    # runs first in every executor call, so each computes with the shard it was queued for, whatever was loaded since
+    if self.shard == shard: return
+    loaded = self.model_cache.entries.get(shard)
+    if loaded is None: raise RuntimeError(f"{shard} is no longer loaded, it was evicted from the model cache")
+    self.shard, self.model, self.states, self.kv_pool, self.prefix_cache = shard, loaded.model, loaded.states, loaded.kv_pool, loaded.prefix_cache
+
+  def make_room(self, request_id: str, x, layers, length: int, keep: Collection[str] = (), evict_requests: bool = True) -> bool:
+    # evict cached prefixes, then least recently used requests, until request_id fits in the pool
+    while not self.kv_pool.fits(request_id, x, layers, length):
+      if self.prefix_cache.evict_oldest(keep=[r[len(PREFIX_ENTRY):] for r in (request_id, *keep) if r.startswith(PREFIX_ENTRY)]): continue
+      evictable = [r for r in self.states if r != request_id and r not in keep and r not in self.prefilling] if evict_requests else []
+      if not evictable: return False
+      self.states.pop(evictable[0])
+      self.kv_pool.release(evictable[0])
+      self.mark_evicted([evictable[0]])
+      if DEBUG >= 2: print(f"Evicted kv cache of request_id={evictable[0]} to make room for {request_id=}")
+    return True
+
+  def mark_evicted(self, request_ids) -> None:
+    for request_id in request_ids:
+      self.evicted[request_id] = None
+      self.evicted.move_to_end(request_id)
+    while len(self.evicted) > MAX_EVICTED_REQUESTS: self.evicted.popitem(last=False)
 
-  def poll_state(self, x, request_id: str, max_states=2):
+  def poll_state(self, x, request_id: str, keep: Collection[str] = ()):
     if request_id not in self.states:
-      if len(self.states) >= max_states:
-        self.states.popitem(last=False)
-      self.states[request_id] = make_prompt_state(x, self.model)
+      self.states[request_id] = PagedModelState([])
     else:
       self.states.move_to_end(request_id)
     state = self.states[request_id]
+    layers = [l.attention for l in self.model.layers]
+    length = state.start + x.shape[1]
+    self.make_room(request_id, x, layers, length, keep)
+    state.pages = self.kv_pool.ensure(request_id, x, layers, length)
     return {"start_pos": state.start, "cache": state.cache}
 
-  async def sample(self, x: np.ndarray, temp=TEMPERATURE, top_p: float = 0.0) -> np.ndarray:
+  def match_prefix(self, shard: Shard, input_data: np.ndarray, prefix: Optional[dict]) -> Tuple[Optional[dict], np.ndarray, Optional[tuple]]:
+    # a new request's prefill: find the longest cached prompt it starts with
+    if shard.is_first_layer():
+      # a restarted prompt goes through every shard without the prefix cache, it is only stored again
+      if prefix is not None and prefix.get("restart"): return {"store": prefix_key(input_data[0]), "restart": True}, input_data, None
+      length, key, snapshot = self.prefix_cache.lookup(input_data[0])
+      # a prompt prefilled chunk by chunk is stored after its last chunk, the node passes store=None and the whole prompt with the first
+      prompt = prefix["tokens"] if prefix is not None and "tokens" in prefix else input_data[0].tolist()
+      prefix = {"store": prefix["store"] if prefix is not None and "store" in prefix else prefix_key(input_data[0])}
+      if length == 0: return prefix, input_data, None
+      # a later shard that misses the entry hands the prompt back to be prefilled again
+      prefix.update(key=key, length=length, tokens=prompt)
+      return prefix, input_data[:, length:], snapshot
+    if prefix is None or not prefix.get("length"): return prefix, input_data, None
+    snapshot = self.prefix_cache.get(prefix["key"])
+    if snapshot is None: raise PrefixCacheMiss(prefix["key"], prefix.get("tokens"))
+    return prefix, input_data, snapshot
+
+  def copy_pages(self, src: str, dst: str, x, length: int, evict_requests: bool = True) -> bool:
+    layers = [l.attention for l in self.model.layers]
+    if not self.make_room(dst, x, layers, length, keep=(src,), evict_requests=evict_requests) or src not in self.kv_pool.page_tables: return False
+    for dst_page, src_page in zip(self.kv_pool.ensure(dst, x, layers, length), self.kv_pool.page_tables[src]):
+      for d, s in zip(dst_page, src_page): d.assign(s).realize()
+    return True
+
+  def restore_prefix(self, request_id: str, x, snapshot: tuple, length: int) -> bool:
+    entry_id, _ = snapshot
+    if not self.copy_pages(entry_id, request_id, x, length):
+      self.kv_pool.release(request_id)
+      return False
+    self.states[request_id] = PagedModelState(self.kv_pool.page_tables[request_id], start=length)
+    return True
+
+  def store_prefix(self, request_id: str, x, tokens: Optional[np.ndarray], key: str):
+    if self.prefix_cache.get(key) is not None: return
+    entry_id, length = f"{PREFIX_ENTRY}{key}", self.states[request_id].start
+    # a snapshot is only worth older snapshots, never the kv cache of a request still generating
+    if not self.copy_pages(request_id, entry_id, x, length, evict_requests=False):
+      self.kv_pool.release(entry_id)
+      if DEBUG >= 2: print(f"No room in the kv cache pool to cache the prefix of {request_id=}")
+      return
+    self.prefix_cache.insert(key, (entry_id, length), tokens)
+
+  def make_prefix_cache(self, kv_pool: KVCachePool) -> PrefixCache:
+    return PrefixCache(on_evict=lambda snapshot: kv_pool.release(snapshot[0]))
+
+  def warmup(self, shard: Shard):
+    # compiled kernels also land in tinygrad's on-disk compile cache (CACHEDB), so after a restart this mostly skips the compiler
+    if WARMUP_DECODE_STEPS <= 0 or shard not in self.model_cache: return
+    self.activate(shard)
+    request_id, weight = "__warmup__", self.model.tok_embeddings.weight
+    start = time.perf_counter()
+    try:
+      # the decode steps stay in one page bucket, so they go through the same jit
+      for length in [self.prefill_chunk_size or KV_PAGE_SIZE] + [1]*max(WARMUP_DECODE_STEPS, 2):
+        if self.shard.is_first_layer(): h = self.model.embed(Tensor.zeros(1, length, dtype=dtypes.int32))
+        else: h = Tensor.zeros(1, length, weight.shape[1], dtype=weight.dtype)
+        self._forward(request_id, h)
+      jits = getattr(getattr(self.model, "decode", None), "jits", {})
+      if DEBUG >= 1: print(f"Warmed up {self.shard} in {time.perf_counter() - start:.2f}s, captured decode graphs: {sum(jit.captured is not None for jit in jits.values())}")
+    except Exception as e:
+      # the first request compiles what it needs instead
+      print(f"Warmup of {self.shard} failed: {e}")
+    finally:
+      self.states.pop(request_id, None)
+      self.kv_pool.release(request_id)
+
+  def stats(self) -> dict:
+    return {"kv_cache": self.kv_pool.stats() if self.kv_pool is not None else None, "prefix_cache": self.prefix_cache.stats(), "model_cache": self.model_cache.stats()}
+
+  async def sample(self, x: np.ndarray, temp=TEMPERATURE, top_p: float = 1.0) -> np.ndarray:
     logits = x[:, -1, :]
     def sample_wrapper():
-      return sample_logits(Tensor(logits).flatten(), temp, 0, 0.8, top_p, 0.0).realize().numpy().astype(int)
+      # sample_logits only applies top p within the top k
+      return sample_logits(Tensor(logits).flatten(), temp, TOP_K if top_p < 1.0 else 0, top_p, 0.0, 0.0).realize().numpy().astype(int)
     return await asyncio.get_running_loop().run_in_executor(self.executor, sample_wrapper)
 
   async def encode(self, shard: Shard, prompt: str) -> np.ndarray:
-    await self.ensure_shard(shard)
-    tokens = await asyncio.get_running_loop().run_in_executor(self.executor, self.tokenizer.encode, prompt)
+    loaded = await self.ensure_shard(shard)
+    tokens = await asyncio.get_running_loop().run_in_executor(self.executor, loaded.tokenizer.encode, prompt)
     return await asyncio.get_running_loop().run_in_executor(self.executor, np.array, tokens)
   
   async def decode(self, shard: Shard, tokens) -> str:
-    await self.ensure_shard(shard)
-    tokens = await asyncio.get_running_loop().run_in_executor(self.executor, self.tokenizer.decode, tokens)
+    loaded = await self.ensure_shard(shard)
+    tokens = await asyncio.get_running_loop().run_in_executor(self.executor, loaded.tokenizer.decode, tokens)
     return tokens
   
   async def load_checkpoint(self, shard: Shard, path: str):
-    await self.ensure_shard(shard)
+    loaded = await self.ensure_shard(shard)
     state_dict = safe_load(path)
-    await asyncio.get_running_loop().run_in_executor(self.executor, load_state_dict, self.model, state_dict)
+    await asyncio.get_running_loop().run_in_executor(self.executor, load_state_dict, loaded.model, state_dict)
   
   async def save_checkpoint(self, shard: Shard, path: str):
-    await self.ensure_shard(shard)
-    state_dict = await asyncio.get_running_loop().run_in_executor(self.executor, get_state_dict, self.model)
+    loaded = await self.ensure_shard(shard)
+    state_dict = await asyncio.get_running_loop().run_in_executor(self.executor, get_state_dict, loaded.model)
     safe_save(state_dict, path) 
   
+  def _prepare(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict]):
+    self.activate(shard)
+    inference_state = dict(inference_state or {})
+    prefix, snapshot = inference_state.pop("prefix_cache", None), None
+    if prefix is not None and prefix.get("restart"):
+      # a later shard missed the prefix this request was restored from, its prompt is prefilled again from scratch
+      self.states.pop(request_id, None)
+      self.kv_pool.release(request_id)
+      self.evicted.pop(request_id, None)
+    is_prefill = request_id not in self.states
+    if is_prefill and request_id in self.evicted: raise RuntimeError(f"kv cache of {request_id=} was evicted mid-generation")
+    tokens = input_data[0] if is_prefill and shard.is_first_layer() else None
+    if is_prefill: prefix, input_data, snapshot = self.match_prefix(shard, input_data, prefix)
+    elif prefix is not None:
+      # the last chunk of a prompt prefilled chunk by chunk, the first shard gets the whole prompt to index the snapshot by
+      prefix = dict(prefix)
+      if "tokens" in prefix: tokens = np.asarray(prefix.pop("tokens"))
+    h = self.model.embed(Tensor(input_data))
+    if snapshot is not None and not self.restore_prefix(request_id, h, snapshot, prefix["length"]):
+      if not shard.is_first_layer(): raise MemoryError(f"No room in the kv cache pool to restore the prefix of {request_id=}")
+      # fall back to prefilling the whole prompt
+      prefix = {"store": prefix["store"]}
+      h = self.model.embed(Tensor(tokens[None, :]))
+    return h, (is_prefill, tokens, prefix, inference_state)
+
+  def _forward(self, request_id: str, h) -> np.ndarray:
+    state = self.poll_state(h, request_id)
+    out = self.model.forward(h, **state)
+    self.states[request_id].start += h.shape[1]
+    return out.realize().numpy()
+
+  def _finish(self, request_id: str, shard: Shard, h, context: tuple) -> Optional[dict]:
+    self.activate(shard)
+    is_prefill, tokens, prefix, inference_state = context
+    if prefix is not None and prefix.get("store"): self.store_prefix(request_id, h, tokens, prefix["store"])
+    if prefix is not None and not shard.is_last_layer(): inference_state["prefix_cache"] = prefix
+    return inference_state or None
+
+  def _infer(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict]) -> Tuple[np.ndarray, Optional[dict]]:
+    h, context = self._prepare(request_id, shard, input_data, inference_state)
+    out = self._forward(request_id, h)
+    return out, self._finish(request_id, shard, h, context)
+
   async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> tuple[np.ndarray, Optional[dict]]:
-    await self.ensure_shard(shard)
-    def wrap_infer():
-      x = Tensor(input_data)
-      h = self.model.embed(x)
-      state = self.poll_state(h, request_id)
-      out = self.model.forward(h, **state)
-      self.states[request_id].start += x.shape[1]
-      return out.realize()
-    output_data = await asyncio.get_running_loop().run_in_executor(self.executor, wrap_infer)
-    return output_data.numpy(), inference_state
+    loaded = await self.ensure_shard(shard)
+    restart = ((inference_state or {}).get("prefix_cache") or {}).get("restart")
+    if self.prefill_chunk_size > 0 and input_data.shape[1] > self.prefill_chunk_size and (request_id not in loaded.states or restart):
+      return await self.infer_prompt_chunks(request_id, shard, input_data, inference_state, loaded)
+    return await asyncio.get_running_loop().run_in_executor(self.executor, self._infer, request_id, shard, input_data, inference_state)
+
+  async def infer_prompt_chunks(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict], loaded: LoadedShard) -> tuple[np.ndarray, Optional[dict]]:
+    # a long prefill in one forward needs a seqlen x seqlen attention matrix and holds the executor for all other requests.
+    # each chunk is its own executor call, so decode steps queued meanwhile run between chunks.
+    loop = asyncio.get_running_loop()
+    self.prefilling.add(request_id)
+    try:
+      h, context = await loop.run_in_executor(self.executor, self._prepare, request_id, shard, input_data, inference_state)
+      def forward_chunk(chunk, state):
+        self.activate(shard)
+        # evicted, or dropped by a restart of the prompt, meanwhile
+        if state is not None and self.states.get(request_id) is not state: raise RuntimeError(f"kv cache of {request_id=} was evicted during its prefill")
+        return self._forward(request_id, chunk)
+      outs, state = [], loaded.states.get(request_id)
+      for start in range(0, h.shape[1], self.prefill_chunk_size):
+        outs.append(await loop.run_in_executor(self.executor, forward_chunk, h[:, start:start + self.prefill_chunk_size], state))
+        state = loaded.states.get(request_id)
+      # only the logits of the last position are sampled from a prompt, the next shard needs every position
+      out = outs[-1] if shard.is_last_layer() else np.concatenate(outs, axis=1)
+      return out, await loop.run_in_executor(self.executor, self._finish, request_id, shard, h, context)
+    finally:
+      self.prefilling.discard(request_id)
+
+  async def cached_prefix_length(self, shard: Shard, tokens: np.ndarray) -> int:
+    loaded = await self.ensure_shard(shard)
+    return await asyncio.get_running_loop().run_in_executor(self.executor, lambda: loaded.prefix_cache.match(tokens)[0])
+
+  async def evict_request(self, request_id: str) -> None:
+    def evict():
+      # the request lives in whichever loaded shard it ran on
+      for loaded in self.model_cache.entries.values():
+        loaded.states.pop(request_id, None)
+        loaded.kv_pool.release(request_id)
+      self.evicted.pop(request_id, None)
+    await asyncio.get_running_loop().run_in_executor(self.executor, evict)
+
+  async def trim_cache(self, request_id: str, n: int) -> None:
+    # positions past start are masked out and overwritten by the next forward
+    def trim():
+      for loaded in self.model_cache.entries.values():
+        if request_id in loaded.states: loaded.states[request_id].start -= n
+    await asyncio.get_running_loop().run_in_executor(self.executor, trim)
+
+  def _infer_batch(self, request_ids: List[str], shard: Shard, input_datas: List[np.ndarray], inference_states: List[Optional[dict]]) -> List[Tuple[np.ndarray, Optional[dict]]]:
+    self.activate(shard)
+    if missing := [request_id for request_id in request_ids if request_id not in self.states]: raise RuntimeError(f"kv cache of {missing} was evicted mid-generation")
+    hs = [self.model.embed(Tensor(input_data)) for input_data in input_datas]
+    for request_id, h in zip(request_ids, hs): self.poll_state(h, request_id, keep=request_ids)
+    # ordered by position, batches with the same page counts replay the same captured graph
+    order = sorted(range(len(request_ids)), key=lambda i: self.states[request_ids[i]].start)
+    states = [self.states[request_ids[i]] for i in order]
+    out = self.model.decode(Tensor.cat(*[hs[i] for i in order], dim=0), [state.start for state in states], [state.cache for state in states]).numpy()
+    results = [None]*len(request_ids)
+    for b, (i, state) in enumerate(zip(order, states)):
+      state.start += 1
+      results[i] = (out[b:b + 1], inference_states[i] or None)
+    return results
+
+  async def infer_tensor_batch(self, request_ids: List[str], shard: Shard, input_datas: List[np.ndarray], inference_states: List[Optional[dict]]) -> List[tuple[np.ndarray, Optional[dict]]]:
+    loaded = await self.ensure_shard(shard)
+    # decode steps share one forward pass over the stacked hidden states, prefills go one by one through the prefix cache
+    decodes = [i for i, (request_id, input_data) in enumerate(zip(request_ids, input_datas)) if request_id in loaded.states and input_data.shape[1] == 1]
+    results = [None]*len(request_ids)
+    if len(decodes) > 1:
+      batch = [[args[i] for i in decodes] for args in (request_ids, input_datas, inference_states)]
+      for i, result in zip(decodes, await asyncio.get_running_loop().run_in_executor(self.executor, self._infer_batch, batch[0], shard, batch[1], batch[2])):
+        results[i] = result
+    for i, (request_id, input_data, inference_state) in enumerate(zip(request_ids, input_datas, inference_states)):
+      if results[i] is None: results[i] = await self.infer_tensor(request_id, shard, input_data, inference_state)
+    return results
 
   async def evaluate(self, request_id: str, shard: Shard, inputs, targets, lengths, loss=length_masked_ce_loss):
     def step(x, y, l):
@@ -139,18 +404,31 @@ class TinygradDynamicShardInferenceEngine(InferenceEngine):
     
     return loss.numpy(), loss.numpy()
 
-  async def ensure_shard(self, shard: Shard):
-    if self.shard == shard:
-      return
+  async def ensure_shard(self, shard: Shard) -> LoadedShard:
+    loaded = self.model_cache.get(shard)
+    if loaded is not None:
+      self.tokenizer = loaded.tokenizer
+      return loaded
 
     model_path = await self.shard_downloader.ensure_shard(shard, self.__class__.__name__)
 
-    if self.shard != shard:
+    # another request may have loaded it during the download
+    loaded = self.model_cache.get(shard)
+    if loaded is None:
       loop = asyncio.get_running_loop()
+      if self.model_cache.max_bytes is None: self.model_cache.max_bytes = model_cache_budget((await device_capabilities()).memory)
       parameters = "1B" if "1b" in shard.model_id.lower() else "3B" if "3b" in shard.model_id.lower() else "8B" if "8b" in shard.model_id.lower() else "70B"
-      model_shard = await loop.run_in_executor(self.executor, build_transformer, model_path, shard, parameters)
+      donor = self.model_cache.overlapping(shard)
+      model_shard = await loop.run_in_executor(self.executor, build_transformer, model_path, shard, parameters, None, None if donor is None else (donor[0], donor[1].model))
 
       tokenizer_path = str((model_path if model_path.is_dir() else model_path.parent))
-      self.tokenizer = await resolve_tokenizer(tokenizer_path)
-      self.shard = shard
-      self.model = model_shard
+      tokenizer = await resolve_tokenizer(get_repo(shard.model_id, self.__class__.__name__) or tokenizer_path, self.__class__.__name__, local_path=tokenizer_path)
+      kv_pool = self.make_kv_pool(model_shard)
+      loaded = LoadedShard(model_shard, tokenizer, OrderedDict(), kv_pool, self.make_prefix_cache(kv_pool))
+      # executor calls of evicted shards raise in activate, their kv caches and layers not shared with other shards are freed
+      self.model_cache.put(shard, loaded, shard_nbytes(model_shard, shard))
+      if DEBUG >= 1: print(f"Loaded {shard}, model cache: {self.model_cache.stats()}")
+      # requests that find the shard loaded queue their executor calls behind the warmup
+      await loop.run_in_executor(self.executor, self.warmup, shard)
+    self.tokenizer = loaded.tokenizer
+    return loaded
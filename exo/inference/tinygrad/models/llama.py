@@ -1,7 +1,12 @@
-from typing import Tuple, Union, Optional, Dict, Any, List
+from typing import Tuple, Union, Optional, Dict, Any, List, Callable
 from tinygrad import Tensor, Variable, TinyJit, dtypes, nn, Device
 from tinygrad.helpers import getenv
 from collections import OrderedDict
+from functools import partial
+import math
+
+# captured decode graphs kept per model, one per combination of page counts seen in a decode step
+MAX_DECODE_JITS = getenv("MAX_DECODE_JITS", 64)
 
 
 # https://github.com/facebookresearch/llama/blob/1076b9c51c77ad06e9d7ba8a4c6df775741732bd/llama/model.py#L47
@@ -61,7 +66,7 @@ class Attention:
     self.wv = linear(dim, self.n_kv_heads*self.head_dim, bias=False)
     self.wo = linear(self.n_heads*self.head_dim, dim, bias=False)
 
-  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache: Optional[Tensor]=None) -> Tensor:
+  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache: Optional[Union[Tensor, List[Tensor]]]=None) -> Tensor:
     if getenv("WQKV"):
       if not hasattr(self, 'wqkv'): self.wqkv = Tensor.cat(self.wq.weight, self.wk.weight, self.wv.weight)
       xqkv = x @ self.wqkv.T
@@ -76,7 +81,9 @@ class Attention:
     xq, xk = apply_rotary_emb(xq, xk, freqs_cis)
     bsz, seqlen, _, _ = xq.shape
 
-    if cache is not None:
+    if isinstance(cache, list):
+      keys, values = update_paged_cache(cache, xk, xv, start_pos)
+    elif cache is not None:
       # update the cache
       assert xk.dtype == xv.dtype == cache.dtype, f"{xk.dtype=}, {xv.dtype=}, {cache.dtype=}"
       cache.shrink((None, None, (start_pos, start_pos + seqlen), None, None)).assign(Tensor.stack(xk, xv)).realize()
@@ -93,6 +100,91 @@ class Attention:
     attn = attn.reshape(bsz, seqlen, -1)
     return self.wo(attn)
 
+  def decode_paged(self, x: Tensor, start_pos: List[Union[Variable, int]], freqs_cis: Tensor, caches: List[List[Tensor]]) -> Tensor:
+    # one new position for each of a batch of requests, caches[b] holding the pages request b uses so far
+    xq, xk, xv = self.wq(x), self.wk(x), self.wv(x)
+    xq = xq.reshape(xq.shape[0], 1, self.n_heads, self.head_dim)
+    xk = xk.reshape(xk.shape[0], 1, self.n_kv_heads, self.head_dim)
+    xv = xv.reshape(xv.shape[0], 1, self.n_kv_heads, self.head_dim)
+    xq, xk = apply_rotary_emb(xq, xk, freqs_cis)
+
+    attn = []
+    for b, (pos, pages) in enumerate(zip(start_pos, caches)):
+      offset = pos - (len(pages) - 1)*pages[0].shape[2]
+      pages[-1].shrink((None, None, (offset, offset + 1), None, None)).assign(Tensor.stack(xk[b:b+1], xv[b:b+1])).realize()
+      attn.append(paged_attention(xq[b:b+1], pages, offset + 1, self.n_rep))
+    return self.wo(attn[0].cat(*attn[1:], dim=0).reshape(x.shape[0], 1, -1))
+
+
+def update_paged_cache(pages: List[Tensor], xk: Tensor, xv: Tensor, start_pos: int) -> Tuple[Tensor, Tensor]:
+  # pages are (2, bsz, page_size, n_kv_heads, head_dim) blocks in position order, see KVCachePool
+  page_size, seqlen = pages[0].shape[2], xk.shape[1]
+  assert xk.dtype == xv.dtype == pages[0].dtype, f"{xk.dtype=}, {xv.dtype=}, {pages[0].dtype=}"
+  kv = Tensor.stack(xk, xv)
+  for page_start in range((start_pos//page_size)*page_size, start_pos + seqlen, page_size):
+    lo, hi = max(start_pos, page_start), min(start_pos + seqlen, page_start + page_size)
+    pages[page_start // page_size].shrink((None, None, (lo - page_start, hi - page_start), None, None)).assign(kv.shrink((None, None, (lo - start_pos, hi - start_pos), None, None))).realize()
+  if start_pos == 0: return xk, xv
+  used = pages[:(start_pos + seqlen + page_size - 1) // page_size]
+  cache = used[0].cat(*used[1:], dim=2).shrink((None, None, (0, start_pos + seqlen), None, None))
+  return cache[0], cache[1]
+
+
+def paged_attention(xq: Tensor, pages: List[Tensor], last_page_len: Union[Variable, int], n_rep: int) -> Tensor:
+  # attention of one query position over the pages, the softmax is merged across pages so they are never concatenated
+  q = xq.transpose(1, 2)
+  parts = []
+  for i, page in enumerate(pages):
+    keys, values = page[0], page[1]
+    if i == len(pages) - 1: keys, values = keys.shrink((None, (0, last_page_len), None, None)), values.shrink((None, (0, last_page_len), None, None))
+    keys, values = repeat_kv(keys, n_rep).transpose(1, 2), repeat_kv(values, n_rep).transpose(1, 2)
+    parts.append((q.matmul(keys.transpose(-2, -1), acc_dtype=dtypes.float32)/math.sqrt(q.shape[-1]), values))
+  m = parts[0][0].max(-1, keepdim=True)
+  for scores, _ in parts[1:]: m = m.maximum(scores.max(-1, keepdim=True))
+  num, den = None, None
+  for scores, values in parts:
+    e = (scores - m).exp()
+    out = e.cast(values.dtype).matmul(values, acc_dtype=dtypes.float32)
+    num, den = (out, e.sum(-1, keepdim=True)) if num is None else (num + out, den + e.sum(-1, keepdim=True))
+  return (num/den).cast(xq.dtype).transpose(1, 2)
+
+
+class PagedDecoder:
+  """
+  Decode steps over paged KV caches. The page tensors are inputs of the captured graph, so one TinyJit per
+  tuple of page counts serves every request (or batch of requests) whose caches span that many pages.
+  """
+  def __init__(self, layers: List["TransformerBlock"], freqs_cis: Tensor, post: Callable[[Tensor], Tensor], jit: bool = True):
+    self.layers = layers
+    self.freqs_cis = freqs_cis
+    self.post = post
+    self.jit = jit
+    self.jits: OrderedDict[Tuple[int, ...], TinyJit] = OrderedDict()
+
+  def __call__(self, x: Tensor, start_pos: List[int], cache: List[List[List[Tensor]]]) -> Tensor:
+    # cache[b][l] is the page table of request b in layer l, pages past its position are left out
+    page_size = cache[0][0][0].shape[2]
+    counts = tuple(pos//page_size + 1 for pos in start_pos)
+    pos_vars = [Variable(f"start_pos{b}", (n - 1)*page_size, n*page_size - 1).bind(pos) for b, (n, pos) in enumerate(zip(counts, start_pos))]
+    pages = [page for n, layers in zip(counts, cache) for layer_pages in layers for page in layer_pages[:n]]
+    if not self.jit: return self.forward(counts, x, *pos_vars, *pages)
+    if counts not in self.jits:
+      self.jits[counts] = TinyJit(partial(self.forward, counts))
+      if len(self.jits) > MAX_DECODE_JITS: self.jits.popitem(last=False)
+    self.jits.move_to_end(counts)
+    return self.jits[counts](x, *pos_vars, *pages)
+
+  def forward(self, counts: Tuple[int, ...], x: Tensor, *args) -> Tensor:
+    start_pos, pages = args[:len(counts)], args[len(counts):]
+    caches, i = [], 0
+    for n in counts:
+      caches.append([list(pages[i + l*n:i + (l + 1)*n]) for l in range(len(self.layers))])
+      i += n*len(self.layers)
+    freqs_cis = Tensor.cat(*[self.freqs_cis.shrink((None, (pos, pos + 1), None, None, None)) for pos in start_pos], dim=0)
+    for l, layer in enumerate(self.layers):
+      x = layer.decode_paged(x, start_pos, freqs_cis, [c[l] for c in caches])
+    return self.post(x)
+
 
 class FeedForward:
   def __init__(self, dim: int, hidden_dim: int, linear=nn.Linear):
@@ -111,10 +203,14 @@ class TransformerBlock:
     self.attention_norm = nn.RMSNorm(dim, norm_eps)
     self.ffn_norm = nn.RMSNorm(dim, norm_eps)
 
-  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache: Optional[Tensor]=None):
+  def __call__(self, x: Tensor, start_pos: Union[Variable, int], freqs_cis: Tensor, mask: Optional[Tensor], cache: Optional[Union[Tensor, List[Tensor]]]=None):
     h = x + self.attention(self.attention_norm(x), start_pos, freqs_cis, mask, cache=cache)
     return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
 
+  def decode_paged(self, x: Tensor, start_pos: List[Union[Variable, int]], freqs_cis: Tensor, caches: List[List[Tensor]]):
+    h = x + self.attention.decode_paged(self.attention_norm(x), start_pos, freqs_cis, caches)
+    return (h + self.feed_forward(self.ffn_norm(h))).contiguous()
+
 
 # standard openai sampling
 def sample_logits(logits: Tensor, temp: float, k: int, p: float, af: float, ap: float):
@@ -198,6 +294,9 @@ class Transformer:
     self.freqs_cis = precompute_freqs_cis(dim // n_heads, self.max_context*2, rope_theta, rope_scaling=rope_scaling).contiguous()
     self.forward_jit = TinyJit(self.forward_base) if jit else None
     self.shard = shard
+    if shard is not None:
+      head = (lambda h: self.output(self.norm(h)).float()) if shard.is_last_layer() else (lambda h: h)
+      self.decode = PagedDecoder(self.layers[shard.start_layer:shard.end_layer + 1], self.freqs_cis, head, jit)
 
   def forward_base(self, x: Tensor, start_pos: Union[Variable, int], cache: Optional[List[Tensor]] = None):
     seqlen = x.shape[1]
@@ -226,6 +325,7 @@ class Transformer:
     return h
 
   def forward(self, x: Tensor, start_pos: int, cache: Optional[List[Tensor]] = None):
+    if x.shape[0:2] == (1, 1) and cache and isinstance(cache[0], list): return self.decode(x, [start_pos], [cache])
     if x.shape[0:2] == (1, 1) and self.forward_jit is not None and start_pos != 0:
       return self.forward_jit(x, Variable("start_pos", 1, self.max_context).bind(start_pos), cache=cache)
     return self.forward_base(x, start_pos, cache=cache)
@@ -253,6 +353,7 @@ class TransformerShard:
     self.null_cache = [None for _ in shardrange] 
     self.freqs_cis = base.freqs_cis
     self.forward_jit = TinyJit(self.forward_base) if jit else None
+    self.decode = PagedDecoder(self.layers, self.freqs_cis, self.post, jit)
 
   def forward_base(self, x: Tensor, start_pos: Union[Variable, int], cache):
     seqlen = x.shape[1]
@@ -266,6 +367,7 @@ class TransformerShard:
     return out
 
   def forward(self, x: Tensor, start_pos: int, cache: Optional[List[Tensor]] = None):
+    if x.shape[0:2] == (1, 1) and cache and isinstance(cache[0], list): return self.decode(x, [start_pos], [cache])
     if x.shape[0:2] == (1, 1) and self.forward_jit is not None and start_pos != 0:
       return self.forward_jit(x, Variable("start_pos", 1, self.max_context).bind(start_pos), cache=cache)
     return self.forward_base(x, start_pos, cache=cache)
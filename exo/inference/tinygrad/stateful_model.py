@@ -1,21 +1,88 @@
-from tinygrad import Tensor, Variable 
+from tinygrad import Tensor, Variable
+from tinygrad.helpers import getenv
 from collections import OrderedDict
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-def create_kv_cache(x: Tensor, layer):
-  cache_kv = Tensor.zeros(2, x.shape[0], layer.max_context, layer.n_kv_heads, layer.head_dim, dtype=x.dtype).contiguous().realize()
+def create_kv_cache(x: Tensor, layer, length: Optional[int] = None):
+  cache_kv = Tensor.zeros(2, x.shape[0], layer.max_context if length is None else length, layer.n_kv_heads, layer.head_dim, dtype=x.dtype).contiguous().realize()
   if isinstance(x.device, tuple):
     # TODO: instead of specifying how to shard, it can follow how xk and xv are being sharded
     cache_kv.shard_((x.device), axis=3 if getenv("SHARD_KVCACHE") else None).realize()
   return cache_kv.realize()
 
+class KVCachePool:
+  """
+  Block-paged KV cache shared by every request on a shard.
+
+  The cache is split into fixed-size pages of page_size positions, each page holding one
+  (2, bs, page_size, n_kv_heads, head_dim) tensor per layer. Every request has a page table (the list
+  of its pages, in position order) that grows one page at a time, and pages of released requests go on
+  a free list to be reused. max_pages (or max_bytes) caps the memory held by the pool.
+  """
+  def __init__(self, page_size: int = 256, max_pages: Optional[int] = None, max_bytes: Optional[int] = None):
+    self.page_size = page_size
+    self.max_pages = max_pages
+    self.max_bytes = max_bytes
+    self.page_tables: Dict[str, List[List[Tensor]]] = {}
+    self.free: List[List[Tensor]] = []
+    self.num_pages = 0
+    self.page_bytes = 0
+
+  def pages_needed(self, request_id: str, length: int) -> int:
+    return max(0, -(-length // self.page_size) - len(self.page_tables.get(request_id, [])))
+
+  def fits(self, request_id: str, x: Tensor, layers, length: int) -> bool:
+    if self.page_bytes == 0:
+      self.page_bytes = sum(2*x.shape[0]*self.page_size*l.n_kv_heads*l.head_dim*x.dtype.itemsize for l in layers)
+      if self.max_bytes is not None: self.max_pages = max(1, self.max_bytes // self.page_bytes)
+    return self.max_pages is None or self.pages_needed(request_id, length) <= len(self.free) + self.max_pages - self.num_pages
+
+  def ensure(self, request_id: str, x: Tensor, layers, length: int) -> List[List[Tensor]]:
+    if not self.fits(request_id, x, layers, length):
+      raise MemoryError(f"KV cache pool exhausted: {request_id=} needs {self.pages_needed(request_id, length)} more pages, {self.stats()}")
+    page_table = self.page_tables.setdefault(request_id, [])
+    for _ in range(self.pages_needed(request_id, length)):
+      page_table.append(self.free.pop() if self.free else self._new_page(x, layers))
+    return page_table
+
+  def release(self, request_id: str) -> None:
+    self.free.extend(self.page_tables.pop(request_id, []))
+
+  def _new_page(self, x: Tensor, layers) -> List[Tensor]:
+    self.num_pages += 1
+    return [create_kv_cache(x, l, self.page_size) for l in layers]
+
+  def stats(self) -> dict:
+    pages_in_use = sum(len(pages) for pages in self.page_tables.values())
+    return {
+      "page_size": self.page_size,
+      "max_pages": self.max_pages,
+      "pages_allocated": self.num_pages,
+      "pages_in_use": pages_in_use,
+      "pages_free": len(self.free) + (0 if self.max_pages is None else self.max_pages - self.num_pages),
+      "bytes_in_use": pages_in_use*self.page_bytes,
+      "requests": len(self.page_tables),
+    }
+
 class ModelState:
   cache: List[Tensor]
-  start: int 
+  start: int
   def __init__(self, cache: List[Tensor], start: int = 0):
     self.cache = cache
     self.start = start
 
+class PagedModelState:
+  pages: List[List[Tensor]]
+  start: int
+  def __init__(self, pages: List[List[Tensor]], start: int = 0):
+    self.pages = pages
+    self.start = start
+
+  @property
+  def cache(self) -> List[List[Tensor]]:
+    # the page table transposed to one list of pages per layer
+    return [list(layer_pages) for layer_pages in zip(*self.pages)]
+
 def make_prompt_state(x: Tensor, model):
   cache = [create_kv_cache(x, l.attention) for l in model.layers]
 
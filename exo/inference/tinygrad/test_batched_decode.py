@@ -0,0 +1,48 @@
+import unittest
+import numpy as np
+from exo.inference.shard import Shard
+from exo.inference.tinygrad import testing
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine
+
+SHARD = Shard("tiny", 0, 1, 2)
+PROMPTS = {"a": [1, 5, 7, 3, 2], "b": [3, 3, 9], "c": [2, 4, 6, 8, 10, 12]}
+
+
+def make_engine() -> TinygradDynamicShardInferenceEngine:
+  return testing.make_engine(SHARD)
+
+
+class TestBatchedDecode(unittest.IsolatedAsyncioTestCase):
+  async def decode(self, engine, batched: bool):
+    for request_id, prompt in PROMPTS.items(): await engine.infer_tensor(request_id, SHARD, np.array([prompt]))
+    outs = {request_id: [] for request_id in PROMPTS}
+    for step in range(3):
+      inputs = [np.array([[step + 1]]) for _ in PROMPTS]
+      if batched: results = await engine.infer_tensor_batch(list(PROMPTS), SHARD, inputs, [None]*len(PROMPTS))
+      else: results = [await engine.infer_tensor(request_id, SHARD, x) for request_id, x in zip(PROMPTS, inputs)]
+      for request_id, (out, _) in zip(PROMPTS, results): outs[request_id].append(out)
+    return outs
+
+  async def test_batched_decode_steps_match_single_requests(self):
+    batched, single = await self.decode(make_engine(), True), await self.decode(make_engine(), False)
+    for request_id in PROMPTS:
+      np.testing.assert_allclose(np.concatenate(batched[request_id]), np.concatenate(single[request_id]), atol=1e-5)
+
+  async def test_decode_steps_share_one_forward_pass(self):
+    engine = make_engine()
+    await self.decode(engine, True)
+    decoder = engine.model.decode
+    # one captured graph per step's page counts, each covering all three requests
+    self.assertTrue(all(len(counts) == 3 for counts in decoder.jits))
+    self.assertEqual({request_id: state.start for request_id, state in engine.states.items()}, {"a": 8, "b": 6, "c": 9})
+
+  async def test_prefills_in_a_batch_run_one_by_one(self):
+    engine = make_engine()
+    await engine.infer_tensor("a", SHARD, np.array([PROMPTS["a"]]))
+    results = await engine.infer_tensor_batch(["a", "b"], SHARD, [np.array([[1]]), np.array([PROMPTS["b"]])], [None, None])
+    self.assertEqual(results[1][0].shape, (1, 3, 32))
+    self.assertEqual(engine.states["b"].start, 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,84 @@
+import asyncio
+import unittest
+import numpy as np
+from exo.inference.shard import Shard
+from exo.inference.tinygrad import testing
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine
+
+MIDDLE_SHARD = Shard("dummy", 2, 5, 8)
+LAST_SHARD = Shard("dummy", 4, 7, 8)
+
+
+class RecordingModel:
+  layers = []
+
+  def __init__(self):
+    self.calls = []
+
+  def embed(self, x):
+    return x.float()
+
+  def forward(self, h, start_pos, cache):
+    self.calls.append((start_pos, h.shape[1]))
+    return h*1
+
+
+def make_engine(shard: Shard, chunk_size: int = 4) -> TinygradDynamicShardInferenceEngine:
+  engine = testing.make_engine(shard, RecordingModel(), prefill_chunk_size=chunk_size)
+  engine.activate(shard)
+  return engine
+
+
+class TestChunkedPrefill(unittest.IsolatedAsyncioTestCase):
+  async def test_long_prompts_are_prefilled_in_chunks(self):
+    engine = make_engine(MIDDLE_SHARD)
+    prompt = np.arange(10).reshape(1, 10)
+    out, _ = await engine.infer_tensor("req", MIDDLE_SHARD, prompt)
+
+    self.assertEqual(engine.model.calls, [(0, 4), (4, 4), (8, 2)])
+    self.assertEqual(engine.states["req"].start, 10)
+    np.testing.assert_array_equal(out, prompt)
+    self.assertEqual(engine.prefilling, set())
+
+  async def test_short_prompts_and_decode_steps_run_in_one_go(self):
+    engine = make_engine(MIDDLE_SHARD)
+    await engine.infer_tensor("req", MIDDLE_SHARD, np.arange(4).reshape(1, 4))
+    await engine.infer_tensor("req", MIDDLE_SHARD, np.arange(6).reshape(1, 6))
+    self.assertEqual(engine.model.calls, [(0, 4), (4, 6)])
+
+  async def test_last_shard_only_returns_the_last_chunk(self):
+    engine = make_engine(LAST_SHARD)
+    out, _ = await engine.infer_tensor("req", LAST_SHARD, np.arange(10).reshape(1, 10))
+    np.testing.assert_array_equal(out, [[8, 9]])
+
+  async def test_other_requests_run_between_chunks(self):
+    engine = make_engine(MIDDLE_SHARD)
+    await engine.infer_tensor("short", MIDDLE_SHARD, np.arange(3).reshape(1, 3))
+    engine.model.calls.clear()
+
+    await asyncio.gather(
+      engine.infer_tensor("long", MIDDLE_SHARD, np.arange(12).reshape(1, 12)),
+      engine.infer_tensor("short", MIDDLE_SHARD, np.array([[3]])),
+    )
+    self.assertLess(engine.model.calls.index((3, 1)), engine.model.calls.index((8, 4)))
+
+  async def test_chunking_can_be_disabled(self):
+    engine = make_engine(MIDDLE_SHARD, chunk_size=0)
+    await engine.infer_tensor("req", MIDDLE_SHARD, np.arange(10).reshape(1, 10))
+    self.assertEqual(engine.model.calls, [(0, 10)])
+
+  async def test_loaded_shards_keep_their_own_requests(self):
+    engine = make_engine(MIDDLE_SHARD)
+    last = make_engine(LAST_SHARD)
+    engine.model_cache.put(LAST_SHARD, last.model_cache.entries[LAST_SHARD], 0)
+    await asyncio.gather(
+      engine.infer_tensor("a", MIDDLE_SHARD, np.arange(3).reshape(1, 3)),
+      engine.infer_tensor("b", LAST_SHARD, np.arange(5).reshape(1, 5)),
+    )
+    self.assertEqual(engine.model_cache.entries[MIDDLE_SHARD].model.calls, [(0, 3)])
+    self.assertEqual(engine.model_cache.entries[LAST_SHARD].model.calls, [(0, 4), (4, 1)])
+    self.assertEqual(list(engine.model_cache.entries[LAST_SHARD].states), ["b"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import numpy as np
+from exo.inference.prefix_cache import prefix_key
+from exo.inference.shard import Shard
+from exo.inference.tinygrad import testing
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine
+
+SHARD = Shard("tiny", 0, 1, 2)
+
+
+def make_engine(max_pages: int) -> TinygradDynamicShardInferenceEngine:
+  return testing.make_engine(SHARD, max_pages=max_pages)
+
+
+class TestKVEviction(unittest.IsolatedAsyncioTestCase):
+  async def test_cached_prefixes_are_evicted_before_requests(self):
+    engine = make_engine(max_pages=4)
+    await engine.infer_tensor("a", SHARD, np.array([[1, 2, 3, 4, 5]]))
+    self.assertEqual(len(engine.prefix_cache.entries), 1)
+    await engine.infer_tensor("b", SHARD, np.array([[9, 8, 7]]))
+    self.assertEqual(list(engine.states), ["a", "b"])
+    # a's snapshot made room for b, which had room left for its own
+    self.assertEqual(list(engine.prefix_cache.entries), [prefix_key([9, 8, 7])])
+
+  async def test_storing_a_prefix_never_evicts_a_request(self):
+    engine = make_engine(max_pages=3)
+    await engine.infer_tensor("b", SHARD, np.array([[9, 8, 7]]))
+    await engine.infer_tensor("a", SHARD, np.array([[1, 2, 3, 4, 5]]))
+    # a's snapshot does not fit next to b, so it is skipped
+    self.assertEqual(list(engine.states), ["b", "a"])
+    self.assertEqual(len(engine.prefix_cache.entries), 0)
+    await engine.infer_tensor("b", SHARD, np.array([[1]]))
+    self.assertEqual(engine.states["b"].start, 4)
+
+  async def test_evicted_requests_fail_instead_of_starting_over(self):
+    engine = make_engine(max_pages=2)
+    await engine.infer_tensor("a", SHARD, np.array([[1, 2, 3, 4, 5]]))
+    await engine.infer_tensor("b", SHARD, np.array([[9, 8, 7]]))
+    self.assertEqual(list(engine.states), ["b"])
+    with self.assertRaises(RuntimeError):
+      await engine.infer_tensor("a", SHARD, np.array([[1]]))
+    with self.assertRaises(RuntimeError):
+      await engine.infer_tensor_batch(["a", "b"], SHARD, [np.array([[1]]), np.array([[1]])], [None, None])
+    # once the request is done with, its id can prefill again
+    await engine.evict_request("a")
+    await engine.evict_request("b")
+    await engine.infer_tensor("a", SHARD, np.array([[1, 2, 3]]))
+    self.assertEqual(engine.states["a"].start, 3)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+from exo.inference.prefix_cache import PrefixCacheMiss, prefix_key
+from exo.inference.shard import Shard
+from exo.inference.tinygrad import testing
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine
+
+SHARD = Shard("tiny", 0, 1, 2)
+FIRST, LAST = Shard("tiny", 0, 0, 2), Shard("tiny", 1, 1, 2)
+PROMPT = [1, 5, 7, 3, 2, 9, 4, 4, 6, 8]
+
+
+def make_engine(shard: Shard = SHARD) -> TinygradDynamicShardInferenceEngine:
+  return testing.make_engine(shard)
+
+
+class TestPrefixSnapshots(unittest.IsolatedAsyncioTestCase):
+  async def test_prompts_prefilled_in_chunks_are_stored_whole(self):
+    engine = make_engine()
+    # what the node sends with the first and the last chunk of a pipelined prompt
+    await engine.infer_tensor("a", SHARD, np.array([PROMPT[:4]]), {"prefix_cache": {"store": None}})
+    await engine.infer_tensor("a", SHARD, np.array([PROMPT[4:]]), {"prefix_cache": {"store": prefix_key(PROMPT), "tokens": PROMPT}})
+
+    self.assertEqual(list(engine.prefix_cache.entries), [prefix_key(PROMPT)])
+    self.assertEqual(await engine.cached_prefix_length(SHARD, np.array(PROMPT + [2, 3])), len(PROMPT))
+
+    restored, _ = await engine.infer_tensor("b", SHARD, np.array([PROMPT + [2, 3]]))
+    self.assertEqual(engine.prefix_cache.hit_tokens, len(PROMPT))
+    fresh, _ = await make_engine().infer_tensor("b", SHARD, np.array([PROMPT + [2, 3]]))
+    np.testing.assert_allclose(restored[:, -1], fresh[:, -1], atol=1e-5)
+
+  async def test_a_shard_missing_the_prefix_hands_back_the_prompt(self):
+    first, last = make_engine(FIRST), make_engine(LAST)
+    h, state = await first.infer_tensor("a", FIRST, np.array([PROMPT]))
+    await last.infer_tensor("a", LAST, h, state)
+    last.prefix_cache.clear()
+
+    prompt = PROMPT + [2, 3]
+    h, state = await first.infer_tensor("b", FIRST, np.array([prompt]))
+    self.assertEqual(state["prefix_cache"]["length"], len(PROMPT))
+    with self.assertRaises(PrefixCacheMiss) as miss:
+      await last.infer_tensor("b", LAST, h, state)
+    self.assertEqual(miss.exception.tokens, prompt)
+    self.assertNotIn("b", last.states)
+
+    # the node sends the prompt through the ring again, the first shard drops the kv cache it restored
+    h, state = await first.infer_tensor("b", FIRST, np.array([prompt]), {"prefix_cache": {"restart": True}})
+    self.assertEqual((h.shape[1], first.states["b"].start), (len(prompt), len(prompt)))
+    out, _ = await last.infer_tensor("b", LAST, h, state)
+    fresh, _ = await make_engine().infer_tensor("b", SHARD, np.array([prompt]))
+    np.testing.assert_allclose(out[:, -1], fresh[:, -1], atol=1e-5)
+    # both shards cached the restarted prompt
+    for engine in (first, last): self.assertIn(prefix_key(prompt), engine.prefix_cache.entries)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+from types import SimpleNamespace
+import numpy as np
+from tinygrad import Tensor, dtypes
+from exo.inference.shard import Shard
+from exo.inference.tinygrad.stateful_model import KVCachePool, PagedModelState
+from exo.inference.tinygrad.models.llama import update_paged_cache
+from exo.inference.tinygrad.testing import tiny_model
+
+LAYERS = [SimpleNamespace(n_kv_heads=2, head_dim=4, max_context=64) for _ in range(3)]
+
+
+class TestKVCachePool(unittest.TestCase):
+  def setUp(self):
+    self.x = Tensor.zeros(1, 1, 8, dtype=dtypes.float32)
+
+  def test_pages_grow_with_the_request(self):
+    pool = KVCachePool(page_size=4)
+    self.assertEqual(len(pool.ensure("a", self.x, LAYERS, 5)), 2)
+    self.assertEqual(len(pool.ensure("a", self.x, LAYERS, 8)), 2)
+    self.assertEqual(len(pool.ensure("a", self.x, LAYERS, 9)), 3)
+    self.assertEqual(pool.stats()["pages_in_use"], 3)
+    self.assertEqual(pool.stats()["bytes_in_use"], 3*3*2*4*2*4*4)
+
+  def test_released_pages_are_reused(self):
+    pool = KVCachePool(page_size=4, max_pages=2)
+    pool.ensure("a", self.x, LAYERS, 8)
+    self.assertFalse(pool.fits("b", self.x, LAYERS, 1))
+    with self.assertRaises(MemoryError):
+      pool.ensure("b", self.x, LAYERS, 1)
+    pool.release("a")
+    self.assertEqual(pool.stats()["pages_free"], 2)
+    pool.ensure("b", self.x, LAYERS, 8)
+    self.assertEqual(pool.stats()["pages_allocated"], 2)
+    self.assertEqual(pool.stats()["requests"], 1)
+
+  def test_max_bytes(self):
+    pool = KVCachePool(page_size=4, max_bytes=2*3*2*4*2*4*4)
+    self.assertTrue(pool.fits("a", self.x, LAYERS, 8))
+    self.assertEqual(pool.max_pages, 2)
+    self.assertFalse(pool.fits("a", self.x, LAYERS, 9))
+
+  def test_paged_cache_matches_contiguous(self):
+    pool = KVCachePool(page_size=4)
+    state = PagedModelState(pool.ensure("a", self.x, LAYERS, 10))
+    xk, xv = Tensor.rand(1, 6, 2, 4), Tensor.rand(1, 6, 2, 4)
+    update_paged_cache(state.cache[0], xk, xv, 0)
+    xk2, xv2 = Tensor.rand(1, 4, 2, 4), Tensor.rand(1, 4, 2, 4)
+    keys, values = update_paged_cache(state.cache[0], xk2, xv2, 6)
+    self.assertEqual(keys.shape, (1, 10, 2, 4))
+    self.assertTrue((keys == xk.cat(xk2, dim=1)).all().item())
+    self.assertTrue((values == xv.cat(xv2, dim=1)).all().item())
+
+
+class TestPagedDecode(unittest.TestCase):
+  def setUp(self):
+    self.model = tiny_model(Shard("tiny", 0, 1, 2))
+    self.layers = [l.attention for l in self.model.layers]
+    self.pool = KVCachePool(page_size=4)
+
+  def reference(self, tokens):
+    return self.model.forward_base(self.model.embed(Tensor([tokens])), 0, self.model.null_cache).numpy()[0]
+
+  def prefill(self, request_id, tokens):
+    h = self.model.embed(Tensor([tokens]))
+    state = PagedModelState(self.pool.ensure(request_id, h, self.layers, len(tokens)))
+    self.model.forward(h, 0, state.cache)
+    state.start = len(tokens)
+    return state
+
+  def test_decode_steps_match_the_full_forward_and_run_jitted(self):
+    tokens = [1, 5, 7, 3, 2, 9, 4, 8, 6, 11]
+    state, outs = self.prefill("a", tokens[:3]), []
+    for token in tokens[3:]:
+      h = self.model.embed(Tensor([[token]]))
+      state.pages = self.pool.ensure("a", h, self.layers, state.start + 1)
+      outs.append(self.model.forward(h, state.start, state.cache).numpy()[:, -1])
+      state.start += 1
+    np.testing.assert_allclose(np.concatenate(outs), self.reference(tokens)[3:], atol=1e-5)
+    # positions 4-7 span two pages: run, capture, then replayed by the jit
+    self.assertIsNotNone(self.model.decode.jits[(2,)].captured)
+
+  def test_batched_decode_matches_single_requests(self):
+    prompts = {"a": [1, 5, 7, 3, 2], "b": [3, 3, 9, 1, 14], "c": [2, 4, 6, 8, 10]}
+    states = {r: self.prefill(r, tokens[:2]) for r, tokens in prompts.items()}
+    outs = {r: [] for r in prompts}
+    for i in range(2, 5):
+      h = self.model.embed(Tensor([[tokens[i]] for tokens in prompts.values()]))
+      for b, r in enumerate(prompts): states[r].pages = self.pool.ensure(r, h[b:b+1], self.layers, states[r].start + 1)
+      out = self.model.decode(h, [states[r].start for r in prompts], [states[r].cache for r in prompts]).numpy()
+      for b, r in enumerate(prompts):
+        outs[r].append(out[b:b+1, -1])
+        states[r].start += 1
+    for r, tokens in prompts.items():
+      np.testing.assert_allclose(np.concatenate(outs[r]), self.reference(tokens)[2:], atol=1e-5)
+    self.assertIsNotNone(self.model.decode.jits[(1, 1, 1)].captured)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+from tinygrad import Tensor, dtypes
+from exo.inference.shard import Shard
+from exo.inference.tinygrad import inference, testing
+from exo.inference.tinygrad.inference import TinygradDynamicShardInferenceEngine
+
+
+class RecordingModel:
+  layers = []
+
+  def __init__(self, fail: bool = False):
+    self.tok_embeddings = SimpleNamespace(weight=Tensor.zeros(16, 8, dtype=dtypes.float16))
+    self.inputs = []
+    self.fail = fail
+
+  def embed(self, x):
+    return x.cast(dtypes.float16).unsqueeze(-1).expand(*x.shape, 8)
+
+  def forward(self, h, start_pos, cache):
+    if self.fail: raise MemoryError("out of memory")
+    self.inputs.append((start_pos, h.shape, h.dtype))
+    return h*1
+
+
+def make_engine(shard: Shard, model: RecordingModel) -> TinygradDynamicShardInferenceEngine:
+  return testing.make_engine(shard, model, prefill_chunk_size=4)
+
+
+class TestWarmup(unittest.TestCase):
+  def test_a_prompt_chunk_and_decode_steps_are_run(self):
+    shard = Shard("dummy", 0, 3, 8)
+    engine = make_engine(shard, RecordingModel())
+    with mock.patch.object(inference, "WARMUP_DECODE_STEPS", 2):
+      engine.warmup(shard)
+    self.assertEqual(engine.model.inputs, [(0, (1, 4, 8), dtypes.float16), (4, (1, 1, 8), dtypes.float16), (5, (1, 1, 8), dtypes.float16)])
+    self.assertEqual(len(engine.states), 0)
+    self.assertEqual(engine.kv_pool.stats()["requests"], 0)
+
+  def test_later_shards_are_warmed_with_hidden_states(self):
+    shard = Shard("dummy", 4, 7, 8)
+    engine = make_engine(shard, RecordingModel())
+    with mock.patch.object(inference, "WARMUP_DECODE_STEPS", 1):
+      engine.warmup(shard)
+    self.assertEqual(engine.model.inputs[0], (0, (1, 4, 8), dtypes.float16))
+
+  def test_failed_warmup_does_not_fail_the_shard(self):
+    shard = Shard("dummy", 0, 3, 8)
+    engine = make_engine(shard, RecordingModel(fail=True))
+    engine.warmup(shard)
+    self.assertEqual(len(engine.states), 0)
+    self.assertEqual(engine.kv_pool.stats()["requests"], 0)
+
+  def test_warmup_can_be_disabled(self):
+    shard = Shard("dummy", 0, 3, 8)
+    model = RecordingModel()
+    engine = make_engine(shard, model)
+    with mock.patch.object(inference, "WARMUP_DECODE_STEPS", 0):
+      engine.warmup(shard)
+    self.assertEqual(model.inputs, [])
+
+
+class TestJittedWarmup(unittest.IsolatedAsyncioTestCase):
+  async def test_loading_a_shard_captures_the_decode_graph(self):
+    shard = Shard("tiny", 0, 1, 2)
+    model = testing.tiny_model(shard)
+    downloader = mock.AsyncMock()
+    downloader.ensure_shard.return_value = Path("tiny")
+    engine = TinygradDynamicShardInferenceEngine(downloader, prefill_chunk_size=4)
+    engine.model_cache.max_bytes = 0
+    with mock.patch.object(inference, "build_transformer", return_value=model), mock.patch.object(inference, "resolve_tokenizer", mock.AsyncMock()), \
+         mock.patch.object(inference, "get_repo", return_value=None), mock.patch.object(inference, "KV_PAGE_SIZE", 4), mock.patch.object(inference, "WARMUP_DECODE_STEPS", 2):
+      loaded = await engine.ensure_shard(shard)
+
+    # both decode steps start in the second page, the second one captured the graph
+    self.assertEqual(list(model.decode.jits), [(2,)])
+    self.assertIsNotNone(model.decode.jits[(2,)].captured)
+    self.assertEqual((len(loaded.states), loaded.kv_pool.stats()["requests"]), (0, 0))
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,22 @@
+from collections import OrderedDict
+from typing import Any, Optional
+from tinygrad import Tensor
+from exo.inference.shard import Shard
+from exo.inference.tinygrad.inference import LoadedShard, TinygradDynamicShardInferenceEngine
+from exo.inference.tinygrad.models.llama import Transformer, TransformerShard
+from exo.inference.tinygrad.stateful_model import KVCachePool
+
+
+def tiny_model(shard: Shard) -> TransformerShard:
+  """shard of a two layer llama with random weights, the same ones on every call."""
+  Tensor.manual_seed(0)
+  base = Transformer(dim=16, hidden_dim=32, n_heads=4, n_layers=2, norm_eps=1e-5, vocab_size=32, shard=shard, n_kv_heads=2, max_context=64)
+  return TransformerShard(shard, base)
+
+
+def make_engine(shard: Shard, model: Any = None, prefill_chunk_size: int = 0, max_pages: Optional[int] = None) -> TinygradDynamicShardInferenceEngine:
+  """An engine that has shard loaded, with model or the tiny llama, and kv cache pages of 4 positions."""
+  engine = TinygradDynamicShardInferenceEngine(None, prefill_chunk_size=prefill_chunk_size)
+  kv_pool = KVCachePool(page_size=4, max_pages=max_pages)
+  engine.model_cache.put(shard, LoadedShard(tiny_model(shard) if model is None else model, None, OrderedDict(), kv_pool, engine.make_prefix_cache(kv_pool)), 0)
+  return engine
@@ -1,8 +1,11 @@
+import os
+import asyncio
 import traceback
 from aiofiles import os as aios
+from collections import OrderedDict
 from os import PathLike
 from pathlib import Path
-from typing import Union
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Union
 from transformers import AutoTokenizer, AutoProcessor
 import numpy as np
 from exo.download.hf.hf_helpers import get_local_snapshot_dir
@@ -24,9 +27,63 @@ class DummyTokenizer:
     return "dummy" * len(tokens)
 
 
-async def resolve_tokenizer(model_id: str):
+TOKENIZER_CACHE_SIZE = int(os.getenv("TOKENIZER_CACHE_SIZE", default="8"))
+
+
+class TokenizerCache:
+  """
+  Process-wide LRU of loaded tokenizers. Callers that ask for a tokenizer while it is loading wait for that
+  load instead of starting their own.
+  """
+  def __init__(self, max_size: int = TOKENIZER_CACHE_SIZE):
+    self.max_size = max_size
+    self.tokenizers: OrderedDict[Hashable, Any] = OrderedDict()
+    self.loading: Dict[Hashable, asyncio.Future] = {}
+    self.hits = 0
+    self.misses = 0
+
+  async def get(self, key: Hashable, load: Callable[[], Awaitable[Any]]) -> Any:
+    if key in self.tokenizers:
+      self.hits += 1
+      self.tokenizers.move_to_end(key)
+      return self.tokenizers[key]
+    future = self.loading.get(key)
+    if future is None:
+      self.misses += 1
+      future = self.loading[key] = asyncio.ensure_future(load())
+      future.add_done_callback(lambda f: self._loaded(key, f))
+    # a caller that gives up must not cancel the load for the others
+    return await asyncio.shield(future)
+
+  def _loaded(self, key: Hashable, future: asyncio.Future) -> None:
+    self.loading.pop(key, None)
+    if future.cancelled() or future.exception() is not None: return
+    self.tokenizers[key] = future.result()
+    if len(self.tokenizers) > self.max_size: self.tokenizers.popitem(last=False)
+
+  def clear(self) -> None:
+    self.tokenizers.clear()
+
+  def stats(self) -> dict:
+    return {"size": len(self.tokenizers), "loading": len(self.loading), "hits": self.hits, "misses": self.misses}
+
+
+tokenizer_cache = TokenizerCache()
+
+
+async def resolve_tokenizer(model_id: str, inference_engine_classname: Optional[str] = None, local_path: Optional[Union[str, PathLike]] = None):
+  """
+  The tokenizer for model_id, loaded once per process and engine. Engines that already have the model on disk
+  pass local_path so it is loaded from there, everyone else shares the same instance.
+  """
   if model_id == "dummy":
     return DummyTokenizer()
+  return await tokenizer_cache.get((str(model_id), inference_engine_classname), lambda: _load_tokenizer(model_id, local_path))
+
+
+async def _load_tokenizer(model_id: str, local_path: Optional[Union[str, PathLike]] = None):
+  if local_path is not None:
+    return await _resolve_tokenizer(local_path)
   local_path = await get_local_snapshot_dir(model_id)
   if DEBUG >= 2: print(f"Checking if local path exists to load tokenizer from local {local_path=}")
   try:
@@ -17,10 +17,12 @@ from exo.train.dataset import load_dataset, iterate_batches, compose
 from exo.networking.manual.manual_discovery import ManualDiscovery
 from exo.networking.manual.network_topology_config import NetworkTopology
 from exo.orchestration.node import Node
+from exo.orchestration.request_store import RequestStore
 from exo.networking.grpc.grpc_server import GRPCServer
 from exo.networking.udp.udp_discovery import UDPDiscovery
 from exo.networking.tailscale.tailscale_discovery import TailscaleDiscovery
 from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.shared_memory_peer_handle import SharedMemoryPeerHandle
 from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
 from exo.api import ChatGPTAPI
 from exo.download.shard_download import ShardDownloader, RepoProgressEvent, NoopShardDownloader
@@ -29,6 +31,7 @@ from exo.helpers import print_yellow_exo, find_available_port, DEBUG, get_system
 from exo.inference.shard import Shard
 from exo.inference.inference_engine import get_inference_engine, InferenceEngine
 from exo.inference.tokenizers import resolve_tokenizer
+from exo.inference.detokenizer import IncrementalDetokenizer
 from exo.models import build_base_shard, get_repo
 from exo.viz.topology_viz import TopologyViz
 from exo.download.hf.hf_helpers import has_hf_home_read_access, has_hf_home_write_access, get_hf_home, move_models_to_hf
@@ -87,6 +90,7 @@ parser.add_argument("--save-checkpoint-dir", type=str, default="checkpoints", he
 parser.add_argument("--node-id", type=str, default=None, help="Node ID")
 parser.add_argument("--node-host", type=str, default="0.0.0.0", help="Node host")
 parser.add_argument("--node-port", type=int, default=None, help="Node port")
+parser.add_argument("--unix-socket-path", type=str, default=None, help="Also serve gRPC on this unix domain socket, used instead of TCP by peers on the same host")
 parser.add_argument("--models-seed-dir", type=str, default=None, help="Model seed directory")
 parser.add_argument("--listen-port", type=int, default=5678, help="Listening port for discovery")
 parser.add_argument("--download-quick-check", action="store_true", help="Quick check local path for model shards download")
@@ -99,7 +103,17 @@ parser.add_argument("--wait-for-peers", type=int, default=0, help="Number of pee
 parser.add_argument("--chatgpt-api-port", type=int, default=52415, help="ChatGPT API port")
 parser.add_argument("--chatgpt-api-response-timeout", type=int, default=90, help="ChatGPT API response timeout in seconds")
 parser.add_argument("--max-generate-tokens", type=int, default=10000, help="Max tokens to generate in each request")
+parser.add_argument("--tensor-encoding", type=str, default="raw", help="Encoding of activations sent to peers: raw, or fp16, bf16 or int8 (lossy), optionally +lz4 or +zstd (e.g. fp16+zstd)")
+parser.add_argument("--prefill-chunk-size", type=int, default=512, help="Split prompts longer than this many tokens into chunks that are prefilled through the ring as a pipeline (0 to disable)")
+parser.add_argument("--speculative-tokens", type=int, default=0, help="Draft this many tokens per step with a small local model and verify them in one pass through the ring (0 to disable, greedy sampling only)")
+parser.add_argument("--request-state-ttl", type=float, default=60.0, help="Seconds to keep the buffered tokens and other per-request state of a finished request")
+parser.add_argument("--max-request-states", type=int, default=10000, help="Max number of requests to keep per-request state for, the least recently used are dropped first")
+parser.add_argument("--max-concurrent-requests", type=int, default=8, help="Max number of API requests generating at once, the rest wait in a queue (0 for no limit). The mlx engine keeps kv caches for MLX_MAX_KV_CACHES (16) requests")
+parser.add_argument("--max-queued-requests", type=int, default=64, help="Reject API requests with 429 once this many are waiting")
+parser.add_argument("--max-batch-size", type=int, default=8, help="Max number of concurrent requests batched into one inference engine call")
 parser.add_argument("--inference-engine", type=str, default=None, help="Inference engine to use (mlx, tinygrad, or dummy)")
+parser.add_argument("--disable-shared-memory", action=argparse.BooleanOptionalAction, help="Send tensors to peers on the same host over gRPC instead of shared memory")
+parser.add_argument("--broadcast-results", action=argparse.BooleanOptionalAction, help="Send generated tokens to every node (e.g. so every TUI shows all requests) instead of only to the node that received the request")
 parser.add_argument("--disable-tui", action=argparse.BooleanOptionalAction, help="Disable TUI")
 parser.add_argument("--run-model", type=str, help="Specify a model to run directly")
 parser.add_argument("--prompt", type=str, help="Prompt for the model when using --run-model", default="Who are you?")
@@ -144,13 +158,14 @@ if DEBUG >= 0:
 allowed_node_ids = args.node_id_filter.split(',') if args.node_id_filter else None
 allowed_interface_types = args.interface_type_filter.split(',') if args.interface_type_filter else None
 
+peer_handle_class = GRPCPeerHandle if args.disable_shared_memory else SharedMemoryPeerHandle
 if args.discovery_module == "udp":
   discovery = UDPDiscovery(
     args.node_id,
     args.node_port,
     args.listen_port,
     args.broadcast_port,
-    lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities),
+    lambda peer_id, address, description, device_capabilities: peer_handle_class(peer_id, address, description, device_capabilities, tensor_encoding=args.tensor_encoding),
     discovery_timeout=args.discovery_timeout,
     allowed_node_ids=allowed_node_ids,
     allowed_interface_types=allowed_interface_types
@@ -159,7 +174,7 @@ elif args.discovery_module == "tailscale":
   discovery = TailscaleDiscovery(
     args.node_id,
     args.node_port,
-    lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities),
+    lambda peer_id, address, description, device_capabilities: peer_handle_class(peer_id, address, description, device_capabilities, tensor_encoding=args.tensor_encoding),
     discovery_timeout=args.discovery_timeout,
     tailscale_api_key=args.tailscale_api_key,
     tailnet=args.tailnet_name,
@@ -168,7 +183,7 @@ elif args.discovery_module == "tailscale":
 elif args.discovery_module == "manual":
   if not args.discovery_config_path:
     raise ValueError(f"--discovery-config-path is required when using manual discovery. Please provide a path to a config json file.")
-  discovery = ManualDiscovery(args.discovery_config_path, args.node_id, create_peer_handle=lambda peer_id, address, description, device_capabilities: GRPCPeerHandle(peer_id, address, description, device_capabilities))
+  discovery = ManualDiscovery(args.discovery_config_path, args.node_id, create_peer_handle=lambda peer_id, address, description, device_capabilities: peer_handle_class(peer_id, address, description, device_capabilities, tensor_encoding=args.tensor_encoding))
 topology_viz = TopologyViz(chatgpt_api_endpoints=chatgpt_api_endpoints, web_chat_urls=web_chat_urls) if not args.disable_tui else None
 node = Node(
   args.node_id,
@@ -179,9 +194,15 @@ node = Node(
   max_generate_tokens=args.max_generate_tokens,
   topology_viz=topology_viz,
   shard_downloader=shard_downloader,
-  default_sample_temperature=args.default_temp
+  default_sample_temperature=args.default_temp,
+  max_batch_size=args.max_batch_size,
+  broadcast_results=args.broadcast_results,
+  prefill_chunk_size=args.prefill_chunk_size,
+  speculative_tokens=args.speculative_tokens,
+  request_state_ttl=args.request_state_ttl,
+  max_request_states=args.max_request_states,
 )
-server = GRPCServer(node, args.node_host, args.node_port)
+server = GRPCServer(node, args.node_host, args.node_port, unix_socket_path=args.unix_socket_path)
 node.server = server
 api = ChatGPTAPI(
   node,
@@ -189,24 +210,49 @@ api = ChatGPTAPI(
   response_timeout=args.chatgpt_api_response_timeout,
   on_chat_completion_request=lambda req_id, __, prompt: topology_viz.update_prompt(req_id, prompt) if topology_viz else None,
   default_model=args.default_model,
-  system_prompt=args.system_prompt
+  system_prompt=args.system_prompt,
+  max_concurrent_requests=args.max_concurrent_requests,
+  max_queued_requests=args.max_queued_requests,
 )
-buffered_token_output = {}
-def update_topology_viz(req_id, tokens, __):
-  if not topology_viz: return
-  if not inference_engine.shard: return
-  if inference_engine.shard.model_id == 'stable-diffusion-2-1-base': return
-
-  if req_id in buffered_token_output: buffered_token_output[req_id].extend(tokens)
-  else: buffered_token_output[req_id] = tokens
-  topology_viz.update_prompt_output(req_id, inference_engine.tokenizer.decode(buffered_token_output[req_id]))
+viz_outputs = RequestStore()
+def start_topology_viz_output(req_id, status):
+  if not topology_viz or req_id in viz_outputs: return
+  if status.get("type") != "node_status" or status.get("status") != "start_process_prompt": return
+  model_id = status["base_shard"].model_id
+  if model_id == 'stable-diffusion-2-1-base': return
+  # the engine's tokenizer belongs to whichever shard it loaded last, the output is decoded with the one of the request's model
+  inference_class = inference_engine.__class__.__name__
+  tokenizer = asyncio.create_task(resolve_tokenizer(get_repo(model_id, inference_class), inference_class))
+  # tokens are held back until the tokenizer is resolved
+  viz_outputs[req_id] = (tokenizer, [], [])
+  tokenizer.add_done_callback(lambda _: update_topology_viz(req_id, [], False))
+node.on_status.register("start_topology_viz_output").on_next(start_topology_viz_output)
+
+def update_topology_viz(req_id, tokens, is_finished):
+  if not topology_viz or req_id not in viz_outputs: return
+  detokenizer, pending, output = viz_outputs[req_id]
+  if tokens or is_finished: pending.append((tokens, is_finished))
+  if isinstance(detokenizer, asyncio.Task):
+    if not detokenizer.done(): return
+    if detokenizer.cancelled() or detokenizer.exception() is not None:
+      if DEBUG >= 2: print(f"Failed to resolve the tokenizer for {req_id=}, its output is not shown")
+      viz_outputs.pop(req_id, None)
+      return
+    detokenizer = IncrementalDetokenizer(detokenizer.result())
+    viz_outputs[req_id] = (detokenizer, pending, output)
+  for tokens, is_finished in pending:
+    output.append(detokenizer.add(tokens))
+    if is_finished:
+      output.append(detokenizer.flush())
+      viz_outputs.finish(req_id)
+  pending.clear()
+  topology_viz.update_prompt_output(req_id, "".join(output))
 node.on_token.register("update_topology_viz").on_next(update_topology_viz)
 
-def preemptively_start_download(request_id: str, opaque_status: str):
+def preemptively_start_download(request_id: str, status: dict):
   try:
-    status = json.loads(opaque_status)
     if status.get("type") == "node_status" and status.get("status") == "start_process_prompt":
-      current_shard = node.get_current_shard(Shard.from_dict(status.get("shard")))
+      current_shard = node.get_current_shard(status.get("shard"))
       if DEBUG >= 2: print(f"Preemptively starting download for {current_shard}")
       asyncio.create_task(shard_downloader.ensure_shard(current_shard, inference_engine.__class__.__name__))
   except Exception as e:
@@ -215,7 +261,7 @@ def preemptively_start_download(request_id: str, opaque_status: str):
       traceback.print_exc()
 
 
-node.on_opaque_status.register("start_download").on_next(preemptively_start_download)
+node.on_status.register("start_download").on_next(preemptively_start_download)
 
 last_broadcast_time = 0
 
@@ -225,7 +271,7 @@ def throttled_broadcast(shard: Shard, event: RepoProgressEvent):
   current_time = time.time()
   if event.status == "complete" or current_time - last_broadcast_time >= 0.1:
     last_broadcast_time = current_time
-    asyncio.create_task(node.broadcast_opaque_status("", json.dumps({"type": "download_progress", "node_id": node.id, "progress": event.to_dict()})))
+    node.broadcast_status("", {"type": "download_progress", "node_id": node.id, "progress": event})
 
 
 shard_downloader.on_progress.register("broadcast").on_next(throttled_broadcast)
@@ -236,7 +282,7 @@ async def run_model_cli(node: Node, inference_engine: InferenceEngine, model_nam
   if not shard:
     print(f"Error: Unsupported model '{model_name}' for inference engine {inference_engine.__class__.__name__}")
     return
-  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class))
+  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class), inference_class)
   request_id = str(uuid.uuid4())
   callback_id = f"cli-wait-response-{request_id}"
   callback = node.on_token.register(callback_id)
@@ -291,7 +337,7 @@ async def eval_model_cli(node: Node, inference_engine: InferenceEngine, model_na
   if not shard:
     print(f"Error: Unsupported model '{model_name}' for inference engine {inference_engine.__class__.__name__}")
     return
-  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class))
+  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class), inference_class)
   train, val, test = dataloader(tokenizer.encode)
   print(f"Evaluating {len(test)} examples with batch_size {batch_size}")
   loss, tokens = await run_iter(node, shard, False, test, batch_size)
@@ -305,7 +351,7 @@ async def train_model_cli(node: Node, inference_engine: InferenceEngine, model_n
   if not shard:
     print(f"Error: Unsupported model '{model_name}' for inference engine {inference_engine.__class__.__name__}")
     return
-  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class))
+  tokenizer = await resolve_tokenizer(get_repo(shard.model_id, inference_class), inference_class)
   train, val, test = dataloader(tokenizer.encode)
   print(f"Training on {len(train)} examples with batch_size {batch_size} for {iters} epochs")
   for i in tqdm(range(3)):
@@ -10,24 +10,75 @@ from ..peer_handle import PeerHandle
 from exo.inference.shard import Shard
 from exo.topology.topology import Topology
 from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
-from exo.helpers import DEBUG
+from exo.helpers import DEBUG, get_host_id
+from .tensor_stream import StreamHeaders
+from .state_cache import MAX_CACHED_STATE_REQUESTS, split_cached_state
+from exo.orchestration.request_store import RequestStore
+from .tensor_codec import encode_tensor, decode_tensor, negotiate_encoding, parse_encoding
+from .status_codec import encode_status, status_to_json
+import copy
+import itertools
 import json
+import os
 import platform
 
 if platform.system().lower() == "darwin" and platform.machine().lower() == "arm64":
   import mlx.core as mx
+  array_types = (mx.array, np.ndarray)
 else:
   import numpy as mx
+  array_types = (np.ndarray,)
+
+
+def is_tensor_state(value) -> bool:
+  return isinstance(value, array_types) or (isinstance(value, list) and len(value) > 0 and all(isinstance(item, array_types) for item in value))
+
+
+def state_snapshot(inference_state: Optional[dict]) -> dict:
+  """What a stream header remembers of a state: tensors by reference, everything else as a copy, so changes made in place are seen."""
+  return {k: (list(v) if isinstance(v, list) else v) if is_tensor_state(v) else copy.deepcopy(v) for k, v in (inference_state or {}).items()}
+
+
+def same_state(inference_state: Optional[dict], snapshot: Optional[dict]) -> bool:
+  # tensors are compared by identity, serializing a state to compare its bytes costs as much as sending it
+  state = inference_state or {}
+  if snapshot is None or state.keys() != snapshot.keys(): return False
+  for k, v in state.items():
+    sent = snapshot[k]
+    if isinstance(v, list) and isinstance(sent, list) and is_tensor_state(v) and is_tensor_state(sent):
+      same = len(v) == len(sent) and all(a is b for a, b in zip(v, sent))
+    elif is_tensor_state(v) or is_tensor_state(sent):
+      same = v is sent
+    else:
+      same = v == sent
+    if not same: return False
+  return True
 
 
 class GRPCPeerHandle(PeerHandle):
-  def __init__(self, _id: str, address: str, desc: str, device_capabilities: DeviceCapabilities):
+  def __init__(self, _id: str, address: str, desc: str, device_capabilities: DeviceCapabilities, tensor_encoding: str = "raw"):
     self._id = _id
     self.address = address
+    # where the channel connects, the peer's unix socket once we know it is on our host
+    self.channel_address = address
+    self.unix_socket_supported = True
     self.desc = desc
     self._device_capabilities = device_capabilities
     self.channel = None
     self.stub = None
+    parse_encoding(tensor_encoding)
+    self.tensor_encoding = tensor_encoding
+    # what we actually send is negotiated with the peer on health check, raw until then
+    self.wire_encoding = ""
+    self.host_id = None
+    self.tensor_stream = None
+    self.tensor_stream_supported = True
+    self.tensor_stream_lock = asyncio.Lock()
+    self.tensor_stream_seq = itertools.count()
+    self.status_batch_supported = True
+    # whether the peer keeps request-constant inference state, negotiated on health check like the encoding
+    self.inference_state_cache = False
+    self.sent_inference_state = RequestStore(max_entries=MAX_CACHED_STATE_REQUESTS)
     self.channel_options = [
       ("grpc.max_metadata_size", 64 * 1024 * 1024),
       ("grpc.max_receive_message_length", 256 * 1024 * 1024),
@@ -56,30 +107,10 @@ class GRPCPeerHandle(PeerHandle):
 
   async def connect(self):
     if self.channel is None:
-<<<<<<< HEAD
       self.channel = grpc.aio.insecure_channel(
-        self.address,
+        self.channel_address,
         options=self.channel_options,
         compression=grpc.Compression.Gzip
-=======
-      # Increased message sizes to match server
-      # Added keepalive settings to prevent timeouts
-      # Added retry policy for better reliability
-      self.channel = grpc.aio.insecure_channel(
-        self.address, 
-        options=[
-          ("grpc.max_metadata_size", 128*1024*1024),
-          ('grpc.max_receive_message_length', 128*1024*1024),
-          ('grpc.max_send_message_length', 128*1024*1024),
-          ('grpc.keepalive_time_ms', 20000),  # Send keepalive ping every 20 seconds
-          ('grpc.keepalive_timeout_ms', 10000),  # Wait 10 seconds for keepalive ping response
-          ('grpc.keepalive_permit_without_calls', True),  # Allow keepalive pings when no calls are in-flight
-          ('grpc.http2.min_time_between_pings_ms', 10000),  # Minimum 10 seconds between pings
-          ('grpc.http2.max_pings_without_data', 5),  # Allow up to 5 pings without data
-          ('grpc.enable_retries', 1),
-          ('grpc.service_config', '{"retryPolicy": { "maxAttempts": 4, "initialBackoff": "0.1s", "maxBackoff": "1s", "backoffMultiplier": 2.0, "retryableStatusCodes": ["UNAVAILABLE"]}}'),
-        ]
->>>>>>> 64d1bc4262a715b90f5f8c84e1655fa05de33574
       )
       self.stub = node_service_pb2_grpc.NodeServiceStub(self.channel)
     await self.channel.channel_ready()
@@ -88,27 +119,21 @@ class GRPCPeerHandle(PeerHandle):
     return self.channel is not None and self.channel.get_state() == grpc.ChannelConnectivity.READY
 
   async def disconnect(self):
+    if self.tensor_stream is not None:
+      self.tensor_stream.cancel()
+      self.tensor_stream = None
     if self.channel:
       await self.channel.close()
     self.channel = None
     self.stub = None
 
   async def _ensure_connected(self):
-<<<<<<< HEAD
     if not await self.is_connected():
       try:
         await asyncio.wait_for(self.connect(), timeout=10.0)
       except asyncio.TimeoutError:
-        if DEBUG >= 2: print(f"Connection timeout for {self._id}@{self.address}")
+        if DEBUG >= 2: print(f"Connection timeout for {self._id}@{self.channel_address}")
         await self.disconnect()
-=======
-    if not await self.is_connected(): 
-      try:
-        await asyncio.wait_for(self.connect(), timeout=10)  # Increased timeout
-      except asyncio.TimeoutError:
-        if DEBUG >= 4:
-          print(f"Connection timeout for {self._id}@{self.address}")
->>>>>>> 64d1bc4262a715b90f5f8c84e1655fa05de33574
         raise
 
   async def health_check(self) -> bool:
@@ -116,6 +141,10 @@ class GRPCPeerHandle(PeerHandle):
       await self._ensure_connected()
       request = node_service_pb2.HealthCheckRequest()
       response = await asyncio.wait_for(self.stub.HealthCheck(request), timeout=10)  # Increased timeout
+      self.wire_encoding = negotiate_encoding(self.tensor_encoding, response.tensor_encodings)
+      self.host_id = response.host_id or None
+      self.inference_state_cache = response.inference_state_cache
+      await self.prefer_unix_socket(response)
       return response.is_healthy
     except asyncio.TimeoutError:
       return False
@@ -126,6 +155,27 @@ class GRPCPeerHandle(PeerHandle):
         traceback.print_exc()
       return False
 
+  async def prefer_unix_socket(self, response: node_service_pb2.HealthCheckResponse) -> None:
+    channel_address = self.address
+    if self.unix_socket_supported and self.is_same_host() and response.HasField("unix_socket_path") and os.path.exists(response.unix_socket_path):
+      channel_address = f"unix:{response.unix_socket_path}"
+    if channel_address == self.channel_address: return
+    if DEBUG >= 2: print(f"Connecting to {self._id} over {channel_address} instead of {self.channel_address}")
+    await self.disconnect()
+    self.channel_address = channel_address
+    try:
+      await self._ensure_connected()
+    except Exception:
+      if channel_address == self.address: raise
+      if DEBUG >= 1: print(f"Could not connect to {self._id} over {channel_address}, staying on {self.address}")
+      self.unix_socket_supported = False
+      await self.disconnect()
+      self.channel_address = self.address
+      await self._ensure_connected()
+
+  def is_same_host(self) -> bool:
+    return self.host_id is not None and self.host_id == get_host_id()
+
   async def send_prompt(self, shard: Shard, prompt: str, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
     request = node_service_pb2.PromptRequest(
       prompt=prompt,
@@ -141,6 +191,26 @@ class GRPCPeerHandle(PeerHandle):
     await self.stub.SendPrompt(request)
 
   async def send_tensor(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
+    try:
+      return await self._send_tensor(shard, tensor, inference_state, request_id)
+    except Exception as e:
+      if "MissingInferenceState" not in str(e): raise
+      # the peer no longer has what we referenced (restarted, evicted), the tensor was not processed, send it all again
+      if DEBUG >= 1: print(f"{self._id}@{self.address} is missing cached inference state for {request_id=}, resending it: {e}")
+      self.sent_inference_state.pop(request_id, None)
+      return await self._send_tensor(shard, tensor, inference_state, request_id)
+
+  async def _send_tensor(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
+    if self.tensor_stream_supported:
+      try:
+        response = await self.send_tensor_over_stream(shard, tensor, inference_state, request_id)
+        if not response.HasField("tensor"): return None
+        return decode_tensor(response.tensor)
+      except grpc.aio.AioRpcError as e:
+        if e.code() != grpc.StatusCode.UNIMPLEMENTED: raise
+        if DEBUG >= 1: print(f"{self._id}@{self.address} does not support TensorStream, falling back to SendTensor")
+        self.tensor_stream_supported = False
+
     request = node_service_pb2.TensorRequest(
       shard=node_service_pb2.Shard(
         model_id=shard.model_id,
@@ -148,9 +218,9 @@ class GRPCPeerHandle(PeerHandle):
         end_layer=shard.end_layer,
         n_layers=shard.n_layers,
       ),
-      tensor=node_service_pb2.Tensor(tensor_data=tensor.tobytes(), shape=tensor.shape, dtype=str(tensor.dtype)),
+      tensor=self.encode_tensor(tensor),
       request_id=request_id,
-      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state)
+      inference_state=None if inference_state is None else self.serialize_inference_state(inference_state, request_id)
     )
     response = await self.stub.SendTensor(request)
 
@@ -159,6 +229,59 @@ class GRPCPeerHandle(PeerHandle):
 
     return np.frombuffer(response.tensor_data, dtype=np.dtype(response.dtype)).reshape(response.shape)
 
+  async def send_tensor_over_stream(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict], request_id: str) -> node_service_pb2.TensorStreamResponse:
+    request = node_service_pb2.TensorStreamRequest(request_id=request_id, tensor=self.encode_tensor(tensor))
+    async with self.tensor_stream_lock:
+      if self.tensor_stream is None:
+        self.tensor_stream = self.stub.TensorStream()
+        self.tensor_stream_headers = StreamHeaders()
+        self.tensor_stream_responses = {}
+        asyncio.create_task(self.read_tensor_stream(self.tensor_stream, self.tensor_stream_responses))
+      stream, responses = self.tensor_stream, self.tensor_stream_responses
+      # headers are added in write order so both ends of the stream forget the same requests
+      sent_shard, sent_inference_state = self.tensor_stream_headers.get(request_id, (None, None))
+      if shard != sent_shard:
+        request.shard.CopyFrom(node_service_pb2.Shard(model_id=shard.model_id, start_layer=shard.start_layer, end_layer=shard.end_layer, n_layers=shard.n_layers))
+      if not same_state(inference_state, sent_inference_state):
+        request.inference_state.CopyFrom(node_service_pb2.InferenceState() if inference_state is None else self.serialize_inference_state(inference_state, request_id))
+        sent_inference_state = state_snapshot(inference_state)
+      self.tensor_stream_headers.remember(request_id, (shard, sent_inference_state))
+      request.seq = next(self.tensor_stream_seq)
+      future = asyncio.get_running_loop().create_future()
+      responses[request.seq] = future
+      try:
+        await stream.write(request)
+      except Exception:
+        responses.pop(request.seq, None)
+        if self.tensor_stream is stream: self.tensor_stream = None
+        raise
+    try:
+      return await future
+    except RuntimeError:
+      # the peer failed this request and may not have kept its header, send it in full next time
+      async with self.tensor_stream_lock:
+        if self.tensor_stream is stream: self.tensor_stream_headers.pop(request_id, None)
+      raise
+
+  def encode_tensor(self, tensor: np.ndarray) -> node_service_pb2.Tensor:
+    return encode_tensor(tensor, self.wire_encoding)
+
+  async def read_tensor_stream(self, stream, responses: dict):
+    error = ConnectionError(f"TensorStream to {self._id}@{self.address} closed")
+    try:
+      async for response in stream:
+        future = responses.pop(response.seq, None)
+        if future is None or future.done(): continue
+        if response.HasField("error"): future.set_exception(RuntimeError(response.error))
+        else: future.set_result(response)
+    except (Exception, asyncio.CancelledError) as e:
+      if DEBUG >= 2: print(f"TensorStream to {self._id}@{self.address} failed: {e!r}")
+      error = e if isinstance(e, Exception) else error
+    if self.tensor_stream is stream: self.tensor_stream = None
+    for future in responses.values():
+      if not future.done(): future.set_exception(error)
+    responses.clear()
+
   async def send_example(self, shard: Shard, example: np.ndarray, target: np.ndarray, length: np.ndarray, train: bool, request_id: Optional[str] = None) -> Optional[np.array]:
     request = node_service_pb2.ExampleRequest(
       shard=node_service_pb2.Shard(
@@ -221,24 +344,45 @@ class GRPCPeerHandle(PeerHandle):
     request = node_service_pb2.SendResultRequest(request_id=request_id, result=result, tensor=tensor, is_finished=is_finished)
     await self.stub.SendResult(request)
 
+  async def cancel_request(self, request_id: str) -> None:
+    try:
+      await self.stub.CancelRequest(node_service_pb2.CancelRequestRequest(request_id=request_id))
+    except grpc.aio.AioRpcError as e:
+      if e.code() != grpc.StatusCode.UNIMPLEMENTED: raise
+      if DEBUG >= 1: print(f"{self._id}@{self.address} does not support CancelRequest, {request_id=} keeps running there")
+
   async def send_opaque_status(self, request_id: str, status: str) -> None:
     request = node_service_pb2.SendOpaqueStatusRequest(request_id=request_id, status=status)
     await self.stub.SendOpaqueStatus(request)
 
-  def serialize_inference_state(self, inference_state: dict) -> node_service_pb2.InferenceState:
+  async def send_status_batch(self, events: List[Tuple[str, dict]]) -> None:
+    if self.status_batch_supported:
+      try:
+        await self.stub.SendStatusBatch(node_service_pb2.StatusBatch(events=[encode_status(request_id, status) for request_id, status in events]))
+        return
+      except grpc.aio.AioRpcError as e:
+        if e.code() != grpc.StatusCode.UNIMPLEMENTED: raise
+        if DEBUG >= 1: print(f"{self._id}@{self.address} does not support SendStatusBatch, falling back to SendOpaqueStatus")
+        self.status_batch_supported = False
+    for request_id, status in events:
+      await self.send_opaque_status(request_id, status_to_json(status))
+
+  def serialize_inference_state(self, inference_state: dict, request_id: Optional[str] = None) -> node_service_pb2.InferenceState:
     proto_inference_state = node_service_pb2.InferenceState()
+    if request_id is not None and self.inference_state_cache:
+      sent = self.sent_inference_state.get(request_id, {})
+      inference_state, cached_keys = split_cached_state(inference_state, sent)
+      if sent: self.sent_inference_state[request_id] = sent
+      proto_inference_state.cached_keys.extend(cached_keys)
     other_data = {}
     for k, v in inference_state.items():
-      if isinstance(v, mx.array):
-        np_array = np.array(v)
-        tensor_data = node_service_pb2.Tensor(tensor_data=np_array.tobytes(), shape=list(np_array.shape), dtype=str(np_array.dtype))
-        proto_inference_state.tensor_data[k].CopyFrom(tensor_data)
-      elif isinstance(v, list) and all(isinstance(item, mx.array) for item in v):
+      # only activations are quantized, state tensors (e.g. the stable diffusion latents) are sent exactly
+      if isinstance(v, array_types):
+        proto_inference_state.tensor_data[k].CopyFrom(encode_tensor(np.array(v)))
+      elif isinstance(v, list) and all(isinstance(item, array_types) for item in v):
         tensor_list = node_service_pb2.TensorList()
         for tensor in v:
-          np_array = np.array(tensor)
-          tensor_data = node_service_pb2.Tensor(tensor_data=np_array.tobytes(), shape=list(np_array.shape), dtype=str(np_array.dtype))
-          tensor_list.tensors.append(tensor_data)
+          tensor_list.tensors.append(encode_tensor(np.array(tensor)))
         proto_inference_state.tensor_list_data[k].CopyFrom(tensor_list)
       else:
         # For non-tensor data, we'll still use JSON
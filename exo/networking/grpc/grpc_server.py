@@ -1,35 +1,50 @@
 import grpc
 from concurrent import futures
 import numpy as np
+import asyncio
 from asyncio import CancelledError
 
+import os
 import platform
+import traceback
+from typing import Optional
 
 from . import node_service_pb2
 from . import node_service_pb2_grpc
 from exo import DEBUG
+from exo.helpers import get_host_id
 from exo.inference.shard import Shard
 from exo.orchestration import Node
+from .tensor_stream import StreamHeaders
+from .state_cache import MAX_CACHED_STATE_REQUESTS, MissingInferenceState, restore_cached_state
+from exo.orchestration.request_store import RequestStore
+from .tensor_codec import decode_tensor, supported_encodings
+from .status_codec import decode_status, status_from_json
 import json
 
 if platform.system().lower() == "darwin" and platform.machine().lower() == "arm64":
   import mlx.core as mx
+  # the one upload of state tensors, the engine computes with these directly
+  state_array = mx.array
 else:
-  import numpy as mx
+  # engines take numpy state as is, the decoded view needs no further copy
+  state_array = np.asarray
 
 
 class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
-  def __init__(self, node: Node, host: str, port: int):
+  def __init__(self, node: Node, host: str, port: int, unix_socket_path: Optional[str] = None):
     self.node = node
     self.host = host
     self.port = port
+    self.unix_socket_path = unix_socket_path
     self.server = None
+    # request-constant inference state peers sent us, so later messages only need to reference it
+    self.received_inference_state = RequestStore(max_entries=MAX_CACHED_STATE_REQUESTS)
 
   async def start(self) -> None:
     self.server = grpc.aio.server(
       futures.ThreadPoolExecutor(max_workers=32),
       options=[
-<<<<<<< HEAD
         ("grpc.max_metadata_size", 32*1024*1024),
         ("grpc.max_send_message_length", 256*1024*1024),
         ("grpc.max_receive_message_length", 256*1024*1024),
@@ -41,26 +56,17 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
         ("grpc.max_concurrent_streams", 100),
         ("grpc.tcp_nodelay", 1),
         ("grpc.optimization_target", "throughput"),
-=======
-        ("grpc.max_metadata_size", 128*1024*1024),
-        ("grpc.max_send_message_length", 128*1024*1024),
-        ("grpc.max_receive_message_length", 128*1024*1024),
-        ('grpc.keepalive_time_ms', 20000),  # Send keepalive ping every 20 seconds
-        ('grpc.keepalive_timeout_ms', 10000),  # Wait 10 seconds for keepalive ping response
-        ('grpc.keepalive_permit_without_calls', True),  # Allow keepalive pings when no calls are in-flight
-        ('grpc.http2.min_time_between_pings_ms', 10000),  # Minimum 10 seconds between pings
-        ('grpc.http2.max_pings_without_data', 5),  # Allow up to 5 pings without data
-        ('grpc.max_connection_idle_ms', 60000),  # Close idle connections after 60 seconds
-        ('grpc.max_connection_age_ms', 300000),  # Close connections after 5 minutes
-        ('grpc.max_connection_age_grace_ms', 5000),  # Grace period of 5 seconds for connection closure
->>>>>>> 64d1bc4262a715b90f5f8c84e1655fa05de33574
       ],
     )
     node_service_pb2_grpc.add_NodeServiceServicer_to_server(self, self.server)
     listen_addr = f"{self.host}:{self.port}"
     self.server.add_insecure_port(listen_addr)
+    if self.unix_socket_path:
+      # a socket file left behind by a previous run would make the bind fail
+      if os.path.exists(self.unix_socket_path): os.unlink(self.unix_socket_path)
+      self.server.add_insecure_port(f"unix:{self.unix_socket_path}")
     await self.server.start()
-    if DEBUG >= 1: print(f"Server started, listening on {listen_addr}")
+    if DEBUG >= 1: print(f"Server started, listening on {listen_addr}" + (f" and unix:{self.unix_socket_path}" if self.unix_socket_path else ""))
 
   async def stop(self) -> None:
     if self.server:
@@ -69,6 +75,7 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
         await self.server.wait_for_termination()
       except CancelledError:
         pass
+      if self.unix_socket_path and os.path.exists(self.unix_socket_path): os.unlink(self.unix_socket_path)
       if DEBUG >= 1: print("Server stopped and all connections are closed")
 
   async def SendPrompt(self, request, context):
@@ -80,7 +87,7 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     )
     prompt = request.prompt
     request_id = request.request_id
-    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state)
+    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state, request_id)
     result = await self.node.process_prompt(shard, prompt, request_id, inference_state)
     if DEBUG >= 5: print(f"SendPrompt {shard=} {prompt=} {request_id=} result: {result}")
     tensor_data = result.tobytes() if result is not None else None
@@ -93,16 +100,74 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
       end_layer=request.shard.end_layer,
       n_layers=request.shard.n_layers,
     )
-    tensor = np.frombuffer(request.tensor.tensor_data, dtype=np.dtype(request.tensor.dtype)).reshape(request.tensor.shape)
     request_id = request.request_id
-
-    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state)
+    # before the tensor, so a tensor in shared memory is still there when the sender has to resend the state
+    inference_state = None if request.inference_state is None else self.deserialize_inference_state(request.inference_state, request_id)
+    tensor = decode_tensor(request.tensor)
 
     result = await self.node.process_tensor(shard, tensor, request_id, inference_state)
     if DEBUG >= 5: print(f"SendTensor tensor {shard=} {tensor=} {request_id=} result: {result}")
     tensor_data = result.tobytes() if result is not None else None
     return node_service_pb2.Tensor(tensor_data=tensor_data, shape=result.shape, dtype=str(result.dtype)) if result is not None else node_service_pb2.Tensor()
 
+  async def TensorStream(self, request_iterator, context):
+    headers = StreamHeaders()
+    responses = asyncio.Queue()
+
+    async def process(seq: int, shard: Shard, tensor: np.ndarray, request_id: str, inference_state: Optional[dict]):
+      try:
+        result = await self.node.process_tensor(shard, tensor, request_id, inference_state)
+        if DEBUG >= 5: print(f"TensorStream tensor {shard=} {tensor=} {request_id=} result: {result}")
+        tensor_data = None if result is None else node_service_pb2.Tensor(tensor_data=result.tobytes(), shape=result.shape, dtype=str(result.dtype))
+        await responses.put(node_service_pb2.TensorStreamResponse(seq=seq, tensor=tensor_data))
+      except Exception as e:
+        if DEBUG >= 2: traceback.print_exc()
+        await responses.put(node_service_pb2.TensorStreamResponse(seq=seq, error=repr(e)))
+
+    async def read():
+      # requests are multiplexed on the stream, process them concurrently like separate SendTensor calls
+      tasks = set()
+      try:
+        async for request in request_iterator:
+          header = headers.get(request.request_id)
+          shard, inference_state = (None, None) if header is None else header
+          if request.HasField("shard"):
+            shard = Shard(model_id=request.shard.model_id, start_layer=request.shard.start_layer, end_layer=request.shard.end_layer, n_layers=request.shard.n_layers)
+          if request.HasField("inference_state"):
+            try:
+              inference_state = self.deserialize_inference_state(request.inference_state, request.request_id)
+            except Exception as e:
+              # forget the request, the sender drops its header on the error and sends it in full again
+              headers.pop(request.request_id, None)
+              await responses.put(node_service_pb2.TensorStreamResponse(seq=request.seq, error=repr(e)))
+              continue
+          elif header is None:
+            # the sender always sends a request's first state, never process a tensor with a state we lost
+            await responses.put(node_service_pb2.TensorStreamResponse(seq=request.seq, error=f"No inference state for {request.request_id=} on this stream"))
+            continue
+          headers.remember(request.request_id, (shard, inference_state))
+          if shard is None:
+            await responses.put(node_service_pb2.TensorStreamResponse(seq=request.seq, error=f"No shard for {request.request_id=} on this stream"))
+            continue
+          try:
+            tensor = decode_tensor(request.tensor)
+          except Exception as e:
+            await responses.put(node_service_pb2.TensorStreamResponse(seq=request.seq, error=repr(e)))
+            continue
+          task = asyncio.create_task(process(request.seq, shard, tensor, request.request_id, None if inference_state is None else dict(inference_state)))
+          tasks.add(task)
+          task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+      finally:
+        await responses.put(None)
+
+    reader = asyncio.create_task(read())
+    try:
+      while (response := await responses.get()) is not None:
+        yield response
+    finally:
+      reader.cancel()
+
   async def SendExample(self, request, context):
     shard = Shard(
       model_id=request.shard.model_id,
@@ -158,28 +223,46 @@ class GRPCServer(node_service_pb2_grpc.NodeServiceServicer):
     self.node.on_token.trigger_all(request_id, result, is_finished)
     return node_service_pb2.Empty()
 
+  async def CancelRequest(self, request, context):
+    if DEBUG >= 2: print(f"Received CancelRequest request: {request.request_id=}")
+    self.received_inference_state.pop(request.request_id, None)
+    await self.node.cancel(request.request_id)
+    return node_service_pb2.Empty()
+
   async def SendOpaqueStatus(self, request, context):
     request_id = request.request_id
     status = request.status
     if DEBUG >= 8: print(f"Received SendOpaqueStatus request: {request_id=} {status=}")
-    self.node.on_opaque_status.trigger_all(request_id, status)
+    self.node.on_status.trigger_all(request_id, status_from_json(status))
+    return node_service_pb2.Empty()
+
+  async def SendStatusBatch(self, request, context):
+    if DEBUG >= 8: print(f"Received SendStatusBatch request with {len(request.events)} events")
+    for event in request.events:
+      self.node.on_status.trigger_all(*decode_status(event))
     return node_service_pb2.Empty()
 
   async def HealthCheck(self, request, context):
-    return node_service_pb2.HealthCheckResponse(is_healthy=True)
+    return node_service_pb2.HealthCheckResponse(is_healthy=True, tensor_encodings=supported_encodings(), host_id=get_host_id(), unix_socket_path=self.unix_socket_path, inference_state_cache=True)
 
-  def deserialize_inference_state(self, inference_state_proto: node_service_pb2.InferenceState) -> dict:
+  def deserialize_inference_state(self, inference_state_proto: node_service_pb2.InferenceState, request_id: Optional[str] = None) -> dict:
     inference_state = {}
 
     for k, tensor_data in inference_state_proto.tensor_data.items():
-      np_array = np.frombuffer(tensor_data.tensor_data, dtype=tensor_data.dtype).reshape(tensor_data.shape)
-      inference_state[k] = mx.array(np_array)
+      inference_state[k] = state_array(decode_tensor(tensor_data))
 
     for k, tensor_list in inference_state_proto.tensor_list_data.items():
-      inference_state[k] = [mx.array(np.frombuffer(tensor.tensor_data, dtype=tensor.dtype).reshape(tensor.shape)) for tensor in tensor_list.tensors]
+      inference_state[k] = [state_array(decode_tensor(tensor)) for tensor in tensor_list.tensors]
 
     if inference_state_proto.other_data_json:
       other_data = json.loads(inference_state_proto.other_data_json)
       inference_state.update(other_data)
 
+    if request_id is not None:
+      cached = self.received_inference_state.get(request_id, {})
+      restore_cached_state(inference_state, inference_state_proto.cached_keys, cached)
+      if cached: self.received_inference_state[request_id] = cached
+    elif inference_state_proto.cached_keys:
+      raise MissingInferenceState(f"{list(inference_state_proto.cached_keys)} were referenced without a request id")
+
     return inference_state
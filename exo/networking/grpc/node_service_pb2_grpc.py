@@ -44,6 +44,11 @@ class NodeServiceStub(object):
                 request_serializer=node__service__pb2.TensorRequest.SerializeToString,
                 response_deserializer=node__service__pb2.Tensor.FromString,
                 _registered_method=True)
+        self.TensorStream = channel.stream_stream(
+                '/node_service.NodeService/TensorStream',
+                request_serializer=node__service__pb2.TensorStreamRequest.SerializeToString,
+                response_deserializer=node__service__pb2.TensorStreamResponse.FromString,
+                _registered_method=True)
         self.SendExample = channel.unary_unary(
                 '/node_service.NodeService/SendExample',
                 request_serializer=node__service__pb2.ExampleRequest.SerializeToString,
@@ -64,6 +69,16 @@ class NodeServiceStub(object):
                 request_serializer=node__service__pb2.SendOpaqueStatusRequest.SerializeToString,
                 response_deserializer=node__service__pb2.Empty.FromString,
                 _registered_method=True)
+        self.SendStatusBatch = channel.unary_unary(
+                '/node_service.NodeService/SendStatusBatch',
+                request_serializer=node__service__pb2.StatusBatch.SerializeToString,
+                response_deserializer=node__service__pb2.Empty.FromString,
+                _registered_method=True)
+        self.CancelRequest = channel.unary_unary(
+                '/node_service.NodeService/CancelRequest',
+                request_serializer=node__service__pb2.CancelRequestRequest.SerializeToString,
+                response_deserializer=node__service__pb2.Empty.FromString,
+                _registered_method=True)
         self.HealthCheck = channel.unary_unary(
                 '/node_service.NodeService/HealthCheck',
                 request_serializer=node__service__pb2.HealthCheckRequest.SerializeToString,
@@ -86,6 +101,12 @@ class NodeServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def TensorStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def SendExample(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -110,6 +131,18 @@ class NodeServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SendStatusBatch(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def CancelRequest(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def HealthCheck(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -129,6 +162,11 @@ def add_NodeServiceServicer_to_server(servicer, server):
                     request_deserializer=node__service__pb2.TensorRequest.FromString,
                     response_serializer=node__service__pb2.Tensor.SerializeToString,
             ),
+            'TensorStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.TensorStream,
+                    request_deserializer=node__service__pb2.TensorStreamRequest.FromString,
+                    response_serializer=node__service__pb2.TensorStreamResponse.SerializeToString,
+            ),
             'SendExample': grpc.unary_unary_rpc_method_handler(
                     servicer.SendExample,
                     request_deserializer=node__service__pb2.ExampleRequest.FromString,
@@ -149,6 +187,16 @@ def add_NodeServiceServicer_to_server(servicer, server):
                     request_deserializer=node__service__pb2.SendOpaqueStatusRequest.FromString,
                     response_serializer=node__service__pb2.Empty.SerializeToString,
             ),
+            'SendStatusBatch': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendStatusBatch,
+                    request_deserializer=node__service__pb2.StatusBatch.FromString,
+                    response_serializer=node__service__pb2.Empty.SerializeToString,
+            ),
+            'CancelRequest': grpc.unary_unary_rpc_method_handler(
+                    servicer.CancelRequest,
+                    request_deserializer=node__service__pb2.CancelRequestRequest.FromString,
+                    response_serializer=node__service__pb2.Empty.SerializeToString,
+            ),
             'HealthCheck': grpc.unary_unary_rpc_method_handler(
                     servicer.HealthCheck,
                     request_deserializer=node__service__pb2.HealthCheckRequest.FromString,
@@ -219,6 +267,33 @@ class NodeService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def TensorStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(
+            request_iterator,
+            target,
+            '/node_service.NodeService/TensorStream',
+            node__service__pb2.TensorStreamRequest.SerializeToString,
+            node__service__pb2.TensorStreamResponse.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def SendExample(request,
             target,
@@ -327,6 +402,60 @@ class NodeService(object):
             metadata,
             _registered_method=True)
 
+    @staticmethod
+    def SendStatusBatch(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.NodeService/SendStatusBatch',
+            node__service__pb2.StatusBatch.SerializeToString,
+            node__service__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
+    @staticmethod
+    def CancelRequest(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(
+            request,
+            target,
+            '/node_service.NodeService/CancelRequest',
+            node__service__pb2.CancelRequestRequest.SerializeToString,
+            node__service__pb2.Empty.FromString,
+            options,
+            channel_credentials,
+            insecure,
+            call_credentials,
+            compression,
+            wait_for_ready,
+            timeout,
+            metadata,
+            _registered_method=True)
+
     @staticmethod
     def HealthCheck(request,
             target,
@@ -0,0 +1,51 @@
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from . import node_service_pb2
+
+# Tensors with this encoding carry the name of a shared memory segment instead of their data. The sender
+# creates the segment and hands ownership to the receiver, which copies the tensor out and unlinks it.
+SHARED_MEMORY_ENCODING = "shm"
+# Below this size a tensor is cheaper to send inline than to map a segment for
+SHARED_MEMORY_MIN_BYTES = 64*1024
+
+
+class SharedMemoryUnavailable(Exception):
+  pass
+
+
+def write_shared_tensor(array: np.ndarray) -> node_service_pb2.Tensor:
+  array = np.ascontiguousarray(array)
+  shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+  # the receiver unlinks the segment, so this process must not clean it up at exit
+  resource_tracker.unregister(shm._name, "shared_memory")
+  try:
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+  except Exception:
+    shm.close()
+    unlink_shared_tensor(shm.name)
+    raise
+  shm.close()
+  return node_service_pb2.Tensor(tensor_data=shm.name.encode(), shape=array.shape, dtype=str(array.dtype), encoding=SHARED_MEMORY_ENCODING)
+
+
+def read_shared_tensor(tensor: node_service_pb2.Tensor) -> np.ndarray:
+  name = tensor.tensor_data.decode()
+  try:
+    shm = SharedMemory(name=name)
+  except (FileNotFoundError, OSError) as e:
+    raise SharedMemoryUnavailable(f"Cannot open shared memory segment {name}: {e}") from e
+  try:
+    return np.ndarray(tuple(tensor.shape), dtype=np.dtype(tensor.dtype), buffer=shm.buf).copy()
+  finally:
+    shm.close()
+    shm.unlink()
+
+
+def unlink_shared_tensor(name: str) -> None:
+  try:
+    shm = SharedMemory(name=name)
+  except FileNotFoundError:
+    return
+  shm.close()
+  shm.unlink()
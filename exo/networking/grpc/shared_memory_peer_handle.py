@@ -0,0 +1,52 @@
+import numpy as np
+from typing import Optional
+
+from . import node_service_pb2
+from .grpc_peer_handle import GRPCPeerHandle
+from .shared_memory import SHARED_MEMORY_MIN_BYTES, write_shared_tensor, unlink_shared_tensor
+from exo.inference.shard import Shard
+from exo.helpers import DEBUG
+
+
+class SharedTensor:
+  """A tensor already written to shared memory, sent as its segment name."""
+  def __init__(self, tensor: np.ndarray):
+    self.proto = write_shared_tensor(tensor)
+
+  @property
+  def name(self) -> str:
+    return self.proto.tensor_data.decode()
+
+
+class SharedMemoryPeerHandle(GRPCPeerHandle):
+  """
+  A GRPCPeerHandle that hands large tensors to peers on the same host through shared memory, so only
+  the segment name goes over gRPC. Peers on other hosts, and small tensors, are sent as usual.
+  """
+  def __init__(self, *args, min_bytes: int = SHARED_MEMORY_MIN_BYTES, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.min_bytes = min_bytes
+    self.shared_memory_supported = True
+
+  def use_shared_memory(self, tensor: np.ndarray) -> bool:
+    return self.shared_memory_supported and self.is_same_host() and isinstance(tensor, np.ndarray) and tensor.nbytes >= self.min_bytes
+
+  async def send_tensor(self, shard: Shard, tensor: np.ndarray, inference_state: Optional[dict] = None, request_id: Optional[str] = None) -> Optional[np.array]:
+    if not self.use_shared_memory(tensor):
+      return await super().send_tensor(shard, tensor, inference_state, request_id)
+
+    shared_tensor = SharedTensor(tensor)
+    try:
+      return await super().send_tensor(shard, shared_tensor, inference_state, request_id)
+    except Exception as e:
+      # the receiver unlinks the segment once it has read it, so anything left behind is ours to clean up
+      unlink_shared_tensor(shared_tensor.name)
+      if "SharedMemoryUnavailable" not in str(e): raise
+      # same host id but no shared /dev/shm, e.g. separate containers; the tensor was never processed, resend it
+      if DEBUG >= 1: print(f"{self._id}@{self.address} cannot read our shared memory, falling back to gRPC: {e}")
+      self.shared_memory_supported = False
+      return await super().send_tensor(shard, tensor, inference_state, request_id)
+
+  def encode_tensor(self, tensor: np.ndarray) -> node_service_pb2.Tensor:
+    if isinstance(tensor, SharedTensor): return tensor.proto
+    return super().encode_tensor(tensor)
@@ -0,0 +1,36 @@
+from typing import Dict, Tuple
+
+# Inference state entries that no longer change once set for a request, e.g. the stable diffusion prompt
+# conditioning. A peer that has one is sent a reference to it instead of the tensor on every later step.
+REQUEST_CONSTANT_STATE_KEYS = ("conditioning", "mask")
+# Number of requests whose request-constant state each peer handle and server remembers
+MAX_CACHED_STATE_REQUESTS = 256
+
+
+class MissingInferenceState(Exception):
+  pass
+
+
+def split_cached_state(inference_state: dict, sent: Dict[str, object]) -> Tuple[dict, list]:
+  """
+  Splits off the request-constant entries the peer already has, i.e. the very objects last sent to it.
+  sent is updated with what goes out in full, so the next message can reference it.
+  """
+  state, cached_keys = {}, []
+  for k, v in inference_state.items():
+    if k in REQUEST_CONSTANT_STATE_KEYS and v is not None and sent.get(k) is v:
+      cached_keys.append(k)
+      continue
+    if k in REQUEST_CONSTANT_STATE_KEYS and v is not None: sent[k] = v
+    state[k] = v
+  return state, cached_keys
+
+
+def restore_cached_state(inference_state: dict, cached_keys, cached: Dict[str, object]) -> dict:
+  """Fills in the referenced entries from what was received earlier and keeps the ones sent in full for later."""
+  for k in cached_keys:
+    if k not in cached: raise MissingInferenceState(f"{k!r} was referenced but is not cached here")
+    inference_state[k] = cached[k]
+  for k in REQUEST_CONSTANT_STATE_KEYS:
+    if k in inference_state and k not in cached_keys and inference_state[k] is not None: cached[k] = inference_state[k]
+  return inference_state
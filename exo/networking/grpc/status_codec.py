@@ -0,0 +1,121 @@
+import json
+from datetime import timedelta
+from typing import Tuple
+from . import node_service_pb2
+from exo.inference.shard import Shard
+from exo.download.download_progress import RepoProgressEvent, RepoFileProgressEvent
+
+
+def encode_shard(shard: Shard) -> node_service_pb2.Shard:
+  return node_service_pb2.Shard(model_id=shard.model_id, start_layer=shard.start_layer, end_layer=shard.end_layer, n_layers=shard.n_layers)
+
+
+def decode_shard(shard: node_service_pb2.Shard) -> Shard:
+  return Shard(model_id=shard.model_id, start_layer=shard.start_layer, end_layer=shard.end_layer, n_layers=shard.n_layers)
+
+
+def encode_download_progress(node_id: str, event: RepoProgressEvent) -> node_service_pb2.DownloadProgress:
+  return node_service_pb2.DownloadProgress(
+    node_id=node_id,
+    repo_id=event.repo_id,
+    repo_revision=event.repo_revision,
+    completed_files=event.completed_files,
+    total_files=event.total_files,
+    downloaded_bytes=event.downloaded_bytes,
+    downloaded_bytes_this_session=event.downloaded_bytes_this_session,
+    total_bytes=event.total_bytes,
+    overall_speed=event.overall_speed,
+    overall_eta=event.overall_eta.total_seconds(),
+    file_progress={
+      path: node_service_pb2.FileDownloadProgress(
+        repo_id=file.repo_id,
+        repo_revision=file.repo_revision,
+        file_path=file.file_path,
+        downloaded=file.downloaded,
+        downloaded_this_session=file.downloaded_this_session,
+        total=file.total,
+        speed=file.speed,
+        eta=file.eta.total_seconds(),
+        status=file.status,
+      )
+      for path, file in event.file_progress.items()
+    },
+    status=event.status,
+  )
+
+
+def decode_download_progress(progress: node_service_pb2.DownloadProgress) -> RepoProgressEvent:
+  return RepoProgressEvent(
+    repo_id=progress.repo_id,
+    repo_revision=progress.repo_revision,
+    completed_files=progress.completed_files,
+    total_files=progress.total_files,
+    downloaded_bytes=progress.downloaded_bytes,
+    downloaded_bytes_this_session=progress.downloaded_bytes_this_session,
+    total_bytes=progress.total_bytes,
+    overall_speed=progress.overall_speed,
+    overall_eta=timedelta(seconds=progress.overall_eta),
+    file_progress={
+      path: RepoFileProgressEvent(
+        repo_id=file.repo_id,
+        repo_revision=file.repo_revision,
+        file_path=file.file_path,
+        downloaded=file.downloaded,
+        downloaded_this_session=file.downloaded_this_session,
+        total=file.total,
+        speed=file.speed,
+        eta=timedelta(seconds=file.eta),
+        status=file.status,
+      )
+      for path, file in progress.file_progress.items()
+    },
+    status=progress.status,
+  )
+
+
+def encode_status(request_id: str, status: dict) -> node_service_pb2.StatusEvent:
+  status_type = status.get("type")
+  if status_type == "node_status":
+    node_status = node_service_pb2.NodeStatus(node_id=status["node_id"], status=status["status"], base_shard=encode_shard(status["base_shard"]), shard=encode_shard(status["shard"]))
+    if status.get("elapsed_time_ns") is not None: node_status.elapsed_time_ns = status["elapsed_time_ns"]
+    return node_service_pb2.StatusEvent(request_id=request_id, node_status=node_status)
+  if status_type == "download_progress":
+    return node_service_pb2.StatusEvent(request_id=request_id, download_progress=encode_download_progress(status["node_id"], status["progress"]))
+  if status_type == "supported_inference_engines":
+    return node_service_pb2.StatusEvent(
+      request_id=request_id, supported_inference_engines=node_service_pb2.SupportedInferenceEngines(node_id=status["node_id"], engines=status["engines"])
+    )
+  return node_service_pb2.StatusEvent(request_id=request_id, opaque_status=status_to_json(status))
+
+
+def decode_status(event: node_service_pb2.StatusEvent) -> Tuple[str, dict]:
+  kind = event.WhichOneof("event")
+  if kind == "node_status":
+    node_status = event.node_status
+    status = {"type": "node_status", "node_id": node_status.node_id, "status": node_status.status, "base_shard": decode_shard(node_status.base_shard), "shard": decode_shard(node_status.shard)}
+    if node_status.HasField("elapsed_time_ns"): status["elapsed_time_ns"] = node_status.elapsed_time_ns
+    return event.request_id, status
+  if kind == "download_progress":
+    return event.request_id, {"type": "download_progress", "node_id": event.download_progress.node_id, "progress": decode_download_progress(event.download_progress)}
+  if kind == "supported_inference_engines":
+    return event.request_id, {"type": "supported_inference_engines", "node_id": event.supported_inference_engines.node_id, "engines": list(event.supported_inference_engines.engines)}
+  return event.request_id, status_from_json(event.opaque_status)
+
+
+def status_to_json(status: dict) -> str:
+  """The JSON form used by SendOpaqueStatus, for peers that predate SendStatusBatch."""
+  status = dict(status)
+  for key in ("base_shard", "shard"):
+    if isinstance(status.get(key), Shard): status[key] = status[key].to_dict()
+  if isinstance(status.get("progress"), RepoProgressEvent): status["progress"] = status["progress"].to_dict()
+  return json.dumps(status)
+
+
+def status_from_json(status_json: str) -> dict:
+  status = json.loads(status_json)
+  if status.get("type") == "node_status":
+    for key in ("base_shard", "shard"):
+      if isinstance(status.get(key), dict): status[key] = Shard.from_dict(status[key])
+  if status.get("type") == "download_progress" and isinstance(status.get("progress"), dict):
+    status["progress"] = RepoProgressEvent.from_dict(status["progress"])
+  return status
@@ -0,0 +1,100 @@
+import numpy as np
+from typing import Iterable, List, Optional, Tuple
+from . import node_service_pb2
+from .shared_memory import SHARED_MEMORY_ENCODING, read_shared_tensor
+
+# An encoding is a "+"-joined combination of at most one quantization and one compression, e.g. "fp16+zstd".
+# The empty encoding is the tensor's raw bytes at its own dtype.
+QUANTIZATIONS = ("fp16", "bf16", "int8")
+COMPRESSIONS = ("lz4", "zstd")
+FP16_MAX = float(np.finfo(np.float16).max)
+
+compressors = {}
+try:
+  import lz4.frame
+  compressors["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+except ImportError:
+  pass
+try:
+  import zstandard
+  compressors["zstd"] = (lambda data: zstandard.ZstdCompressor().compress(data), lambda data: zstandard.ZstdDecompressor().decompress(data))
+except ImportError:
+  pass
+
+
+def supported_encodings() -> List[str]:
+  return list(QUANTIZATIONS) + list(compressors.keys())
+
+
+def parse_encoding(encoding: str) -> Tuple[Optional[str], Optional[str]]:
+  parts = [part for part in encoding.split("+") if part and part != "raw"]
+  unknown = [part for part in parts if part not in QUANTIZATIONS and part not in COMPRESSIONS]
+  if unknown: raise ValueError(f"Unknown tensor encoding {encoding!r}, expected a combination of {QUANTIZATIONS} and {COMPRESSIONS}")
+  quantization = next((part for part in parts if part in QUANTIZATIONS), None)
+  compression = next((part for part in parts if part in COMPRESSIONS), None)
+  return quantization, compression
+
+
+def negotiate_encoding(preferred: str, peer_encodings: Iterable[str]) -> str:
+  """The part of our preferred encoding that both we and the peer support."""
+  peer_encodings = set(peer_encodings)
+  quantization, compression = parse_encoding(preferred)
+  if compression not in compressors: compression = None
+  return "+".join(part for part in (quantization, compression) if part is not None and part in peer_encodings)
+
+
+def encode_tensor(array: np.ndarray, encoding: str = "") -> node_service_pb2.Tensor:
+  quantization, compression = parse_encoding(encoding)
+  scales = b""
+  if array.ndim == 0 or not np.issubdtype(array.dtype, np.floating) or (quantization in ("fp16", "bf16") and array.dtype.itemsize <= 2):
+    # nothing to gain, or the downcast would lose precision
+    quantization = None
+  elif quantization == "fp16" and array.size and not np.abs(array).max() <= FP16_MAX:
+    # values beyond fp16's range would arrive as inf, send those tensors as they are
+    quantization = None
+  if quantization is None:
+    data = array.tobytes()
+  elif quantization == "fp16":
+    data = array.astype(np.float16).tobytes()
+  elif quantization == "bf16":
+    bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32).astype(np.uint64)
+    # round to nearest even on the 16 dropped mantissa bits
+    data = ((bits + 0x7FFF + ((bits >> 16) & 1)) >> 16).astype(np.uint16).tobytes()
+  else:
+    x = array.astype(np.float32)
+    scale = np.abs(x).max(axis=-1, keepdims=True)/127
+    scale[scale == 0] = 1
+    data = np.clip(np.rint(x/scale), -127, 127).astype(np.int8).tobytes()
+    scales = scale.astype(np.float32).tobytes()
+  if compression is not None:
+    data = compressors[compression][0](data)
+  applied = "+".join(part for part in (quantization, compression) if part is not None)
+  return node_service_pb2.Tensor(tensor_data=data, shape=array.shape, dtype=str(array.dtype), encoding=applied, scales=scales)
+
+
+def decode_tensor(tensor: node_service_pb2.Tensor) -> np.ndarray:
+  """
+  Raw tensors come back as a read-only view of the message bytes, everything else with a single allocation
+  at the target dtype, so the engine's upload to its device is the only other copy on the receiving side.
+  """
+  if tensor.encoding == SHARED_MEMORY_ENCODING: return read_shared_tensor(tensor)
+  quantization, compression = parse_encoding(tensor.encoding)
+  # every access to a bytes field copies it out of the message, so only do it once
+  data = tensor.tensor_data
+  if compression is not None:
+    if compression not in compressors: raise ValueError(f"Received a tensor compressed with {compression}, which is not installed")
+    data = compressors[compression][1](data)
+  dtype = np.dtype(tensor.dtype)
+  shape = tuple(tensor.shape)
+  if quantization is None:
+    return np.frombuffer(data, dtype=dtype).reshape(shape)
+  if quantization == "fp16":
+    array = np.frombuffer(data, dtype=np.float16)
+  elif quantization == "bf16":
+    bits = np.frombuffer(data, dtype=np.uint16).astype(np.uint32)
+    bits <<= 16
+    array = bits.view(np.float32)
+  else:
+    scale = np.frombuffer(tensor.scales, dtype=np.float32).reshape(shape[:-1] + (1,))
+    array = np.multiply(np.frombuffer(data, dtype=np.int8).reshape(shape), scale, dtype=np.result_type(dtype, np.float32))
+  return array.astype(dtype, copy=False).reshape(shape)
@@ -0,0 +1,12 @@
+from collections import OrderedDict
+
+# Number of requests whose shard/inference_state each end of a TensorStream remembers. Both ends add
+# requests in stream order and forget the oldest first, so they always agree on what the receiver has.
+MAX_STREAM_REQUESTS = 1024
+
+
+class StreamHeaders(OrderedDict):
+  def remember(self, request_id: str, header: tuple) -> None:
+    if request_id not in self and len(self) >= MAX_STREAM_REQUESTS:
+      self.popitem(last=False)
+    self[request_id] = header
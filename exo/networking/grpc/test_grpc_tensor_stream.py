@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class TestTensorStream(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.AsyncMock()
+    self.node.process_tensor = mock.AsyncMock(side_effect=lambda shard, tensor, request_id, inference_state: tensor + 1 if shard.is_last_layer() else None)
+    self.server = GRPCServer(self.node, "localhost", 50071)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("node1", "localhost:50071", "test", UNKNOWN_DEVICE_CAPABILITIES)
+    await self.peer.connect()
+    # record what goes over the wire
+    self.requests = []
+    open_stream = self.peer.stub.TensorStream
+
+    def recording_stream():
+      call = open_stream()
+      write = call.write
+      async def recording_write(request):
+        self.requests.append(request)
+        await write(request)
+      call.write = recording_write
+      return call
+
+    self.peer.stub.TensorStream = recording_stream
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def test_header_is_sent_once_per_request(self):
+    shard = Shard("dummy", 0, 7, 8)
+    for i in range(3):
+      result = await self.peer.send_tensor(shard, np.array([[i]]), {"step": 1}, request_id="req")
+      np.testing.assert_array_equal(result, np.array([[i + 1]]))
+
+    self.assertEqual([request.HasField("shard") for request in self.requests], [True, False, False])
+    self.assertEqual([request.HasField("inference_state") for request in self.requests], [True, False, False])
+    for call in self.node.process_tensor.call_args_list:
+      self.assertEqual(call.args[0], shard)
+      self.assertEqual(call.args[3], {"step": 1})
+
+  async def test_requests_are_multiplexed(self):
+    shard = Shard("dummy", 0, 3, 8)
+    results = await asyncio.gather(*[self.peer.send_tensor(shard, np.array([[i]]), request_id=f"req{i}") for i in range(4)])
+
+    self.assertEqual(results, [None]*4)
+    self.assertEqual(len(self.requests), 4)
+    self.assertTrue(all(request.HasField("shard") for request in self.requests))
+    self.assertEqual(sorted(call.args[2] for call in self.node.process_tensor.call_args_list), [f"req{i}" for i in range(4)])
+
+  async def test_state_changes_are_resent(self):
+    shard = Shard("dummy", 0, 7, 8)
+    await self.peer.send_tensor(shard, np.array([[1]]), {"step": 1}, request_id="req")
+    await self.peer.send_tensor(shard, np.array([[1]]), {"step": 2}, request_id="req")
+    await self.peer.send_tensor(shard, np.array([[1]]), None, request_id="req")
+
+    self.assertEqual([call.args[3] for call in self.node.process_tensor.call_args_list], [{"step": 1}, {"step": 2}, {}])
+
+  async def test_unchanged_state_is_not_serialized_again(self):
+    shard = Shard("dummy", 0, 7, 8)
+    state = {"step": 1, "x": np.ones((1, 2), dtype=np.float32)}
+    with mock.patch.object(self.peer, "serialize_inference_state", wraps=self.peer.serialize_inference_state) as serialize:
+      for _ in range(3): await self.peer.send_tensor(shard, np.array([[1]]), dict(state), request_id="req")
+      self.assertEqual(serialize.call_count, 1)
+      # changes made in place are still sent
+      state["step"] = 2
+      await self.peer.send_tensor(shard, np.array([[1]]), state, request_id="req")
+      self.assertEqual(serialize.call_count, 2)
+    self.assertEqual(self.node.process_tensor.call_args.args[3]["step"], 2)
+
+  async def test_a_state_that_fails_to_decode_is_sent_again(self):
+    shard = Shard("dummy", 0, 7, 8)
+    with mock.patch.object(self.server, "deserialize_inference_state", side_effect=ValueError("bad state")):
+      with self.assertRaises(RuntimeError):
+        await self.peer.send_tensor(shard, np.array([[1]]), {"step": 1}, request_id="req")
+    await self.peer.send_tensor(shard, np.array([[1]]), {"step": 1}, request_id="req")
+
+    self.assertTrue(self.requests[1].HasField("inference_state"))
+    self.assertEqual(self.node.process_tensor.call_args.args[3], {"step": 1})
+
+  async def test_encoding_is_negotiated_on_health_check(self):
+    self.assertEqual(self.peer.wire_encoding, "")
+    self.assertTrue(await self.peer.health_check())
+    # activations are sent raw unless a lossy encoding is asked for
+    self.assertEqual(self.peer.wire_encoding, "")
+    self.peer.tensor_encoding = "fp16"
+    self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.wire_encoding, "fp16")
+
+    x = np.arange(8, dtype=np.float32).reshape(1, 1, 8)
+    await self.peer.send_tensor(Shard("dummy", 0, 3, 8), x, request_id="req")
+    self.assertEqual(self.requests[0].tensor.encoding, "fp16")
+    np.testing.assert_array_equal(self.node.process_tensor.call_args.args[1], x)
+
+  async def test_state_tensors_are_not_quantized(self):
+    self.peer.tensor_encoding = "fp16"
+    await self.peer.health_check()
+    latents = np.random.default_rng(0).standard_normal((1, 4, 8)).astype(np.float32)
+    await self.peer.send_tensor(Shard("dummy", 0, 3, 8), latents, {"x": latents}, request_id="req")
+    self.assertEqual(self.requests[0].inference_state.tensor_data["x"].encoding, "")
+    np.testing.assert_array_equal(self.node.process_tensor.call_args.args[3]["x"], latents)
+
+  async def test_errors_are_raised_on_the_sender(self):
+    self.node.process_tensor.side_effect = RuntimeError("boom")
+    with self.assertRaises(RuntimeError):
+      await self.peer.send_tensor(Shard("dummy", 0, 7, 8), np.array([[1]]), request_id="req")
+
+
+if __name__ == "__main__":
+  unittest.main()
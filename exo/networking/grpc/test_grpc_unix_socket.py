@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class TestUnixSocket(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.AsyncMock()
+    self.node.process_tensor = mock.AsyncMock(side_effect=lambda shard, tensor, request_id, inference_state: tensor + 1)
+    self.socket_path = os.path.join(tempfile.mkdtemp(), "exo.sock")
+    self.server = GRPCServer(self.node, "localhost", 50073, unix_socket_path=self.socket_path)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("node1", "localhost:50073", "test", UNKNOWN_DEVICE_CAPABILITIES)
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def test_same_host_peer_switches_to_unix_socket(self):
+    self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.channel_address, f"unix:{self.socket_path}")
+    self.assertEqual(self.peer.addr(), "localhost:50073")
+
+    result = await self.peer.send_tensor(Shard("dummy", 0, 7, 8), np.array([[1]]), request_id="req")
+    np.testing.assert_array_equal(result, np.array([[2]]))
+    self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.channel_address, f"unix:{self.socket_path}")
+
+  async def test_other_host_stays_on_tcp(self):
+    with mock.patch("exo.networking.grpc.grpc_peer_handle.get_host_id", return_value="elsewhere"):
+      self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.channel_address, "localhost:50073")
+
+  async def test_falls_back_to_tcp_when_socket_is_unusable(self):
+    connect = self.peer.connect
+
+    async def failing_connect():
+      if self.peer.channel_address.startswith("unix:"): raise ConnectionError("no socket")
+      await connect()
+
+    self.peer.connect = failing_connect
+    self.assertTrue(await self.peer.health_check())
+    self.assertEqual(self.peer.channel_address, "localhost:50073")
+    self.assertFalse(self.peer.unix_socket_supported)
+
+  async def test_socket_file_is_removed_on_stop(self):
+    self.assertTrue(os.path.exists(self.socket_path))
+    await self.server.stop()
+    self.assertFalse(os.path.exists(self.socket_path))
+
+
+if __name__ == "__main__":
+  unittest.main()
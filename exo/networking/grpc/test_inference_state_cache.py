@@ -0,0 +1,93 @@
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+SHARD = Shard("dummy", 0, 3, 8)
+
+
+class TestInferenceStateCache(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.AsyncMock()
+    self.node.process_tensor = mock.AsyncMock(return_value=None)
+    self.server = GRPCServer(self.node, "localhost", 50076)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("node1", "localhost:50076", "test", UNKNOWN_DEVICE_CAPABILITIES)
+    await self.peer.connect()
+    self.assertTrue(await self.peer.health_check())
+    self.serialized = []
+    serialize = self.peer.serialize_inference_state
+
+    def recording_serialize(*args, **kwargs):
+      proto = serialize(*args, **kwargs)
+      self.serialized.append(proto)
+      return proto
+
+    self.peer.serialize_inference_state = recording_serialize
+    self.conditioning = np.random.rand(2, 77, 64).astype(np.float32)
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def denoise(self, steps: int, request_id: str = "req"):
+    for step in range(steps):
+      state = {"conditioning": self.conditioning, "mask": None, "x_t_prev": np.full((1, 8), step, dtype=np.float32), "step": step}
+      await self.peer.send_tensor(SHARD, np.zeros((1, 8)), state, request_id=request_id)
+
+  def received_states(self):
+    return [call.args[3] for call in self.node.process_tensor.call_args_list]
+
+  async def test_constant_state_is_sent_once_per_request(self):
+    await self.denoise(3)
+
+    self.assertEqual([list(proto.tensor_data) for proto in self.serialized], [["conditioning", "x_t_prev"], ["x_t_prev"], ["x_t_prev"]])
+    self.assertEqual([list(proto.cached_keys) for proto in self.serialized], [[], ["conditioning"], ["conditioning"]])
+    for step, state in enumerate(self.received_states()):
+      np.testing.assert_allclose(state["conditioning"], self.conditioning, atol=1e-3)
+      self.assertEqual(state["step"], step)
+      self.assertIsNone(state["mask"])
+
+  async def test_changed_constant_state_is_resent(self):
+    await self.denoise(1)
+    self.conditioning = self.conditioning + 1
+    await self.denoise(1)
+    self.assertEqual(list(self.serialized[1].cached_keys), [])
+    np.testing.assert_allclose(self.received_states()[1]["conditioning"], self.conditioning, atol=1e-3)
+
+  async def test_full_state_is_resent_when_the_peer_lost_it(self):
+    await self.denoise(1)
+    self.server.received_inference_state.pop("req")
+    await self.denoise(2)
+
+    self.assertEqual([list(proto.cached_keys) for proto in self.serialized], [[], ["conditioning"], [], ["conditioning"]])
+    self.assertEqual(self.node.process_tensor.call_count, 3)
+    for state in self.received_states():
+      np.testing.assert_allclose(state["conditioning"], self.conditioning, atol=1e-3)
+
+  async def test_unary_fallback_resends_the_full_state(self):
+    self.peer.tensor_stream_supported = False
+    await self.denoise(1)
+    self.server.received_inference_state.pop("req")
+    await self.denoise(1)
+    self.assertEqual(self.node.process_tensor.call_count, 2)
+    np.testing.assert_allclose(self.received_states()[1]["conditioning"], self.conditioning, atol=1e-3)
+
+  async def test_peers_without_the_cache_get_everything(self):
+    self.peer.inference_state_cache = False
+    await self.denoise(2)
+    self.assertEqual([list(proto.cached_keys) for proto in self.serialized], [[], []])
+    self.assertEqual(len(self.peer.sent_inference_state), 0)
+
+  async def test_requests_are_cached_separately(self):
+    await self.denoise(1, "a")
+    await self.denoise(1, "b")
+    self.assertEqual(list(self.serialized[1].cached_keys), [])
+    self.assertEqual(sorted(self.server.received_inference_state), ["a", "b"])
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+from unittest import mock
+import numpy as np
+from multiprocessing.shared_memory import SharedMemory
+from exo.inference.shard import Shard
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.networking.grpc.shared_memory import SHARED_MEMORY_ENCODING, SharedMemoryUnavailable
+from exo.networking.grpc.shared_memory_peer_handle import SharedMemoryPeerHandle
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+class TestSharedMemoryPeerHandle(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.AsyncMock()
+    self.node.process_tensor = mock.AsyncMock(side_effect=lambda shard, tensor, request_id, inference_state: tensor + 1)
+    self.server = GRPCServer(self.node, "localhost", 50072)
+    await self.server.start()
+    self.peer = SharedMemoryPeerHandle("node1", "localhost:50072", "test", UNKNOWN_DEVICE_CAPABILITIES, tensor_encoding="raw", min_bytes=1024)
+    self.assertTrue(await self.peer.health_check())
+    self.sent = []
+    encode_tensor = self.peer.encode_tensor
+
+    def recording_encode_tensor(tensor):
+      proto = encode_tensor(tensor)
+      self.sent.append(proto)
+      return proto
+
+    self.peer.encode_tensor = recording_encode_tensor
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  def assertUnlinked(self, proto):
+    with self.assertRaises(FileNotFoundError):
+      SharedMemory(name=proto.tensor_data.decode())
+
+  async def test_large_tensors_go_through_shared_memory(self):
+    self.assertTrue(self.peer.is_same_host())
+    x = np.random.rand(4, 512).astype(np.float32)
+    result = await self.peer.send_tensor(Shard("dummy", 0, 7, 8), x, request_id="req")
+
+    np.testing.assert_array_equal(result, x + 1)
+    np.testing.assert_array_equal(self.node.process_tensor.call_args.args[1], x)
+    self.assertEqual(self.sent[0].encoding, SHARED_MEMORY_ENCODING)
+    self.assertLess(len(self.sent[0].tensor_data), 64)
+    self.assertUnlinked(self.sent[0])
+
+  async def test_small_tensors_are_sent_inline(self):
+    x = np.arange(4, dtype=np.float32)
+    await self.peer.send_tensor(Shard("dummy", 0, 7, 8), x, request_id="req")
+    self.assertEqual(self.sent[0].encoding, "")
+
+  async def test_other_hosts_are_sent_inline(self):
+    self.peer.host_id = "elsewhere"
+    x = np.random.rand(4, 512).astype(np.float32)
+    await self.peer.send_tensor(Shard("dummy", 0, 7, 8), x, request_id="req")
+    self.assertEqual(self.sent[0].encoding, "")
+
+  async def test_falls_back_when_peer_cannot_read_segment(self):
+    x = np.random.rand(4, 512).astype(np.float32)
+    with mock.patch("exo.networking.grpc.tensor_codec.read_shared_tensor", side_effect=SharedMemoryUnavailable("no /dev/shm")):
+      result = await self.peer.send_tensor(Shard("dummy", 0, 7, 8), x, request_id="req")
+
+    np.testing.assert_array_equal(result, x + 1)
+    self.assertEqual([proto.encoding for proto in self.sent], [SHARED_MEMORY_ENCODING, ""])
+    self.assertFalse(self.peer.shared_memory_supported)
+    self.assertUnlinked(self.sent[0])
+    self.assertEqual(self.node.process_tensor.call_count, 1)
+
+  async def test_segment_is_cleaned_up_when_processing_fails(self):
+    self.node.process_tensor.side_effect = RuntimeError("boom")
+    with self.assertRaises(RuntimeError):
+      await self.peer.send_tensor(Shard("dummy", 0, 7, 8), np.random.rand(4, 512).astype(np.float32), request_id="req")
+    self.assertUnlinked(self.sent[0])
+    self.assertTrue(self.peer.shared_memory_supported)
+
+
+if __name__ == "__main__":
+  unittest.main()
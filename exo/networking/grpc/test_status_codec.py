@@ -0,0 +1,57 @@
+import unittest
+from unittest import mock
+from datetime import timedelta
+from exo.inference.shard import Shard
+from exo.download.download_progress import RepoProgressEvent, RepoFileProgressEvent
+from exo.networking.grpc.status_codec import encode_status, decode_status, status_to_json, status_from_json
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+
+def make_progress():
+  file = RepoFileProgressEvent("repo", "main", "model.safetensors", 10, 5, 100, 2.5, timedelta(seconds=36), "in_progress")
+  return RepoProgressEvent("repo", "main", 0, 1, 10, 5, 100, 2.5, timedelta(seconds=36), {"model.safetensors": file}, "in_progress")
+
+
+class TestStatusCodec(unittest.TestCase):
+  def test_typed_statuses_round_trip(self):
+    statuses = [
+      {"type": "node_status", "node_id": "a", "status": "start_process_prompt", "base_shard": Shard("m", 0, 31, 32), "shard": Shard("m", 0, 15, 32)},
+      {"type": "node_status", "node_id": "a", "status": "end_process_prompt", "base_shard": Shard("m", 0, 31, 32), "shard": Shard("m", 0, 15, 32), "elapsed_time_ns": 12},
+      {"type": "download_progress", "node_id": "a", "progress": make_progress()},
+      {"type": "supported_inference_engines", "node_id": "a", "engines": ["mlx", "tinygrad"]},
+      {"type": "something_else", "value": [1, 2]},
+    ]
+    for status in statuses:
+      with self.subTest(status=status["type"]):
+        event = encode_status("req", status)
+        self.assertEqual(decode_status(event), ("req", status))
+        self.assertEqual(status_from_json(status_to_json(status)), status)
+
+  def test_node_status_is_typed(self):
+    event = encode_status("req", {"type": "node_status", "node_id": "a", "status": "start_process_prompt", "base_shard": Shard("m", 0, 31, 32), "shard": Shard("m", 0, 15, 32)})
+    self.assertEqual(event.WhichOneof("event"), "node_status")
+    self.assertLess(event.ByteSize(), 64)
+
+
+class TestSendStatusBatch(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.Mock()
+    self.server = GRPCServer(self.node, "localhost", 50074)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("node1", "localhost:50074", "test", UNKNOWN_DEVICE_CAPABILITIES)
+    await self.peer.connect()
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def test_batch_is_delivered_in_order(self):
+    events = [("req", {"type": "download_progress", "node_id": "a", "progress": make_progress()}), ("", {"type": "supported_inference_engines", "node_id": "a", "engines": ["tinygrad"]})]
+    await self.peer.send_status_batch(events)
+    self.assertEqual([call.args for call in self.node.on_status.trigger_all.call_args_list], events)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,109 @@
+import tracemalloc
+import unittest
+from unittest import mock
+import numpy as np
+from exo.networking.grpc import node_service_pb2, tensor_codec
+from exo.networking.grpc.grpc_server import GRPCServer, state_array
+from exo.networking.grpc.tensor_codec import encode_tensor, decode_tensor, negotiate_encoding, parse_encoding
+
+
+class TestTensorCodec(unittest.TestCase):
+  def setUp(self):
+    self.x = np.random.default_rng(0).standard_normal((1, 5, 64)).astype(np.float32)
+
+  def test_raw_roundtrip(self):
+    tensor = encode_tensor(self.x)
+    self.assertEqual(tensor.encoding, "")
+    np.testing.assert_array_equal(decode_tensor(tensor), self.x)
+
+  def test_fp16(self):
+    tensor = encode_tensor(self.x, "fp16")
+    self.assertEqual(len(tensor.tensor_data), self.x.nbytes // 2)
+    decoded = decode_tensor(tensor)
+    self.assertEqual(decoded.dtype, np.float32)
+    np.testing.assert_allclose(decoded, self.x, rtol=1e-3, atol=1e-3)
+
+  def test_fp16_falls_back_to_raw_beyond_its_range(self):
+    x = self.x.copy()
+    x[0, 1, 3] = 7e4
+    tensor = encode_tensor(x, "fp16")
+    self.assertEqual(tensor.encoding, "")
+    np.testing.assert_array_equal(decode_tensor(tensor), x)
+
+  def test_bf16(self):
+    tensor = encode_tensor(self.x, "bf16")
+    self.assertEqual(len(tensor.tensor_data), self.x.nbytes // 2)
+    np.testing.assert_allclose(decode_tensor(tensor), self.x, rtol=1e-2, atol=1e-2)
+
+  def test_int8(self):
+    x = self.x.copy()
+    x[0, 2] = 0
+    tensor = encode_tensor(x, "int8")
+    self.assertEqual(len(tensor.tensor_data), x.nbytes // 4)
+    decoded = decode_tensor(tensor)
+    self.assertEqual(decoded.shape, x.shape)
+    np.testing.assert_array_equal(decoded[0, 2], 0)
+    np.testing.assert_allclose(decoded, x, atol=np.abs(x).max()/127)
+
+  def test_non_float_and_half_tensors_are_not_quantized(self):
+    tokens = np.array([[1, 2, 3]])
+    self.assertEqual(encode_tensor(tokens, "int8").encoding, "")
+    np.testing.assert_array_equal(decode_tensor(encode_tensor(tokens, "int8")), tokens)
+    self.assertEqual(encode_tensor(self.x.astype(np.float16), "bf16").encoding, "")
+
+  @unittest.skipUnless(tensor_codec.compressors, "no compression library installed")
+  def test_compression(self):
+    compression = next(iter(tensor_codec.compressors))
+    x = np.zeros((4, 1024), dtype=np.float32)
+    tensor = encode_tensor(x, f"fp16+{compression}")
+    self.assertLess(len(tensor.tensor_data), x.nbytes // 2)
+    np.testing.assert_array_equal(decode_tensor(tensor), x)
+
+  def test_negotiation(self):
+    self.assertEqual(negotiate_encoding("fp16", ["fp16", "bf16", "int8"]), "fp16")
+    self.assertEqual(negotiate_encoding("int8", []), "")
+    self.assertEqual(negotiate_encoding("raw", ["fp16"]), "")
+    self.assertEqual(negotiate_encoding("fp16+zstd", ["fp16", "zstd"]), "fp16+zstd" if "zstd" in tensor_codec.compressors else "fp16")
+    with self.assertRaises(ValueError):
+      parse_encoding("fp8")
+
+
+
+def copies_to_decode(tensor, decode=decode_tensor) -> float:
+  """Bytes allocated while decoding a received tensor, in multiples of the decoded tensor's size."""
+  tensor = type(tensor).FromString(tensor.SerializeToString())
+  tracemalloc.start()
+  try:
+    decoded = decode(tensor)
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return peak/decoded.nbytes
+
+
+class TestDecodeCopies(unittest.TestCase):
+  # a 70B hidden state for a 256 token prompt chunk
+  x = np.random.default_rng(0).standard_normal((1, 256, 8192)).astype(np.float32)
+
+  def test_raw_tensors_are_a_view_of_the_message(self):
+    decoded = decode_tensor(encode_tensor(self.x))
+    self.assertFalse(decoded.flags.owndata)
+    self.assertFalse(decoded.flags.writeable)
+    # reading the bytes field out of the message is the one copy
+    self.assertLess(copies_to_decode(encode_tensor(self.x)), 1.1)
+
+  def test_quantized_tensors_are_decoded_with_one_allocation(self):
+    for encoding, wire_size in (("fp16", 0.5), ("bf16", 0.5), ("int8", 0.25)):
+      with self.subTest(encoding=encoding):
+        self.assertLess(copies_to_decode(encode_tensor(self.x, encoding)), wire_size + 1.1)
+
+  @unittest.skipUnless(state_array is np.asarray, "state tensors are uploaded to mlx")
+  def test_state_tensors_are_not_copied_again(self):
+    server = GRPCServer(mock.AsyncMock(), "localhost", 0)
+    state = node_service_pb2.InferenceState()
+    state.tensor_data["x"].CopyFrom(encode_tensor(self.x))
+    self.assertLess(copies_to_decode(state, lambda proto: server.deserialize_inference_state(proto)["x"]), 1.1)
+
+
+if __name__ == "__main__":
+  unittest.main()
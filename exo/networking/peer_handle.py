@@ -51,6 +51,14 @@ class PeerHandle(ABC):
   async def send_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
     pass
 
+  @abstractmethod
+  async def cancel_request(self, request_id: str) -> None:
+    pass
+
+  @abstractmethod
+  async def send_status_batch(self, events: List[Tuple[str, dict]]) -> None:
+    pass
+
   @abstractmethod
   async def collect_topology(self, visited: set[str], max_depth: int) -> Topology:
     pass
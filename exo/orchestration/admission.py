@@ -0,0 +1,83 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict
+
+# Lanes in the order they are served. A waiting interactive request always goes before a waiting batch request.
+PRIORITIES = ("interactive", "batch")
+
+
+class QueueFull(Exception):
+  pass
+
+
+class AdmissionController:
+  """
+  Bounds how many requests run at once. Requests beyond max_concurrent wait in their priority lane, and
+  requests beyond max_queued waiting are rejected right away so callers can back off instead of timing out.
+  A max_concurrent of 0 admits everything.
+  """
+  def __init__(self, max_concurrent: int = 8, max_queued: int = 64):
+    self.max_concurrent = max_concurrent
+    self.max_queued = max_queued
+    self.active = 0
+    self.lanes: Dict[str, Deque[asyncio.Future]] = {priority: deque() for priority in PRIORITIES}
+    self.admitted = {priority: 0 for priority in PRIORITIES}
+    self.rejected = {priority: 0 for priority in PRIORITIES}
+    self.queue_time = {priority: 0.0 for priority in PRIORITIES}
+    self.max_queue_time = {priority: 0.0 for priority in PRIORITIES}
+
+  @property
+  def queued(self) -> int:
+    return sum(len(lane) for lane in self.lanes.values())
+
+  async def acquire(self, priority: str = "interactive") -> None:
+    if priority not in self.lanes: raise ValueError(f"Unknown priority {priority!r}, expected one of {PRIORITIES}")
+    start = time.perf_counter()
+    if self.max_concurrent <= 0 or (self.active < self.max_concurrent and self.queued == 0):
+      self.active += 1
+    else:
+      if self.queued >= self.max_queued:
+        self.rejected[priority] += 1
+        raise QueueFull(f"{self.queued} requests are already waiting for one of {self.max_concurrent} slots")
+      future = asyncio.get_running_loop().create_future()
+      self.lanes[priority].append(future)
+      try:
+        await future
+      except asyncio.CancelledError:
+        if future in self.lanes[priority]: self.lanes[priority].remove(future)
+        # the slot was handed to us just as we gave up, pass it on
+        elif future.done() and not future.cancelled(): self.release()
+        raise
+    waited = time.perf_counter() - start
+    self.admitted[priority] += 1
+    self.queue_time[priority] += waited
+    self.max_queue_time[priority] = max(self.max_queue_time[priority], waited)
+
+  def release(self) -> None:
+    # hand the slot straight to the next waiter so a newcomer cannot take it first
+    for priority in PRIORITIES:
+      lane = self.lanes[priority]
+      while lane:
+        future = lane.popleft()
+        if not future.done():
+          future.set_result(None)
+          return
+    self.active -= 1
+
+  def stats(self) -> dict:
+    return {
+      "active": self.active,
+      "max_concurrent": self.max_concurrent,
+      "max_queued": self.max_queued,
+      "lanes": {
+        priority: {
+          "queued": len(self.lanes[priority]),
+          "admitted": self.admitted[priority],
+          "rejected": self.rejected[priority],
+          "avg_queue_time": self.queue_time[priority]/self.admitted[priority] if self.admitted[priority] else 0.0,
+          "max_queue_time": self.max_queue_time[priority],
+        }
+        for priority in PRIORITIES
+      },
+    }
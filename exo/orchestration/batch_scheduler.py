@@ -0,0 +1,62 @@
+import asyncio
+import traceback
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+from exo import DEBUG
+
+
+class BatchScheduler:
+  """
+  Continuous batching in front of an InferenceEngine.
+
+  At most one engine call is in flight per shard. Requests that arrive while a call is running are queued
+  and dispatched together as the next batch, so concurrent requests at a shard share one engine call
+  instead of queueing up as serialized batch-of-1 calls. Engines without their own infer_tensor_batch
+  would only run the batch one by one, so their requests go straight to the engine.
+  """
+  def __init__(self, inference_engine: InferenceEngine, max_batch_size: int = 8):
+    self.inference_engine = inference_engine
+    self.max_batch_size = max(1, max_batch_size)
+    self.pending: Dict[Shard, List[Tuple[str, np.ndarray, Optional[dict], asyncio.Future]]] = {}
+    self.running: Dict[Shard, asyncio.Task] = {}
+
+  @property
+  def batches(self) -> bool:
+    return type(self.inference_engine).infer_tensor_batch is not InferenceEngine.infer_tensor_batch
+
+  async def infer_tensor(self, request_id: str, shard: Shard, input_data: np.ndarray, inference_state: Optional[dict] = None) -> Tuple[np.ndarray, Optional[dict]]:
+    if not self.batches: return await self.inference_engine.infer_tensor(request_id, shard, input_data, inference_state)
+    future = asyncio.get_running_loop().create_future()
+    self.pending.setdefault(shard, []).append((request_id, input_data, inference_state, future))
+    if shard not in self.running:
+      self.running[shard] = asyncio.create_task(self._run(shard))
+    return await future
+
+  async def _run(self, shard: Shard) -> None:
+    try:
+      while self.pending.get(shard):
+        batch = self.pending[shard][:self.max_batch_size]
+        self.pending[shard] = self.pending[shard][self.max_batch_size:]
+        request_ids = [request_id for request_id, _, _, _ in batch]
+        if DEBUG >= 3: print(f"[BatchScheduler] running batch of {len(batch)} for {shard=}: {request_ids}")
+        try:
+          if len(batch) == 1:
+            request_id, input_data, inference_state, _ = batch[0]
+            results = [await self.inference_engine.infer_tensor(request_id, shard, input_data, inference_state)]
+          else:
+            results = await self.inference_engine.infer_tensor_batch(
+              request_ids, shard, [input_data for _, input_data, _, _ in batch], [inference_state for _, _, inference_state, _ in batch]
+            )
+        except Exception as e:
+          if DEBUG >= 2: traceback.print_exc()
+          for _, _, _, future in batch:
+            if not future.done(): future.set_exception(e)
+          continue
+        for (_, _, _, future), result in zip(batch, results):
+          if not future.done(): future.set_result(result)
+    finally:
+      self.running.pop(shard, None)
+      if not self.pending.get(shard):
+        self.pending.pop(shard, None)
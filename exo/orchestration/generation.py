@@ -0,0 +1,45 @@
+from typing import List, Optional, Tuple
+
+
+def generation_params(max_tokens: Optional[int] = None, temperature: Optional[float] = None, top_p: Optional[float] = None, stop: Optional[List[str]] = None) -> dict:
+  """The per-request generation parameters the last shard applies. Parameters left unset fall back to the node's defaults."""
+  params = {"max_tokens": max_tokens, "temperature": temperature, "top_p": top_p, "stop": [s for s in stop or [] if s] or None}
+  return {k: v for k, v in params.items() if v is not None}
+
+
+def hits_stop_sequence(tokenizer, tokens: List[int], new_tokens: int, stop: Optional[List[str]]) -> bool:
+  # earlier tokens were checked when they arrived, only decode enough of the tail to see a stop string ending in the new ones
+  if not stop: return False
+  window = new_tokens + max(len(s) for s in stop)
+  text = tokenizer.decode(tokens[-window:])
+  return any(s in text for s in stop)
+
+
+class StopStringFilter:
+  """
+  Passes streamed text through up to the first stop string, also when one is split across chunks. Text that
+  could be the start of a stop string is held back until the next chunk shows whether it is.
+  """
+  def __init__(self, stop: Optional[List[str]]):
+    self.stop = [s for s in stop or [] if s]
+    self.pending = ""
+    self.stopped = False
+
+  def feed(self, text: str) -> str:
+    if self.stopped: return ""
+    text = self.pending + text
+    text, self.stopped = truncate_at_stop(text, self.stop)
+    held = 0 if self.stopped else max((n for s in self.stop for n in range(1, len(s)) if text.endswith(s[:n])), default=0)
+    self.pending = text[len(text) - held:] if held else ""
+    return text[:len(text) - held]
+
+  def flush(self) -> str:
+    text, self.pending = self.pending, ""
+    return text
+
+
+def truncate_at_stop(text: str, stop: Optional[List[str]]) -> Tuple[str, bool]:
+  """Cuts text before the first stop string in it, the stop string itself is not part of the output."""
+  positions = [text.find(s) for s in stop or [] if s in text]
+  if not positions: return text, False
+  return text[:min(positions)], True
@@ -4,18 +4,43 @@ import asyncio
 import uuid
 import time
 import traceback
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from typing import List, Dict, Optional, Tuple, Union, Set
 from exo.networking import Discovery, PeerHandle, Server
 from exo.inference.inference_engine import InferenceEngine, Shard
+from exo.inference.prefix_cache import PrefixCacheMiss, prefix_key
 from exo.topology.topology import Topology
 from exo.topology.device_capabilities import device_capabilities, UNKNOWN_DEVICE_CAPABILITIES
-from exo.topology.partitioning_strategy import Partition, PartitioningStrategy, map_partitions_to_shards
+from exo.topology.partitioning_strategy import Partition, PartitioningStrategy
+from exo.topology.partition_cache import PartitionCache
 from exo import DEBUG
 from exo.helpers import AsyncCallbackSystem
 from exo.viz.topology_viz import TopologyViz
 from exo.download.hf.hf_helpers import RepoProgressEvent
 from exo.inference.inference_engine import get_inference_engine, InferenceEngine
 from exo.download.hf.hf_shard_download import HFShardDownloader
+from exo.orchestration.batch_scheduler import BatchScheduler
+from exo.orchestration.status_bus import StatusBus
+from exo.orchestration.speculative import Speculation, draft_request_id, verify_drafts, propose_drafts
+from exo.orchestration.generation import hits_stop_sequence
+from exo.orchestration.request_store import RequestStore
+from exo.models import build_base_shard, get_draft_model
+
+# Keys the node keeps in inference_state for itself. They travel with the request but are never handed to the inference engine.
+NODE_STATE_KEYS = ("origin_node_id", "prefill_chunk", "speculative", "generation", "prefill_attempt")
+
+
+def split_node_state(inference_state: Optional[dict]) -> Tuple[dict, Optional[dict]]:
+  if not inference_state or not any(k in inference_state for k in NODE_STATE_KEYS): return {}, inference_state
+  node_state = {k: v for k, v in inference_state.items() if k in NODE_STATE_KEYS}
+  return node_state, {k: v for k, v in inference_state.items() if k not in NODE_STATE_KEYS} or None
+
+
+def merge_node_state(node_state: dict, inference_state: Optional[dict]) -> Optional[dict]:
+  if not node_state: return inference_state
+  return {**(inference_state or {}), **node_state}
+
 
 class Node:
   def __init__(
@@ -29,31 +54,56 @@ class Node:
     default_sample_temperature: float = 0.0,
     topology_viz: Optional[TopologyViz] = None,
     shard_downloader: Optional[HFShardDownloader] = None,
+    max_batch_size: int = 8,
+    broadcast_results: bool = False,
+    prefill_chunk_size: int = 512,
+    speculative_tokens: int = 0,
+    request_state_ttl: float = 60.0,
+    max_request_states: int = 10000,
   ):
     self.id = _id
     self.inference_engine = inference_engine
     self.server = server
     self.discovery = discovery
     self.partitioning_strategy = partitioning_strategy
-    self.peers: List[PeerHandle] = {}
+    self.partition_cache = PartitionCache(partitioning_strategy)
+    self.peers: List[PeerHandle] = []
     self.topology: Topology = Topology()
     self.device_capabilities = UNKNOWN_DEVICE_CAPABILITIES
-    self.buffered_token_output: Dict[str, Tuple[List[int], bool]] = {}
-    self.buffered_logits: Dict[str, List[np.ndarray]] = {}
-    self.buffered_inputs: Dict[str, List[np.ndarray]] = {}
-    self.buffered_partials: Dict[str, List[np.ndarray]] = {}
+    # per-request state is dropped request_state_ttl seconds after the request finishes, see RequestStore
+    self.buffered_token_output: Dict[str, Tuple[List[int], bool]] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
+    self.buffered_logits: Dict[str, List[np.ndarray]] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
+    self.buffered_inputs: Dict[str, List[np.ndarray]] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
+    self.buffered_partials: Dict[str, List[np.ndarray]] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
     self.checkpoints: Dict[str, Dict[str, int]] = {}
     
     self.max_generate_tokens = max_generate_tokens
     self.topology_viz = topology_viz
     self.default_sample_temperature = default_sample_temperature
     self._on_token = AsyncCallbackSystem[str, Tuple[str, List[int], bool]]()
-    self._on_opaque_status = AsyncCallbackSystem[str, Tuple[str, str]]()
-    self._on_opaque_status.register("node_status").on_next(self.on_node_status)
+    self._on_status = AsyncCallbackSystem[str, Tuple[str, dict]]()
+    self._on_status.register("node_status").on_next(self.on_node_status)
+    self.status_bus = StatusBus()
     self.node_download_progress: Dict[str, RepoProgressEvent] = {}
     self.topology_inference_engines_pool: List[List[str]] = []
     self.shard_downloader = shard_downloader
-    self.outstanding_requests = {}
+    self.outstanding_requests: Dict[str, str] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
+    self.batch_scheduler = BatchScheduler(inference_engine, max_batch_size=max_batch_size)
+    # send every token to every peer (e.g. so each TUI shows all requests), not just to the node the request came from
+    self.broadcast_results = broadcast_results
+    # long prompts are split into chunks of this many tokens that flow through the ring as a pipeline, 0 disables
+    self.prefill_chunk_size = prefill_chunk_size
+    self.prefill_turns: Dict[str, Tuple[List[int], asyncio.Condition]] = {}
+    # how often a request's prompt was restarted after a shard missed its cached prefix, chunks of earlier attempts are dropped
+    self.prefill_attempts: Dict[str, int] = RequestStore(ttl=request_state_ttl, max_entries=max_request_states)
+    # requests that entered here are decoded speculatively: a draft model proposes tokens, the ring verifies them.
+    # the draft model is one more shard on this node's engine, so it shares its thread and loaded weights
+    self.speculative_tokens = speculative_tokens
+    self.speculations: Dict[str, Speculation] = {}
+    self._on_token.register("speculative_decoding").on_next(self.on_speculative_tokens)
+    # ids of recently cancelled requests, so tensors still in flight for them are dropped instead of resurrecting their state
+    self.cancelled_requests: OrderedDict[str, None] = OrderedDict()
+    self.max_cancelled_requests = 1024
 
   async def start(self, wait_for_peers: int = 0) -> None:
     self.device_capabilities = await device_capabilities()
@@ -63,14 +113,14 @@ class Node:
     await self.collect_topology(set())
     if DEBUG >= 2: print(f"Collected topology: {self.topology}")
     asyncio.create_task(self.periodic_topology_collection(2.0))
+    asyncio.create_task(self.periodic_request_state_sweep(10.0))
 
   async def stop(self) -> None:
     await self.discovery.stop()
     await self.server.stop()
 
-  def on_node_status(self, request_id, opaque_status):
+  def on_node_status(self, request_id: str, status_data: dict):
     try:
-      status_data = json.loads(opaque_status)
       status_type = status_data.get("type", "")
       if status_type == "supported_inference_engines":
         node_id = status_data.get("node_id")
@@ -83,14 +133,12 @@ class Node:
           if status_data.get("node_id") == self.current_topology.active_node_id:
             self.current_topology.active_node_id = None
 
-      download_progress = None
       if status_type == "download_progress":
         if DEBUG >= 8: print(f"Download progress from {status_data.get('node_id')}: {status_data.get('progress')}")
-        download_progress = RepoProgressEvent.from_dict(status_data.get('progress'))
-        self.node_download_progress[status_data.get('node_id')] = download_progress
+        self.node_download_progress[status_data.get('node_id')] = status_data.get('progress')
 
       if self.topology_viz:
-        self.topology_viz.update_visualization(self.topology, self.partitioning_strategy.partition(self.topology), self.id, self.node_download_progress)
+        self.topology_viz.update_visualization(self.topology, self.partition_cache.partitions(self.topology), self.id, self.node_download_progress)
     except Exception as e:
       if DEBUG >= 1: print(f"Error on_node_status: {e}")
       if DEBUG >= 1: traceback.print_exc()
@@ -105,8 +153,7 @@ class Node:
     return supported_engine_names
 
   async def broadcast_supported_engines(self, supported_engines_names: List[str]):
-    status_message = json.dumps({"type": "supported_inference_engines", "node_id": self.id, "engines": supported_engines_names})
-    await self.broadcast_opaque_status("", status_message)
+    self.broadcast_status("", {"type": "supported_inference_engines", "node_id": self.id, "engines": supported_engines_names})
 
   def get_topology_inference_engines(self) -> List[List[str]]:
     return self.topology_inference_engines_pool
@@ -120,15 +167,35 @@ class Node:
     request_id: Optional[str] = None,
     inference_state: Optional[dict] = None,
   ):
+    if request_id in self.cancelled_requests:
+      # cancelled while this shard was computing, the engine call just recreated the cache we freed
+      await self.inference_engine.evict_request(request_id)
+      return None
+    prefill_chunk = (inference_state or {}).get("prefill_chunk")
+    if prefill_chunk is not None:
+      index, count = prefill_chunk
+      if index < count - 1:
+        # an intermediate prompt chunk only fills the kv caches along the ring, the last chunk produces the first token
+        if not shard.is_last_layer():
+          self.outstanding_requests[request_id] = "waiting"
+          asyncio.create_task(self.forward_tensor(shard, result, request_id, self.get_partition_index(offset = 1), inference_state))
+        return None
+      if shard.is_last_layer():
+        inference_state = {k: v for k, v in inference_state.items() if k != "prefill_chunk"}
+    if "speculative" in (inference_state or {}) and shard.is_last_layer():
+      return await self.process_speculative_result(shard, result, request_id, inference_state)
     if shard.model_id != 'stable-diffusion-2-1-base':
+      generation = (inference_state or {}).get("generation", {})
+      max_tokens = self.max_tokens(generation)
       if request_id not in self.buffered_token_output:
         self.buffered_token_output[request_id] = ([], False)
-      is_finished = len(self.buffered_token_output[request_id][0]) >= self.max_generate_tokens
+      is_finished = len(self.buffered_token_output[request_id][0]) >= max_tokens
       if shard.is_last_layer() and not is_finished:
-        token = await self.inference_engine.sample(result, temp=self.default_sample_temperature)
+        token = await self.inference_engine.sample(result, **self.sample_params(generation))
         await self.inference_engine.ensure_shard(shard)
         self.buffered_token_output[request_id][0].append(token.item())
-        is_finished = token.item() == self.inference_engine.tokenizer.eos_token_id or is_finished or len(self.buffered_token_output[request_id][0]) >= self.max_generate_tokens
+        is_finished = token.item() == self.inference_engine.tokenizer.eos_token_id or is_finished or len(self.buffered_token_output[request_id][0]) >= max_tokens
+        is_finished = is_finished or hits_stop_sequence(self.inference_engine.tokenizer, self.buffered_token_output[request_id][0], 1, generation.get("stop"))
         if DEBUG >= 2: print(f"[{request_id}] result size: {result.size}, is finished: {is_finished}, buffered tokens: {len(self.buffered_token_output[request_id][0])}")
         forward = token.reshape(1, -1)
         intermediate_result = [self.buffered_token_output[request_id][0][-1]]
@@ -141,66 +208,161 @@ class Node:
       forward = result
     if shard.is_last_layer():
       self.trigger_on_token_callbacks(request_id, intermediate_result, is_finished)
-      asyncio.create_task(self.broadcast_result(request_id, intermediate_result, is_finished))
+      asyncio.create_task(self.deliver_result(request_id, intermediate_result, is_finished, (inference_state or {}).get("origin_node_id")))
 
     if is_finished:
       if shard.model_id != 'stable-diffusion-2-1-base':
         self.buffered_token_output[request_id] = (self.buffered_token_output[request_id][0], True)
       self.outstanding_requests.pop(request_id)
+      self.finish_request(request_id)
     else:
       self.outstanding_requests[request_id] = "waiting"
       asyncio.create_task(self.forward_tensor(shard, forward, request_id, self.get_partition_index(offset = 1), inference_state))
 
     return  np.array(self.buffered_token_output[request_id][0]) if shard.model_id != 'stable-diffusion-2-1-base' else intermediate_result
 
+  def max_tokens(self, generation: dict) -> int:
+    # a request can ask for fewer tokens than the node allows, never for more
+    return min(generation.get("max_tokens", self.max_generate_tokens), self.max_generate_tokens)
+
+  def sample_params(self, generation: dict) -> dict:
+    params = {"temp": generation.get("temperature", self.default_sample_temperature)}
+    if "top_p" in generation: params["top_p"] = generation["top_p"]
+    return params
+
+  async def process_speculative_result(self, shard: Shard, result: np.ndarray, request_id: str, inference_state: dict) -> np.ndarray:
+    # the last shard verifies the drafts and hands the accepted tokens to the origin node, which drafts the next step
+    if request_id not in self.buffered_token_output:
+      self.buffered_token_output[request_id] = ([], False)
+    buffered_tokens = self.buffered_token_output[request_id][0]
+    drafts = inference_state["speculative"].get("drafts")
+    generation = inference_state.get("generation", {})
+    max_tokens = self.max_tokens(generation)
+    if drafts:
+      tokens = verify_drafts(result, drafts)
+    else:
+      tokens = [(await self.inference_engine.sample(result, **self.sample_params(generation))).item()]
+    # the engine's tokenizer is the one of the shard it loaded last, which may be the draft model's
+    await self.inference_engine.ensure_shard(shard)
+    eos_token_id = self.inference_engine.tokenizer.eos_token_id
+    if eos_token_id in tokens: tokens = tokens[:tokens.index(eos_token_id) + 1]
+    tokens = tokens[:max(max_tokens - len(buffered_tokens), 0)]
+    buffered_tokens.extend(tokens)
+    is_finished = not tokens or tokens[-1] == eos_token_id or len(buffered_tokens) >= max_tokens
+    is_finished = is_finished or hits_stop_sequence(self.inference_engine.tokenizer, buffered_tokens, len(tokens), generation.get("stop"))
+    if DEBUG >= 2: print(f"[{request_id}] speculative step: {drafts=} {tokens=} {is_finished=}")
+    self.trigger_on_token_callbacks(request_id, tokens, is_finished)
+    asyncio.create_task(self.deliver_result(request_id, tokens, is_finished, inference_state.get("origin_node_id")))
+    if is_finished:
+      self.buffered_token_output[request_id] = (buffered_tokens, True)
+      self.outstanding_requests.pop(request_id, None)
+      self.finish_request(request_id)
+    else:
+      self.outstanding_requests[request_id] = "waiting"
+    return np.array(buffered_tokens)
+
+  def start_speculation(self, base_shard: Shard, prompt: str, request_id: str, generation: Optional[dict] = None) -> bool:
+    generation = generation or {}
+    if self.speculative_tokens < 1 or generation.get("temperature", self.default_sample_temperature) != 0: return False
+    draft_model_id = get_draft_model(base_shard.model_id, self.inference_engine.__class__.__name__)
+    if draft_model_id is None: return False
+    draft_shard = build_base_shard(draft_model_id, self.inference_engine.__class__.__name__)
+    draft_shard = Shard(draft_shard.model_id, 0, draft_shard.n_layers - 1, draft_shard.n_layers)
+    prefill = asyncio.create_task(self.inference_engine.infer_prompt(draft_request_id(request_id), draft_shard, prompt))
+    self.speculations[request_id] = Speculation(base_shard=base_shard, draft_shard=draft_shard, k=self.speculative_tokens, prefill=prefill, generation=generation)
+    if DEBUG >= 2: print(f"[{request_id}] speculative decoding with {draft_model_id}, {self.speculative_tokens} tokens per step")
+    return True
+
+  def on_speculative_tokens(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
+    if request_id not in self.speculations: return
+    if is_finished:
+      spec = self.speculations.pop(request_id)
+      if DEBUG >= 2: print(f"[{request_id}] speculative decoding accepted {spec.accepted}/{spec.proposed} drafts")
+      asyncio.create_task(self.inference_engine.evict_request(draft_request_id(request_id)))
+      return
+    asyncio.create_task(self.speculate(request_id, list(tokens)))
+
+  async def cancel(self, request_id: str) -> None:
+    """Stops a request on this node, frees its state and tells the peers to do the same."""
+    if request_id in self.cancelled_requests: return
+    self.cancelled_requests[request_id] = None
+    if len(self.cancelled_requests) > self.max_cancelled_requests: self.cancelled_requests.popitem(last=False)
+    if DEBUG >= 1: print(f"[{request_id}] cancelling request")
+    for buffer in (self.buffered_token_output, self.buffered_logits, self.buffered_inputs, self.buffered_partials, self.outstanding_requests, self.prefill_turns, self.prefill_attempts):
+      buffer.pop(request_id, None)
+    spec = self.speculations.pop(request_id, None)
+    if spec is not None: spec.prefill.cancel()
+    await self.inference_engine.evict_request(request_id)
+    if spec is not None: await self.inference_engine.evict_request(draft_request_id(request_id))
+    # every peer forwards it once more, so it reaches the whole ring even if we are not connected to every shard
+    asyncio.create_task(self.broadcast_cancel(request_id))
+
+  async def broadcast_cancel(self, request_id: str) -> None:
+    async def send_cancel_to_peer(peer: PeerHandle) -> None:
+      try:
+        await asyncio.wait_for(peer.cancel_request(request_id), timeout=15.0)
+      except asyncio.TimeoutError:
+        print(f"Timeout cancelling {request_id=} on {peer.id()}")
+      except Exception as e:
+        print(f"Error cancelling {request_id=} on {peer.id()}: {e}")
+        traceback.print_exc()
+    await asyncio.gather(*[send_cancel_to_peer(peer) for peer in self.peers], return_exceptions=True)
+
+  async def speculate(self, request_id: str, tokens: List[int]) -> None:
+    spec = self.speculations.get(request_id)
+    if spec is None: return
+    try:
+      await spec.prefill
+      k = spec.k
+      accepted = len(tokens) - 1 if spec.drafts else 0
+      # the ring ran [last, d1..dk], everything after the accepted drafts is gone from its caches
+      ring_rollback = k - accepted if spec.drafts else 0
+      # the draft model has seen d1..d(k-1) but not dk
+      draft_rollback = (k - 1) - accepted if spec.drafts and accepted < k else 0
+      if spec.drafts and accepted == k: spec.pending = [spec.drafts[-1], tokens[-1]]
+      else: spec.pending = [tokens[-1]]
+      spec.proposed += len(spec.drafts)
+      spec.accepted += accepted
+      if draft_rollback: await self.inference_engine.trim_cache(draft_request_id(request_id), draft_rollback)
+      spec.drafts = await propose_drafts(self.inference_engine, draft_request_id(request_id), spec.draft_shard, spec.pending, k)
+      if request_id in self.cancelled_requests: return
+      inference_state = {"origin_node_id": self.id, "speculative": {"drafts": spec.drafts, "rollback": ring_rollback}}
+      if spec.generation: inference_state["generation"] = spec.generation
+      await self.forward_tensor(spec.base_shard, np.array([[tokens[-1], *spec.drafts]]), request_id, 0, inference_state)
+    except Exception as e:
+      self.speculations.pop(request_id, None)
+      print(f"Error in speculative decoding for {request_id=}: {e}")
+      traceback.print_exc()
+
 
   async def process_prompt(
     self,
     base_shard: Shard,
     prompt: str,
     request_id: Optional[str] = None,
-    inference_state: Optional[dict] = {},
+    inference_state: Optional[dict] = None,
   ) -> Optional[np.ndarray]:
     shard = self.get_current_shard(base_shard)
+    if not (inference_state or {}).get("origin_node_id"):
+      # the request entered the cluster here, this is where its results have to go
+      inference_state = {**(inference_state or {}), "origin_node_id": self.id}
+      if request_id is not None and self.start_speculation(base_shard, prompt, request_id, inference_state.get("generation")):
+        inference_state["speculative"] = {}
     start_time = time.perf_counter_ns()
-    asyncio.create_task(
-      self.broadcast_opaque_status(
-        request_id,
-        json.dumps({
-          "type": "node_status",
-          "node_id": self.id,
-          "status": "start_process_prompt",
-          "base_shard": base_shard.to_dict(),
-          "shard": shard.to_dict(),
-          "prompt": prompt,
-          "request_id": request_id,
-        }),
-      )
-    )
+    self.broadcast_status(request_id, {"type": "node_status", "node_id": self.id, "status": "start_process_prompt", "base_shard": base_shard, "shard": shard})
     start_time = time.perf_counter_ns()
     resp = await self._process_prompt(base_shard, prompt, request_id, inference_state)
     end_time = time.perf_counter_ns()
     elapsed_time_ns = end_time - start_time
-    asyncio.create_task(
-      self.broadcast_opaque_status(
-        request_id,
-        json.dumps({
-          "type": "node_status",
-          "node_id": self.id,
-          "status": "end_process_prompt",
-          "base_shard": base_shard.to_dict(),
-          "shard": shard.to_dict(),
-          "prompt": prompt,
-          "request_id": request_id,
-          "elapsed_time_ns": elapsed_time_ns,
-        }),
-      )
+    self.broadcast_status(
+      request_id, {"type": "node_status", "node_id": self.id, "status": "end_process_prompt", "base_shard": base_shard, "shard": shard, "elapsed_time_ns": elapsed_time_ns}
     )
     if DEBUG >= 2: print(f"[{request_id}] process prompt: {base_shard=} {shard=} {prompt=} {elapsed_time_ns=}")
 
   async def _process_prompt(self, base_shard: Shard, prompt: str, request_id: Optional[str] = None, inference_state: Optional[dict] = None) -> Optional[np.ndarray]:
     if request_id is None:
       request_id = str(uuid.uuid4())
+    if request_id in self.cancelled_requests: return None
     shard = self.get_current_shard(base_shard)
     if DEBUG >= 2: print(f"[{request_id}] process prompt: {base_shard=} {shard=} {prompt=}")
 
@@ -211,10 +373,82 @@ class Node:
       return None
     else:
       self.outstanding_requests[request_id] = "processing"
-      result, inference_state = await self.inference_engine.infer_prompt(request_id, shard, prompt, inference_state)
+      node_state, inference_state = split_node_state(inference_state)
+      if self.prefill_chunk_size > 0 and not shard.is_last_layer() and shard.model_id != 'stable-diffusion-2-1-base':
+        tokens = (await self.inference_engine.encode(shard, prompt)).reshape(1, -1)
+        cached = await self.inference_engine.cached_prefix_length(shard, tokens[0])
+        if tokens.shape[1] - cached > self.prefill_chunk_size:
+          return await self.process_prompt_chunks(shard, tokens, request_id, node_state, inference_state, cached)
+        result, inference_state = await self.inference_engine.infer_tensor(request_id, shard, tokens, inference_state)
+      else:
+        result, inference_state = await self.inference_engine.infer_prompt(request_id, shard, prompt, inference_state)
+      inference_state = merge_node_state(node_state, inference_state)
       ret = await self.process_inference_result(shard, result, request_id, inference_state)
       return result
 
+  async def process_prompt_chunks(self, shard: Shard, tokens: np.ndarray, request_id: str, node_state: dict, inference_state: Optional[dict], cached: int = 0) -> np.ndarray:
+    # while the next shard works on chunk i we already compute chunk i+1, each shard keeps extending the request's kv cache.
+    # the first chunk also holds the cached prefix, which the engines restore instead of computing
+    bounds = [0, *range(cached + self.prefill_chunk_size, tokens.shape[1], self.prefill_chunk_size), tokens.shape[1]]
+    chunks = [tokens[:, start:end] for start, end in zip(bounds, bounds[1:])]
+    if DEBUG >= 2: print(f"[{request_id}] pipelining prefill of {tokens.shape[1]} tokens ({cached} cached) in {len(chunks)} chunks")
+    prompt = tokens[0].tolist()
+    for index, chunk in enumerate(chunks):
+      if request_id in self.cancelled_requests or self.prefill_attempts.get(request_id, 0) > 0: return None
+      # the prefix cache is matched with the first chunk and gets the whole prompt after the last one
+      if index == 0: prefix = {"store": None, "tokens": prompt}
+      elif index == len(chunks) - 1: prefix = {"store": prefix_key(tokens[0]), "tokens": prompt}
+      else: prefix = None
+      chunk_state = inference_state if prefix is None else {**(inference_state or {}), "prefix_cache": prefix}
+      try:
+        result, chunk_state = await self.inference_engine.infer_tensor(request_id, shard, chunk, chunk_state)
+      except Exception:
+        # a shard further down missed the cached prefix and restarted the prompt meanwhile, which dropped this attempt's kv cache
+        if self.prefill_attempts.get(request_id, 0) > 0: return None
+        raise
+      await self.process_inference_result(shard, result, request_id, merge_node_state({**node_state, "prefill_chunk": [index, len(chunks)]}, chunk_state))
+    return result
+
+  @asynccontextmanager
+  async def prefill_turn(self, request_id: str, prefill_chunk: Optional[List[int]]):
+    """Prompt chunks of a request must extend the kv cache in order, however they arrive."""
+    if prefill_chunk is None:
+      yield
+      return
+    index, count = prefill_chunk
+    turn, condition = self.prefill_turns.setdefault(request_id, ([0], asyncio.Condition()))
+    async with condition:
+      await condition.wait_for(lambda: turn[0] == index)
+    try:
+      yield
+    finally:
+      async with condition:
+        turn[0] = index + 1
+        condition.notify_all()
+      if index == count - 1: self.prefill_turns.pop(request_id, None)
+
+  def stale_prefill(self, request_id: str, node_state: dict) -> bool:
+    attempt, current = node_state.get("prefill_attempt", 0), self.prefill_attempts.get(request_id, 0)
+    if attempt > current: self.prefill_attempts[request_id] = attempt
+    # chunks of an attempt that was restarted are still in flight, they would extend the restarted kv cache
+    return attempt < current and "prefill_chunk" in node_state
+
+  async def restart_prefill(self, shard: Shard, request_id: str, node_state: dict, miss: PrefixCacheMiss) -> None:
+    """
+    This shard does not have the cached prefix the first shard restored, e.g. it was evicted here. The whole prompt goes
+    through the ring again from the first shard without the prefix cache, each shard dropping what it kept of the request.
+    """
+    if miss.tokens is None:
+      self.outstanding_requests.pop(request_id, None)
+      print(f"Error processing tensor for shard {shard}: {miss}, the prompt is unknown so it cannot be prefilled again")
+      return
+    attempt = node_state.get("prefill_attempt", 0) + 1
+    self.prefill_attempts[request_id] = attempt
+    if DEBUG >= 1: print(f"[{request_id}] {miss}, prefilling the prompt of {len(miss.tokens)} tokens again (attempt {attempt})")
+    node_state = {**{k: v for k, v in node_state.items() if k != "prefill_chunk"}, "prefill_attempt": attempt}
+    self.outstanding_requests[request_id] = "waiting"
+    asyncio.create_task(self.forward_tensor(shard, np.array([miss.tokens]), request_id, 0, {**node_state, "prefix_cache": {"restart": True}}))
+
   async def enqueue_example(
     self,
     base_shard: Shard,
@@ -269,38 +503,13 @@ class Node:
     request_id: Optional[str] = None,
   ):
     shard = self.get_current_shard(base_shard)
-    asyncio.create_task(
-      self.broadcast_opaque_status(
-        request_id,
-        json.dumps({
-          "type": "node_status",
-          "node_id": self.id,
-          "status": f"start_{'train' if train else 'eval'}_example",
-          "base_shard": base_shard.to_dict(),
-          "shard": shard.to_dict(),
-          "example_size": example.size,
-          "example_shape": example.shape,
-          "request_id": request_id,
-        }),
-      )
-    )
+    self.broadcast_status(request_id, {"type": "node_status", "node_id": self.id, "status": f"start_{'train' if train else 'eval'}_example", "base_shard": base_shard, "shard": shard})
     start_time = time.perf_counter_ns()
     resp = await self._process_example(shard, example, target, length, train, request_id)
     end_time = time.perf_counter_ns()
     elapsed_time_ns = end_time - start_time
-    asyncio.create_task(
-      self.broadcast_opaque_status(
-        request_id,
-        json.dumps({
-          "type": "node_status",
-          "node_id": self.id,
-          "status": f"end_{'train' if train else 'eval'}_example",
-          "base_shard": base_shard.to_dict(),
-          "shard": shard.to_dict(),
-          "request_id": request_id,
-          "elapsed_time_ns": elapsed_time_ns,
-        }),
-      )
+    self.broadcast_status(
+      request_id, {"type": "node_status", "node_id": self.id, "status": f"end_{'train' if train else 'eval'}_example", "base_shard": base_shard, "shard": shard, "elapsed_time_ns": elapsed_time_ns}
     )
     return resp
 
@@ -375,15 +584,26 @@ class Node:
   ) -> Optional[np.ndarray]:
     if request_id is None:
       request_id = str(uuid.uuid4())
+    if request_id in self.cancelled_requests:
+      if DEBUG >= 2: print(f"[{request_id}] dropping tensor for cancelled request")
+      return None
     shard = self.get_current_shard(base_shard)
 
+    node_state, inference_state = split_node_state(inference_state)
     try:
       self.outstanding_requests[request_id] = "processing"
-      result, inference_state = await self.inference_engine.infer_tensor(request_id, shard, tensor, inference_state)
+      rollback = node_state.get("speculative", {}).get("rollback")
+      if rollback: await self.inference_engine.trim_cache(request_id, rollback)
+      async with self.prefill_turn(request_id, node_state.get("prefill_chunk")):
+        if self.stale_prefill(request_id, node_state): return None
+        result, inference_state = await self.batch_scheduler.infer_tensor(request_id, shard, tensor, inference_state)
+      inference_state = merge_node_state(node_state, inference_state)
       ret = await self.process_inference_result(shard, result, request_id, inference_state) 
       return ret
+    except PrefixCacheMiss as e:
+      await self.restart_prefill(shard, request_id, node_state, e)
     except Exception as e:
-      self.outstanding_requests.pop(request_id)
+      self.outstanding_requests.pop(request_id, None)
       print(f"Error processing tensor for shard {shard}: {e}")
       traceback.print_exc()
   
@@ -398,10 +618,10 @@ class Node:
     target_index: int,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.partition_cache.partitions(self.topology)[target_index].node_id
     target_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"computed target from: {base_shard} {target_index}, {self.topology}. target shard: {target_shard}")
-    target_peer = next((p for p in self.peers if p.id() == target_id), None)
+    target_peer = self.peers_by_id.get(target_id)
     if not target_peer:
       raise ValueError(f"peer for {target_index} not found")
     if DEBUG >= 1: print(f"sending example to {target_peer.id()}: {step} => {target} ({length})")
@@ -417,13 +637,13 @@ class Node:
     inference_state: Optional[dict] = None,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.partition_cache.partitions(self.topology)[target_index].node_id
     next_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"Computed target from: {base_shard} {target_index}, {self.topology}. next shard: {next_shard}")
     if target_id == self.id:
       await self.process_prompt(next_shard, prompt, request_id, inference_state)
     else:
-      target_peer = next((p for p in self.peers if p.id() == target_id), None)
+      target_peer = self.peers_by_id.get(target_id)
       if not target_peer:
         raise ValueError(f"Peer for {target_index} not found")
       if DEBUG >= 1: print(f"Sending prompt to {target_peer.id()}: {prompt}")
@@ -438,13 +658,13 @@ class Node:
     inference_state: Optional[dict] = None,
   ) -> None:
     if DEBUG >= 1: print(f"target partition index: {target_index}")
-    target_id = self.partitioning_strategy.partition(self.topology)[target_index].node_id
+    target_id = self.partition_cache.partitions(self.topology)[target_index].node_id
     next_shard = self.get_current_shard(base_shard, target_index)
     if DEBUG >= 2: print(f"Computed target from: {base_shard} {target_index}, {self.topology}. target shard: {next_shard}")
     if target_id == self.id:
       await self.process_tensor(next_shard, tensor, request_id, inference_state)
     else:
-      target_peer = next((p for p in self.peers if p.id() == target_id), None)
+      target_peer = self.peers_by_id.get(target_id)
       if not target_peer:
         raise ValueError(f"Peer for {target_index} not found")
       if DEBUG >= 1: print(f"Sending tensor to {target_peer.id()}: {tensor}")
@@ -454,8 +674,8 @@ class Node:
     if not self.partitioning_strategy:
       if DEBUG >= 1: print("No partitioning strategy found. Skipping forward.")
       return None
-    partitions = self.partitioning_strategy.partition(self.topology)
-    current_partition_index = next((i for i, p in enumerate(partitions) if p.node_id == self.id), None)
+    partitions = self.partition_cache.partitions(self.topology)
+    current_partition_index = self.partition_cache.partition_index(self.topology, self.id)
     if current_partition_index is None:
       raise ValueError(f"No current partition found for node: {self.id}")
     return (current_partition_index + offset) % len(partitions)
@@ -463,18 +683,17 @@ class Node:
   def get_current_shard(self, base_shard: Shard, index: Optional[int] = None) -> Shard:
     if index is None:
       index = self.get_partition_index()
-    partitions = self.partitioning_strategy.partition(self.topology)
-    shards = map_partitions_to_shards(partitions, base_shard.n_layers, base_shard.model_id)
+    shards = self.partition_cache.shards(self.topology, base_shard.model_id, base_shard.n_layers)
     return shards[index]
 
   async def update_peers(self, wait_for_peers: int = 0) -> bool:
     next_peers = await self.discovery.discover_peers(wait_for_peers)
-    current_peer_ids = {peer.id() for peer in self.peers}
+    current_peers = self.peers_by_id
     next_peer_ids = {peer.id() for peer in next_peers}
-    peers_added = [peer for peer in next_peers if peer.id() not in current_peer_ids]
+    peers_added = [peer for peer in next_peers if peer.id() not in current_peers]
     peers_removed = [peer for peer in self.peers if peer.id() not in next_peer_ids]
-    peers_updated = [peer for peer in next_peers if peer.id() in current_peer_ids and any(p.addr() != peer.addr() for p in self.peers if p.id() == peer.id())]
-    peers_unchanged = [peer for peer in next_peers if peer.id() in current_peer_ids and all(p.addr() == peer.addr() for p in self.peers if p.id() == peer.id())]
+    peers_updated = [peer for peer in next_peers if peer.id() in current_peers and current_peers[peer.id()].addr() != peer.addr()]
+    peers_unchanged = [peer for peer in next_peers if peer.id() in current_peers and current_peers[peer.id()].addr() == peer.addr()]
     peers_to_disconnect = [peer for peer in peers_removed if await peer.is_connected()]
     peers_to_connect = [peer for peer in peers_added + peers_updated + peers_unchanged if not await peer.is_connected()]
 
@@ -524,6 +743,39 @@ class Node:
     await self.broadcast_supported_engines(supported_engines)
     if len(self.get_topology_inference_engines()):
       self.inference_engine = get_inference_engine(supported_engines[0], self.shard_downloader)
+      self.batch_scheduler.inference_engine = self.inference_engine
+
+  @property
+  def request_states(self) -> Dict[str, RequestStore]:
+    return {
+      "buffered_token_output": self.buffered_token_output,
+      "buffered_logits": self.buffered_logits,
+      "buffered_inputs": self.buffered_inputs,
+      "buffered_partials": self.buffered_partials,
+      "outstanding_requests": self.outstanding_requests,
+      "prefill_attempts": self.prefill_attempts,
+    }
+
+  def finish_request(self, request_id: str) -> None:
+    for store in self.request_states.values():
+      store.finish(request_id)
+
+  def sweep_request_states(self) -> int:
+    evicted = sum(store.sweep() for store in self.request_states.values())
+    if DEBUG >= 2 and evicted: print(f"Evicted {evicted} expired request states")
+    return evicted
+
+  def request_state_stats(self) -> dict:
+    return {name: store.stats() for name, store in self.request_states.items()}
+
+  async def periodic_request_state_sweep(self, interval: float):
+    while True:
+      await asyncio.sleep(interval)
+      try:
+        self.sweep_request_states()
+      except Exception as e:
+        print(f"Error sweeping request states: {e}")
+        traceback.print_exc()
 
   async def periodic_topology_collection(self, interval: int):
     while True:
@@ -570,48 +822,58 @@ class Node:
     next_topology.active_node_id = self.topology.active_node_id
     self.topology = next_topology
     if self.topology_viz:
-      self.topology_viz.update_visualization(self.topology, self.partitioning_strategy.partition(self.topology), self.id)
+      self.topology_viz.update_visualization(self.topology, self.partition_cache.partitions(self.topology), self.id)
     return self.topology
 
+  @property
+  def peers(self) -> List[PeerHandle]:
+    return self._peers
+
+  @peers.setter
+  def peers(self, peers: List[PeerHandle]) -> None:
+    # forwarding looks peers up by id on every hop, keep an index next to the list
+    self._peers = list(peers)
+    self.peers_by_id: Dict[str, PeerHandle] = {peer.id(): peer for peer in self._peers}
+
   @property
   def on_token(self) -> AsyncCallbackSystem[str, Tuple[str, List[int], bool]]:
     return self._on_token
 
   @property
-  def on_opaque_status(self) -> AsyncCallbackSystem[str, Tuple[str, str]]:
-    return self._on_opaque_status
+  def on_status(self) -> AsyncCallbackSystem[str, Tuple[str, dict]]:
+    return self._on_status
 
   def trigger_on_token_callbacks(self, request_id: str, tokens: List[int], is_finished: bool) -> None:
     if DEBUG >= 2: print(f"Triggering all on_token callbacks with {request_id=} {tokens=} {is_finished=}")
     self.on_token.trigger_all(request_id, tokens, is_finished)
   
-  async def broadcast_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
-    async def send_result_to_peer(peer):
-      try:
-        await asyncio.wait_for(peer.send_result(request_id, result, is_finished), timeout=15.0)
-      except asyncio.TimeoutError:
-        print(f"Timeout broadcasting result to {peer.id()}")
-      except Exception as e:
-        print(f"Error broadcasting result to {peer.id()}: {e}")
-        traceback.print_exc()
-
-    await asyncio.gather(*[send_result_to_peer(peer) for peer in self.peers], return_exceptions=True)
-
-  async def broadcast_opaque_status(self, request_id: str, status: str) -> None:
-    if DEBUG >= 8: print(f"Broadcasting opaque status: {request_id=} {status=}")
+  async def deliver_result(self, request_id: str, result: List[int], is_finished: bool, origin_node_id: Optional[str] = None) -> None:
+    if self.broadcast_results or origin_node_id is None:
+      return await self.broadcast_result(request_id, result, is_finished)
+    if origin_node_id == self.id: return
+    peer = self.peers_by_id.get(origin_node_id)
+    if peer is None:
+      if DEBUG >= 1: print(f"[{request_id}] origin node {origin_node_id} is not a peer, broadcasting result")
+      return await self.broadcast_result(request_id, result, is_finished)
+    await self.send_result_to_peer(peer, request_id, result, is_finished)
+
+  async def send_result_to_peer(self, peer: PeerHandle, request_id: str, result: List[int], is_finished: bool) -> None:
+    try:
+      await asyncio.wait_for(peer.send_result(request_id, result, is_finished), timeout=15.0)
+    except asyncio.TimeoutError:
+      print(f"Timeout broadcasting result to {peer.id()}")
+    except Exception as e:
+      print(f"Error broadcasting result to {peer.id()}: {e}")
+      traceback.print_exc()
 
-    async def send_status_to_peer(peer):
-      try:
-        await asyncio.wait_for(peer.send_opaque_status(request_id, status), timeout=15.0)
-      except asyncio.TimeoutError:
-        print(f"Timeout sending opaque status to {peer.id()}")
-      except Exception as e:
-        print(f"Error sending opaque status to {peer.id()}: {e}")
-        traceback.print_exc()
+  async def broadcast_result(self, request_id: str, result: List[int], is_finished: bool) -> None:
+    await asyncio.gather(*[self.send_result_to_peer(peer, request_id, result, is_finished) for peer in self.peers], return_exceptions=True)
 
-    await asyncio.gather(*[send_status_to_peer(peer) for peer in self.peers], return_exceptions=True)
-    # in the case of opaque status, we also want to receive our own opaque statuses
-    self.on_opaque_status.trigger_all(request_id, status)
+  def broadcast_status(self, request_id: str, status: dict) -> None:
+    if DEBUG >= 8: print(f"Broadcasting status: {request_id=} {status=}")
+    # peers get it with the next batch from the status bus, we want to receive our own statuses right away
+    self.status_bus.publish(self.peers, request_id, status)
+    self.on_status.trigger_all(request_id, status)
 
   @property
   def current_topology(self) -> Topology:
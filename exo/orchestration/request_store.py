@@ -0,0 +1,90 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, MutableMapping, Optional
+
+_MISSING = object()
+
+
+class RequestStore(MutableMapping):
+  """
+  A dict of per-request state that does not outlive its request. An entry is dropped ttl seconds after
+  finish() is called for it, or idle_ttl seconds after it was last used if that never happens (a client
+  that went away, a shard that never learns the request ended). Beyond max_entries the least recently
+  used entry is dropped right away, finished entries before live ones.
+  """
+  def __init__(self, ttl: float = 60.0, idle_ttl: float = 900.0, max_entries: int = 10000, default_factory: Optional[Callable[[], Any]] = None, clock: Callable[[], float] = time.monotonic):
+    self.ttl = ttl
+    self.idle_ttl = idle_ttl
+    self.max_entries = max_entries
+    self.default_factory = default_factory
+    self.clock = clock
+    # least recently used first
+    self.entries: OrderedDict[str, Any] = OrderedDict()
+    self.used_at: Dict[str, float] = {}
+    # in the order the requests finished
+    self.finished_at: Dict[str, float] = {}
+    self.evicted = 0
+
+  def __getitem__(self, key: str) -> Any:
+    if key not in self.entries:
+      if self.default_factory is None: raise KeyError(key)
+      self[key] = self.default_factory()
+    self.touch(key)
+    return self.entries[key]
+
+  def __setitem__(self, key: str, value: Any) -> None:
+    self.entries[key] = value
+    self.touch(key)
+    if len(self.entries) > self.max_entries: self.evict_one(keep=key)
+
+  def __delitem__(self, key: str) -> None:
+    del self.entries[key]
+    self.used_at.pop(key, None)
+    self.finished_at.pop(key, None)
+
+  def __contains__(self, key: object) -> bool:
+    return key in self.entries
+
+  def __iter__(self) -> Iterator[str]:
+    return iter(list(self.entries))
+
+  def __len__(self) -> int:
+    return len(self.entries)
+
+  def get(self, key: str, default: Any = None) -> Any:
+    return self[key] if key in self.entries else default
+
+  def pop(self, key: str, default: Any = _MISSING) -> Any:
+    if key not in self.entries:
+      if default is _MISSING: raise KeyError(key)
+      return default
+    value = self.entries[key]
+    del self[key]
+    return value
+
+  def touch(self, key: str) -> None:
+    self.entries.move_to_end(key)
+    self.used_at[key] = self.clock()
+
+  def finish(self, key: str) -> None:
+    if key in self.entries and key not in self.finished_at: self.finished_at[key] = self.clock()
+
+  def evict_one(self, keep: Optional[str] = None) -> None:
+    victim = next((key for key in self.finished_at if key != keep), None)
+    if victim is None: victim = next(key for key in self.entries if key != keep)
+    del self[victim]
+    self.evicted += 1
+
+  def sweep(self) -> int:
+    now = self.clock()
+    expired = [key for key, finished_at in self.finished_at.items() if now - finished_at >= self.ttl]
+    for key in self.entries:
+      if now - self.used_at[key] < self.idle_ttl: break
+      if key not in self.finished_at: expired.append(key)
+    for key in expired:
+      del self[key]
+    self.evicted += len(expired)
+    return len(expired)
+
+  def stats(self) -> dict:
+    return {"live": len(self.entries) - len(self.finished_at), "finished": len(self.finished_at), "evicted": self.evicted}
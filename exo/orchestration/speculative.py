@@ -0,0 +1,51 @@
+import asyncio
+import numpy as np
+from dataclasses import dataclass, field
+from typing import List
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+
+
+@dataclass
+class Speculation:
+  """What the origin node tracks for a request it decodes speculatively with a local draft model."""
+  base_shard: Shard
+  draft_shard: Shard
+  k: int
+  prefill: asyncio.Task
+  # drafts sent for verification in the current round
+  drafts: List[int] = field(default_factory=list)
+  # verified tokens the draft model has not consumed yet
+  pending: List[int] = field(default_factory=list)
+  # per-request generation parameters, sent along with every verification step
+  generation: dict = field(default_factory=dict)
+  proposed: int = 0
+  accepted: int = 0
+
+
+def verify_drafts(logits: np.ndarray, drafts: List[int]) -> List[int]:
+  """
+  Greedy verification of drafts against the target model's logits for [last token, *drafts]: the longest
+  prefix of drafts the target agrees with, followed by the target's own token after it.
+  """
+  predictions = np.argmax(logits[0, -(len(drafts) + 1):], axis=-1)
+  accepted = 0
+  while accepted < len(drafts) and predictions[accepted] == drafts[accepted]:
+    accepted += 1
+  return [int(token) for token in drafts[:accepted]] + [int(predictions[accepted])]
+
+
+def draft_request_id(request_id: str) -> str:
+  # the draft model runs on the node's own engine, so its kv cache is kept apart from the target model's one for the same request
+  return f"{request_id}/draft"
+
+
+async def propose_drafts(engine: InferenceEngine, request_id: str, shard: Shard, tokens: List[int], k: int) -> List[int]:
+  """Feeds tokens to the draft model and greedily proposes k more. The last proposal is not fed back."""
+  drafts = []
+  x = tokens
+  for _ in range(k):
+    logits, _ = await engine.infer_tensor(request_id, shard, np.array([x]))
+    drafts.append(int(np.argmax(logits[0, -1])))
+    x = drafts[-1:]
+  return drafts
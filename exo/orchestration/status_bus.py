@@ -0,0 +1,77 @@
+import asyncio
+import itertools
+import traceback
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterable, Optional, Set
+from exo import DEBUG
+from exo.networking import PeerHandle
+
+# Status types where only the latest event per node matters, older pending ones are dropped
+SUPERSEDED_STATUS_TYPES = ("download_progress", "supported_inference_engines")
+
+
+def superseding_key(status: dict) -> Optional[Hashable]:
+  status_type = status.get("type")
+  return (status_type, status.get("node_id")) if status_type in SUPERSEDED_STATUS_TYPES else None
+
+
+class StatusBus:
+  """
+  Queues status events per peer and sends each peer at most one batch per interval. A peer that is still
+  receiving its previous batch keeps accumulating, so a slow peer never holds up the others.
+  """
+  def __init__(self, interval: float = 0.1, timeout: float = 15.0):
+    self.interval = interval
+    self.timeout = timeout
+    self.peers: Dict[str, PeerHandle] = {}
+    self.pending: Dict[str, OrderedDict] = {}
+    self.sending: Set[str] = set()
+    self.flusher: Optional[asyncio.Task] = None
+    self.event_ids = itertools.count()
+    self.published = 0
+    self.superseded = 0
+    self.batches_sent = 0
+    self.events_sent = 0
+
+  def publish(self, peers: Iterable[PeerHandle], request_id: str, status: dict) -> None:
+    key = superseding_key(status)
+    if key is None: key = next(self.event_ids)
+    self.published += 1
+    for peer in peers:
+      self.peers[peer.id()] = peer
+      pending = self.pending.setdefault(peer.id(), OrderedDict())
+      if pending.pop(key, None) is not None: self.superseded += 1
+      pending[key] = (request_id, status)
+    if self.pending and (self.flusher is None or self.flusher.done()):
+      self.flusher = asyncio.create_task(self.run())
+
+  async def run(self) -> None:
+    while self.pending:
+      await asyncio.sleep(self.interval)
+      for peer_id in list(self.pending.keys()):
+        if peer_id in self.sending: continue
+        events = list(self.pending.pop(peer_id).values())
+        self.sending.add(peer_id)
+        asyncio.create_task(self.send(self.peers.pop(peer_id), events))
+
+  async def send(self, peer: PeerHandle, events: list) -> None:
+    try:
+      await asyncio.wait_for(peer.send_status_batch(events), timeout=self.timeout)
+      self.batches_sent += 1
+      self.events_sent += len(events)
+    except asyncio.TimeoutError:
+      print(f"Timeout sending status to {peer.id()}")
+    except Exception as e:
+      print(f"Error sending status to {peer.id()}: {e}")
+      if DEBUG >= 2: traceback.print_exc()
+    finally:
+      self.sending.discard(peer.id())
+
+  def stats(self) -> dict:
+    return {
+      "published": self.published,
+      "superseded": self.superseded,
+      "batches_sent": self.batches_sent,
+      "events_sent": self.events_sent,
+      "pending": sum(len(pending) for pending in self.pending.values()),
+    }
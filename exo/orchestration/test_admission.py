@@ -0,0 +1,70 @@
+import asyncio
+import unittest
+from exo.orchestration.admission import AdmissionController, QueueFull
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+  async def test_requests_beyond_the_limit_wait_for_a_slot(self):
+    admission = AdmissionController(max_concurrent=1, max_queued=4)
+    await admission.acquire()
+    waiter = asyncio.create_task(admission.acquire())
+    await asyncio.sleep(0)
+    self.assertFalse(waiter.done())
+    self.assertEqual(admission.queued, 1)
+
+    admission.release()
+    await waiter
+    self.assertEqual((admission.active, admission.queued), (1, 0))
+    admission.release()
+    self.assertEqual(admission.active, 0)
+
+  async def test_interactive_requests_go_before_batch_requests(self):
+    admission = AdmissionController(max_concurrent=1, max_queued=4)
+    await admission.acquire()
+    order = []
+
+    async def request(priority):
+      await admission.acquire(priority)
+      order.append(priority)
+
+    tasks = [asyncio.create_task(request(priority)) for priority in ("batch", "interactive", "batch", "interactive")]
+    await asyncio.sleep(0)
+    for _ in tasks:
+      admission.release()
+      await asyncio.sleep(0)
+    await asyncio.gather(*tasks)
+    self.assertEqual(order, ["interactive", "interactive", "batch", "batch"])
+    self.assertEqual(admission.stats()["lanes"]["batch"]["admitted"], 2)
+
+  async def test_full_queue_rejects_right_away(self):
+    admission = AdmissionController(max_concurrent=1, max_queued=1)
+    await admission.acquire()
+    waiter = asyncio.create_task(admission.acquire("batch"))
+    await asyncio.sleep(0)
+    with self.assertRaises(QueueFull):
+      await admission.acquire("batch")
+    self.assertEqual(admission.stats()["lanes"]["batch"]["rejected"], 1)
+    waiter.cancel()
+
+  async def test_giving_up_leaves_the_queue(self):
+    admission = AdmissionController(max_concurrent=1, max_queued=4)
+    await admission.acquire()
+    with self.assertRaises(asyncio.TimeoutError):
+      await asyncio.wait_for(admission.acquire(), timeout=0.01)
+    self.assertEqual(admission.queued, 0)
+    admission.release()
+    self.assertEqual(admission.active, 0)
+
+  async def test_no_limit(self):
+    admission = AdmissionController(max_concurrent=0)
+    for _ in range(100):
+      await admission.acquire()
+    self.assertEqual(admission.active, 100)
+
+  async def test_unknown_priority(self):
+    with self.assertRaises(ValueError):
+      await AdmissionController().acquire("urgent")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,85 @@
+import asyncio
+import unittest
+import numpy as np
+from exo.inference.dummy_inference_engine import DummyInferenceEngine
+from exo.inference.inference_engine import InferenceEngine
+from exo.inference.shard import Shard
+from exo.orchestration.batch_scheduler import BatchScheduler
+
+
+class CountingInferenceEngine(DummyInferenceEngine):
+  def __init__(self):
+    super().__init__()
+    self.batch_sizes = []
+
+  async def infer_tensor(self, request_id, shard, input_data, inference_state=None):
+    if input_data.shape[0] == 1: self.batch_sizes.append(1)
+    await asyncio.sleep(0.01)
+    return await super().infer_tensor(request_id, shard, input_data, inference_state)
+
+  async def infer_tensor_batch(self, request_ids, shard, input_datas, inference_states):
+    self.batch_sizes.append(len(request_ids))
+    return await super().infer_tensor_batch(request_ids, shard, input_datas, inference_states)
+
+
+class TestBatchScheduler(unittest.IsolatedAsyncioTestCase):
+  async def test_concurrent_requests_share_a_batch(self):
+    engine = CountingInferenceEngine()
+    scheduler = BatchScheduler(engine, max_batch_size=8)
+    shard = Shard("dummy", 0, 7, 8)
+
+    results = await asyncio.gather(*[scheduler.infer_tensor(f"req{i}", shard, np.array([[i]])) for i in range(5)])
+
+    self.assertEqual(engine.batch_sizes, [5])
+    for i, (output, _) in enumerate(results):
+      np.testing.assert_array_equal(output, np.array([[i + 1]]))
+
+  async def test_requests_arriving_during_a_call_join_the_next_batch(self):
+    engine = CountingInferenceEngine()
+    scheduler = BatchScheduler(engine, max_batch_size=8)
+    shard = Shard("dummy", 0, 7, 8)
+
+    first = asyncio.create_task(scheduler.infer_tensor("req0", shard, np.array([[0]])))
+    await asyncio.sleep(0)
+    rest = [asyncio.create_task(scheduler.infer_tensor(f"req{i}", shard, np.array([[i]]))) for i in range(1, 5)]
+    await asyncio.gather(first, *rest)
+
+    self.assertEqual(engine.batch_sizes, [1, 4])
+
+  async def test_max_batch_size(self):
+    engine = CountingInferenceEngine()
+    scheduler = BatchScheduler(engine, max_batch_size=2)
+    shard = Shard("dummy", 0, 7, 8)
+
+    await asyncio.gather(*[scheduler.infer_tensor(f"req{i}", shard, np.array([[i]])) for i in range(5)])
+
+    self.assertEqual(engine.batch_sizes, [2, 2, 1])
+    self.assertEqual(scheduler.running, {})
+    self.assertEqual(scheduler.pending, {})
+
+  async def test_errors_are_delivered_to_every_request_in_the_batch(self):
+    engine = CountingInferenceEngine()
+    async def failing_batch(*args): raise RuntimeError("boom")
+    engine.infer_tensor_batch = failing_batch
+    scheduler = BatchScheduler(engine)
+    shard = Shard("dummy", 0, 7, 8)
+
+    results = await asyncio.gather(*[scheduler.infer_tensor(f"req{i}", shard, np.array([[i]])) for i in range(3)], return_exceptions=True)
+
+    self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+    self.assertEqual(scheduler.running, {})
+
+  async def test_engines_without_batching_are_called_directly(self):
+    engine = CountingInferenceEngine()
+    engine.__class__ = type("SequentialInferenceEngine", (CountingInferenceEngine,), {"infer_tensor_batch": InferenceEngine.infer_tensor_batch})
+    scheduler = BatchScheduler(engine)
+    shard = Shard("dummy", 0, 7, 8)
+
+    await asyncio.gather(*[scheduler.infer_tensor(f"req{i}", shard, np.array([[i]])) for i in range(3)])
+
+    self.assertEqual(engine.batch_sizes, [1, 1, 1])
+    self.assertEqual(scheduler.pending, {})
+
+
+if __name__ == "__main__":
+  unittest.main()
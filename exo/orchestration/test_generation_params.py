@@ -0,0 +1,98 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.orchestration.generation import generation_params, hits_stop_sequence, truncate_at_stop, StopStringFilter
+from exo.orchestration import testing
+
+BASE_SHARD = Shard("dummy", 0, 31, 32)
+
+
+class CharTokenizer:
+  eos_token_id = 0
+
+  def decode(self, tokens):
+    return "".join(chr(ord("a") + t - 1) for t in tokens)
+
+
+def make_node(tokens):
+  node = testing.make_node("last", max_generate_tokens=100, default_sample_temperature=0.6)
+  node.inference_engine.sample = mock.AsyncMock(side_effect=[np.array(token) for token in tokens])
+  node.inference_engine.tokenizer = CharTokenizer()
+  node.forward_tensor = mock.AsyncMock()
+  node.deliver_result = mock.AsyncMock()
+  return node
+
+
+async def decode(node, generation, steps):
+  for _ in range(steps):
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 1)), "req", {"origin_node_id": "origin", "generation": generation})
+  await asyncio.sleep(0)
+
+
+class TestGenerationParams(unittest.IsolatedAsyncioTestCase):
+  def test_unset_params_are_left_to_the_node(self):
+    self.assertEqual(generation_params(max_tokens=16, stop=[""]), {"max_tokens": 16})
+    self.assertEqual(generation_params(temperature=0.0, top_p=0.9, stop=["\n"]), {"temperature": 0.0, "top_p": 0.9, "stop": ["\n"]})
+
+  def test_stop_sequences(self):
+    tokenizer = CharTokenizer()
+    # "abcde"
+    self.assertTrue(hits_stop_sequence(tokenizer, [1, 2, 3, 4, 5], 1, ["de"]))
+    self.assertFalse(hits_stop_sequence(tokenizer, [1, 2, 3, 4, 5], 1, ["ab"]))
+    self.assertFalse(hits_stop_sequence(tokenizer, [1, 2, 3], 1, None))
+    self.assertEqual(truncate_at_stop("hello\nworld. bye", ["bye", "\n"]), ("hello", True))
+    self.assertEqual(truncate_at_stop("hello", ["\n"]), ("hello", False))
+
+  def test_stop_strings_split_across_streamed_chunks(self):
+    stop_filter = StopStringFilter(["</end>", "\n\n"])
+    chunks = ["Hello <", "/e", "nd> world"]
+    self.assertEqual([stop_filter.feed(chunk) for chunk in chunks], ["Hello ", "", ""])
+    self.assertTrue(stop_filter.stopped)
+
+    stop_filter = StopStringFilter(["</end>"])
+    self.assertEqual(stop_filter.feed("a </"), "a ")
+    self.assertEqual(stop_filter.feed("b>"), "</b>")
+    self.assertEqual(stop_filter.feed("x <"), "x ")
+    self.assertEqual(stop_filter.flush(), "<")
+    self.assertFalse(stop_filter.stopped)
+
+  async def test_max_tokens_finishes_the_request_early(self):
+    node = make_node([5, 6, 7])
+    await decode(node, {"max_tokens": 2}, 2)
+
+    self.assertEqual(node.buffered_token_output["req"], ([5, 6], True))
+    self.assertEqual(node.deliver_result.call_args_list[-1].args, ("req", [6], True, "origin"))
+    self.assertEqual(node.forward_tensor.call_count, 1)
+
+  async def test_max_tokens_cannot_exceed_the_node_limit(self):
+    node = make_node([5])
+    self.assertEqual(node.max_tokens({"max_tokens": 10_000}), 100)
+    self.assertEqual(node.max_tokens({}), 100)
+
+  async def test_sampling_params_reach_the_engine(self):
+    node = make_node([5, 6])
+    await decode(node, {"temperature": 0.0, "top_p": 0.5}, 1)
+    node.inference_engine.sample.assert_awaited_with(mock.ANY, temp=0.0, top_p=0.5)
+    await decode(node, {}, 1)
+    node.inference_engine.sample.assert_awaited_with(mock.ANY, temp=0.6)
+
+  async def test_stop_string_finishes_the_request(self):
+    # "b", "c", "d"
+    node = make_node([2, 3, 4])
+    await decode(node, {"stop": ["bc"]}, 2)
+
+    self.assertEqual(node.buffered_token_output["req"], ([2, 3], True))
+    self.assertNotIn("req", node.outstanding_requests)
+
+  async def test_generation_params_travel_around_the_ring(self):
+    node = make_node([5])
+    await decode(node, {"max_tokens": 8}, 1)
+    self.assertEqual(node.forward_tensor.call_args.args[4]["generation"], {"max_tokens": 8})
+    infer_state = node.inference_engine.infer_tensor.call_args.args[3]
+    self.assertNotIn("generation", infer_state or {})
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,104 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.prefix_cache import PrefixCacheMiss, prefix_key
+from exo.inference.shard import Shard
+from exo.orchestration import testing
+
+BASE_SHARD = Shard("dummy", 0, 31, 32)
+
+
+def make_node(node_id):
+  # "first" holds layers 0-15, "last" holds 16-31
+  node = testing.make_node(node_id, {"first": 2000, "last": 1000}, prefill_chunk_size=512)
+  engine = node.inference_engine
+  engine.encode = mock.AsyncMock(return_value=np.arange(1200))
+  engine.cached_prefix_length = mock.AsyncMock(return_value=0)
+  engine.sample = mock.AsyncMock(return_value=np.array(7))
+  engine.tokenizer = mock.Mock(eos_token_id=0)
+  return node
+
+
+class TestPrefillPipeline(unittest.IsolatedAsyncioTestCase):
+  async def test_long_prompts_are_sent_through_the_ring_in_chunks(self):
+    node = make_node("first")
+    node.forward_tensor = mock.AsyncMock()
+    await node._process_prompt(BASE_SHARD, "prompt", "req", {"origin_node_id": "first"})
+    await asyncio.sleep(0)
+
+    self.assertEqual([call.args[2].shape[1] for call in node.inference_engine.infer_tensor.call_args_list], [512, 512, 176])
+    self.assertEqual([call.args[4]["prefill_chunk"] for call in node.forward_tensor.call_args_list], [[0, 3], [1, 3], [2, 3]])
+    node.inference_engine.sample.assert_not_awaited()
+
+  async def test_short_prompts_are_not_chunked(self):
+    node = make_node("first")
+    node.inference_engine.encode.return_value = np.arange(100)
+    node.forward_tensor = mock.AsyncMock()
+    await node._process_prompt(BASE_SHARD, "prompt", "req", {"origin_node_id": "first"})
+    await asyncio.sleep(0)
+
+    node.inference_engine.infer_tensor.assert_awaited_once()
+    self.assertNotIn("prefill_chunk", node.forward_tensor.call_args.args[4])
+
+  async def test_the_cached_prefix_goes_with_the_first_chunk(self):
+    node = make_node("first")
+    node.inference_engine.cached_prefix_length.return_value = 600
+    node.forward_tensor = mock.AsyncMock()
+    await node._process_prompt(BASE_SHARD, "prompt", "req", {"origin_node_id": "first"})
+    await asyncio.sleep(0)
+
+    calls = node.inference_engine.infer_tensor.call_args_list
+    self.assertEqual([call.args[2].shape[1] for call in calls], [1112, 88])
+    # the snapshot is taken after the last chunk, of the whole prompt
+    self.assertEqual([call.args[3]["prefix_cache"]["store"] for call in calls], [None, prefix_key(np.arange(1200))])
+    self.assertEqual(calls[1].args[3]["prefix_cache"]["tokens"], list(range(1200)))
+
+  async def test_prompts_mostly_cached_are_not_chunked(self):
+    node = make_node("first")
+    node.inference_engine.cached_prefix_length.return_value = 700
+    node.forward_tensor = mock.AsyncMock()
+    await node._process_prompt(BASE_SHARD, "prompt", "req", {"origin_node_id": "first"})
+    await asyncio.sleep(0)
+
+    node.inference_engine.infer_tensor.assert_awaited_once()
+
+  async def test_chunks_are_processed_in_order_and_only_the_last_samples(self):
+    node = make_node("last")
+    node.forward_tensor = mock.AsyncMock()
+    node.deliver_result = mock.AsyncMock()
+    chunks = {index: np.zeros((1, 512 if index < 2 else 176, 4)) for index in range(3)}
+    await asyncio.gather(*[node._process_tensor(BASE_SHARD, chunks[index], "req", {"origin_node_id": "first", "prefill_chunk": [index, 3]}) for index in (2, 0, 1)])
+
+    self.assertEqual([call.args[2].shape[1] for call in node.inference_engine.infer_tensor.call_args_list], [512, 512, 176])
+    node.inference_engine.sample.assert_awaited_once()
+    node.deliver_result.assert_called_once_with("req", [7], False, "first")
+    # the sampled token starts decoding without the chunk marker
+    self.assertNotIn("prefill_chunk", node.forward_tensor.call_args.args[4])
+    self.assertEqual(node.prefill_turns, {})
+
+  async def test_a_prefix_cache_miss_restarts_the_prompt_from_the_first_shard(self):
+    node = make_node("last")
+    node.forward_tensor = mock.AsyncMock()
+    node.inference_engine.infer_tensor.side_effect = PrefixCacheMiss("key", [1, 2, 3])
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 512, 4)), "req", {"origin_node_id": "first", "prefill_chunk": [0, 2]})
+    await asyncio.sleep(0)
+
+    shard, tokens, request_id, index, state = node.forward_tensor.call_args.args
+    np.testing.assert_array_equal(tokens, [[1, 2, 3]])
+    self.assertEqual((request_id, index), ("req", 0))
+    self.assertEqual(state, {"origin_node_id": "first", "prefill_attempt": 1, "prefix_cache": {"restart": True}})
+
+    # the rest of the first attempt is dropped, the restarted prompt goes through
+    node.inference_engine.infer_tensor.side_effect = lambda request_id, shard, x, state=None: (np.zeros((1, x.shape[1], 4)), None)
+    node.inference_engine.infer_tensor.reset_mock()
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 100, 4)), "req", {"origin_node_id": "first", "prefill_chunk": [1, 2]})
+    node.inference_engine.infer_tensor.assert_not_awaited()
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 612, 4)), "req", {"origin_node_id": "first", "prefill_attempt": 1, "prefix_cache": {"restart": True}})
+    node.inference_engine.infer_tensor.assert_awaited_once()
+    self.assertEqual(node.inference_engine.infer_tensor.call_args.args[3], {"prefix_cache": {"restart": True}})
+    node.inference_engine.sample.assert_awaited_once()
+
+
+if __name__ == "__main__":
+  unittest.main()
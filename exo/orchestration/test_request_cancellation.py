@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.orchestration import testing
+from exo.networking.grpc.grpc_peer_handle import GRPCPeerHandle
+from exo.networking.grpc.grpc_server import GRPCServer
+from exo.topology.device_capabilities import UNKNOWN_DEVICE_CAPABILITIES
+
+BASE_SHARD = Shard("dummy", 0, 31, 32)
+
+
+def make_node(node_id="first"):
+  return testing.make_node(node_id, {"first": 2000, "last": 1000})
+
+
+class TestRequestCancellation(unittest.IsolatedAsyncioTestCase):
+  async def test_cancel_frees_the_request_and_tells_every_peer(self):
+    node = make_node()
+    peers = [mock.Mock(id=mock.Mock(return_value=peer_id), cancel_request=mock.AsyncMock()) for peer_id in ("last", "other")]
+    node.peers = peers
+    node.buffered_token_output["req"] = ([1, 2], False)
+    node.outstanding_requests["req"] = "waiting"
+    await node.cancel("req")
+    await asyncio.sleep(0.01)
+
+    self.assertNotIn("req", node.buffered_token_output)
+    self.assertNotIn("req", node.outstanding_requests)
+    node.inference_engine.evict_request.assert_awaited_once_with("req")
+    for peer in peers: peer.cancel_request.assert_awaited_once_with("req")
+
+  async def test_cancel_is_only_propagated_once(self):
+    node = make_node()
+    node.broadcast_cancel = mock.AsyncMock()
+    await node.cancel("req")
+    await node.cancel("req")
+    await asyncio.sleep(0)
+
+    node.broadcast_cancel.assert_awaited_once_with("req")
+    node.inference_engine.evict_request.assert_awaited_once()
+
+  async def test_tensors_of_cancelled_requests_are_dropped(self):
+    node = make_node()
+    node.broadcast_cancel = mock.AsyncMock()
+    node.forward_tensor = mock.AsyncMock()
+    await node.cancel("req")
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 1)), "req", {"origin_node_id": "first"})
+
+    node.inference_engine.infer_tensor.assert_not_awaited()
+    node.forward_tensor.assert_not_called()
+
+  async def test_cancel_during_inference_stops_forwarding_and_frees_the_new_cache(self):
+    node = make_node()
+    node.broadcast_cancel = mock.AsyncMock()
+    node.forward_tensor = mock.AsyncMock()
+
+    async def infer_while_cancelled(request_id, shard, x, state=None):
+      await node.cancel(request_id)
+      return np.zeros((1, 1, 4)), None
+
+    node.inference_engine.infer_tensor.side_effect = infer_while_cancelled
+    await node._process_tensor(BASE_SHARD, np.zeros((1, 1)), "req", {"origin_node_id": "first"})
+    await asyncio.sleep(0)
+
+    node.forward_tensor.assert_not_called()
+    self.assertEqual(node.inference_engine.evict_request.await_count, 2)
+    self.assertNotIn("req", node.outstanding_requests)
+
+
+class TestCancelRequestRPC(unittest.IsolatedAsyncioTestCase):
+  async def asyncSetUp(self):
+    self.node = mock.Mock(cancel=mock.AsyncMock())
+    self.server = GRPCServer(self.node, "localhost", 50075)
+    await self.server.start()
+    self.peer = GRPCPeerHandle("node1", "localhost:50075", "test", UNKNOWN_DEVICE_CAPABILITIES)
+    await self.peer.connect()
+
+  async def asyncTearDown(self):
+    await self.peer.disconnect()
+    await self.server.stop()
+
+  async def test_cancel_request_reaches_the_node(self):
+    await self.peer.cancel_request("req")
+    self.node.cancel.assert_awaited_once_with("req")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,86 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.orchestration import testing
+from exo.orchestration.request_store import RequestStore
+
+
+class Clock:
+  def __init__(self):
+    self.now = 0.0
+
+  def __call__(self):
+    return self.now
+
+
+class TestRequestStore(unittest.TestCase):
+  def setUp(self):
+    self.clock = Clock()
+    self.store = RequestStore(ttl=10, idle_ttl=100, max_entries=3, clock=self.clock)
+
+  def test_finished_entries_expire_after_the_ttl(self):
+    self.store["a"] = 1
+    self.store["b"] = 2
+    self.store.finish("a")
+    self.clock.now = 9
+    self.assertEqual(self.store.sweep(), 0)
+    self.clock.now = 10
+    self.assertEqual(self.store.sweep(), 1)
+    self.assertEqual(list(self.store), ["b"])
+    self.assertEqual(self.store.stats(), {"live": 1, "finished": 0, "evicted": 1})
+
+  def test_unfinished_entries_expire_when_idle(self):
+    self.store["a"] = 1
+    self.store["b"] = 2
+    self.clock.now = 60
+    self.store["a"]
+    self.clock.now = 100
+    self.store.sweep()
+    self.assertEqual(list(self.store), ["a"])
+
+  def test_max_entries_evicts_finished_entries_first(self):
+    for key in "abc":
+      self.store[key] = key
+    self.store.finish("b")
+    self.store["d"] = "d"
+    self.assertEqual(list(self.store), ["a", "c", "d"])
+    self.store["e"] = "e"
+    self.assertEqual(list(self.store), ["c", "d", "e"])
+    self.assertEqual(self.store.evicted, 2)
+
+  def test_dict_interface(self):
+    self.store["a"] = 1
+    self.assertIn("a", self.store)
+    self.assertIsNone(self.store.get("b"))
+    self.assertEqual(self.store.pop("b", None), None)
+    self.assertEqual(self.store.pop("a"), 1)
+    with self.assertRaises(KeyError): self.store.pop("a")
+    with self.assertRaises(KeyError): self.store["a"]
+
+  def test_default_factory_only_creates_on_item_access(self):
+    store = RequestStore(default_factory=list)
+    self.assertNotIn("a", store)
+    self.assertIsNone(store.get("a"))
+    store["a"].append(1)
+    self.assertEqual(store["a"], [1])
+
+
+class TestNodeRequestStates(unittest.IsolatedAsyncioTestCase):
+  async def test_finished_requests_are_swept(self):
+    node = testing.make_node("last", request_state_ttl=0)
+    node.inference_engine.sample = mock.AsyncMock(return_value=np.array(0))
+    node.inference_engine.tokenizer = mock.Mock(eos_token_id=0)
+    node.deliver_result = mock.AsyncMock()
+    await node._process_tensor(Shard("dummy", 0, 31, 32), np.zeros((1, 1)), "req", {"origin_node_id": "origin"})
+    await asyncio.sleep(0)
+
+    self.assertEqual(node.request_state_stats()["buffered_token_output"], {"live": 0, "finished": 1, "evicted": 0})
+    self.assertEqual(node.sweep_request_states(), 1)
+    self.assertNotIn("req", node.buffered_token_output)
+    self.assertEqual(node.request_state_stats()["buffered_token_output"]["evicted"], 1)
+
+
+if __name__ == "__main__":
+  unittest.main()
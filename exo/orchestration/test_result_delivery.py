@@ -0,0 +1,58 @@
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.orchestration.node import Node, split_node_state, merge_node_state
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+def make_peer(peer_id):
+  peer = mock.AsyncMock()
+  peer.id = mock.Mock(return_value=peer_id)
+  return peer
+
+
+class TestResultDelivery(unittest.IsolatedAsyncioTestCase):
+  def setUp(self):
+    self.engine = mock.AsyncMock()
+    self.engine.infer_prompt = mock.AsyncMock(return_value=(np.zeros((1, 1, 8)), None))
+    self.engine.sample = mock.AsyncMock(return_value=np.array(3))
+    self.engine.tokenizer = mock.Mock(eos_token_id=0)
+    self.node = Node("me", None, self.engine, mock.AsyncMock(), RingMemoryWeightedPartitioningStrategy(), max_generate_tokens=1)
+    self.node.topology.update_node("me", DeviceCapabilities(model="test", chip="test", memory=1000, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    self.peers = [make_peer("origin"), make_peer("other")]
+    self.node.peers = self.peers
+
+  async def test_results_go_only_to_origin(self):
+    await self.node.deliver_result("req", [1], False, "origin")
+    self.peers[0].send_result.assert_awaited_once_with("req", [1], False)
+    self.peers[1].send_result.assert_not_awaited()
+
+  async def test_origin_is_stamped_and_hidden_from_the_engine(self):
+    self.node.deliver_result = mock.AsyncMock()
+    await self.node._process_prompt(Shard("dummy", 0, 0, 1), "hi", "req", {"origin_node_id": "origin", "image": 1})
+
+    self.assertEqual(self.engine.infer_prompt.call_args.args[3], {"image": 1})
+    self.node.deliver_result.assert_called_once_with("req", [3], True, "origin")
+
+  async def test_local_origin_needs_no_rpc(self):
+    await self.node.deliver_result("req", [1], False, "me")
+    for peer in self.peers: peer.send_result.assert_not_awaited()
+
+  async def test_broadcast_mode_and_unknown_origin_broadcast(self):
+    await self.node.deliver_result("req", [1], False, "gone")
+    self.node.broadcast_results = True
+    await self.node.deliver_result("req", [2], True, "origin")
+    for peer in self.peers:
+      self.assertEqual([call.args for call in peer.send_result.await_args_list], [("req", [1], False), ("req", [2], True)])
+
+  def test_node_state_round_trip(self):
+    node_state, engine_state = split_node_state({"origin_node_id": "a"})
+    self.assertEqual((node_state, engine_state), ({"origin_node_id": "a"}, None))
+    self.assertEqual(merge_node_state(node_state, {"step": 1}), {"step": 1, "origin_node_id": "a"})
+    self.assertEqual(split_node_state({"step": 1}), ({}, {"step": 1}))
+
+
+if __name__ == "__main__":
+  unittest.main()
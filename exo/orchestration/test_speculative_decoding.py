@@ -0,0 +1,128 @@
+import asyncio
+import unittest
+from unittest import mock
+import numpy as np
+from exo.inference.shard import Shard
+from exo.orchestration import testing
+from exo.orchestration.speculative import Speculation, verify_drafts
+
+BASE_SHARD = Shard("llama-3.1-8b", 0, 31, 32)
+DRAFT_SHARD = Shard("llama-3.2-1b", 0, 15, 16)
+
+
+def one_hot(tokens, vocab=16):
+  logits = np.zeros((1, len(tokens), vocab))
+  logits[0, range(len(tokens)), tokens] = 1
+  return logits
+
+
+def make_node(node_id="origin", k=3):
+  node = testing.make_node(node_id, vocab=16, speculative_tokens=k)
+  node.inference_engine.sample = mock.AsyncMock(return_value=np.array(5))
+  node.inference_engine.tokenizer = mock.Mock(eos_token_id=0)
+  return node
+
+
+def start(node, request_id="req"):
+  prefill = asyncio.get_running_loop().create_future()
+  prefill.set_result(None)
+  node.speculations[request_id] = Speculation(base_shard=BASE_SHARD, draft_shard=DRAFT_SHARD, k=node.speculative_tokens, prefill=prefill)
+  return node.speculations[request_id]
+
+
+class TestSpeculativeDecoding(unittest.IsolatedAsyncioTestCase):
+  def test_verify_accepts_the_longest_matching_prefix_and_the_targets_next_token(self):
+    # logits for [last, d1, d2, d3] predict the token after each position
+    self.assertEqual(verify_drafts(one_hot([4, 6, 9, 2]), [4, 6, 7]), [4, 6, 9])
+    self.assertEqual(verify_drafts(one_hot([3, 6, 7, 2]), [4, 6, 7]), [3])
+    self.assertEqual(verify_drafts(one_hot([4, 6, 7, 2]), [4, 6, 7]), [4, 6, 7, 2])
+
+  async def test_last_shard_delivers_verified_tokens_to_the_origin_instead_of_looping(self):
+    node = make_node("last")
+    node.forward_tensor = mock.AsyncMock()
+    node.deliver_result = mock.AsyncMock()
+    node.inference_engine.infer_tensor.side_effect = lambda request_id, shard, x, state=None: (one_hot([4, 6, 9, 2]), None)
+    await node._process_tensor(BASE_SHARD, np.array([[1, 4, 6, 7]]), "req", {"origin_node_id": "origin", "speculative": {"drafts": [4, 6, 7], "rollback": 2}})
+    await asyncio.sleep(0)
+
+    node.inference_engine.trim_cache.assert_awaited_once_with("req", 2)
+    node.deliver_result.assert_called_once_with("req", [4, 6, 9], False, "origin")
+    node.forward_tensor.assert_not_called()
+    self.assertEqual(node.buffered_token_output["req"], ([4, 6, 9], False))
+
+  async def test_verified_tokens_stop_at_eos(self):
+    node = make_node("last")
+    node.deliver_result = mock.AsyncMock()
+    node.inference_engine.infer_tensor.side_effect = lambda request_id, shard, x, state=None: (one_hot([4, 0, 9, 2]), None)
+    await node._process_tensor(BASE_SHARD, np.array([[1, 4, 0, 9]]), "req", {"origin_node_id": "origin", "speculative": {"drafts": [4, 0, 9]}})
+    await asyncio.sleep(0)
+
+    node.deliver_result.assert_called_once_with("req", [4, 0], True, "origin")
+    self.assertNotIn("req", node.outstanding_requests)
+
+  async def test_origin_drafts_k_tokens_and_sends_them_for_verification(self):
+    node = make_node()
+    node.forward_tensor = mock.AsyncMock()
+    spec = start(node)
+    node.inference_engine.infer_tensor.side_effect = [(one_hot([4]), None), (one_hot([6]), None), (one_hot([7]), None)]
+    await node.speculate("req", [1])
+
+    self.assertEqual([(call.args[0], call.args[2].tolist()) for call in node.inference_engine.infer_tensor.call_args_list], [("req/draft", [[1]]), ("req/draft", [[4]]), ("req/draft", [[6]])])
+    node.inference_engine.trim_cache.assert_not_awaited()
+    self.assertEqual(node.forward_tensor.call_args.args[1].tolist(), [[1, 4, 6, 7]])
+    self.assertEqual(node.forward_tensor.call_args.args[4]["speculative"], {"drafts": [4, 6, 7], "rollback": 0})
+    self.assertEqual(spec.drafts, [4, 6, 7])
+
+  async def test_rejected_drafts_are_rolled_back_on_the_draft_model_and_the_ring(self):
+    node = make_node()
+    node.forward_tensor = mock.AsyncMock()
+    spec = start(node)
+    spec.drafts = [4, 6, 7]
+    node.inference_engine.infer_tensor.side_effect = lambda request_id, shard, x, state=None: (one_hot([3]), None)
+    # d1 accepted, the target chose 9 instead of d2
+    await node.speculate("req", [4, 9])
+
+    node.inference_engine.trim_cache.assert_awaited_once_with("req/draft", 1)
+    self.assertEqual(node.inference_engine.infer_tensor.call_args_list[0].args[2].tolist(), [[9]])
+    self.assertEqual(node.forward_tensor.call_args.args[1].tolist(), [[9, 3, 3, 3]])
+    self.assertEqual(node.forward_tensor.call_args.args[4]["speculative"]["rollback"], 2)
+    self.assertEqual((spec.proposed, spec.accepted), (3, 1))
+
+  async def test_fully_accepted_drafts_feed_the_last_draft_to_the_draft_model(self):
+    node = make_node()
+    node.forward_tensor = mock.AsyncMock()
+    spec = start(node)
+    spec.drafts = [4, 6, 7]
+    node.inference_engine.infer_tensor.side_effect = lambda request_id, shard, x, state=None: (one_hot([3, 3]), None)
+    await node.speculate("req", [4, 6, 7, 2])
+
+    node.inference_engine.trim_cache.assert_not_awaited()
+    self.assertEqual(node.inference_engine.infer_tensor.call_args_list[0].args[2].tolist(), [[7, 2]])
+    self.assertEqual(node.forward_tensor.call_args.args[4]["speculative"]["rollback"], 0)
+
+  async def test_speculation_ends_with_the_request(self):
+    node = make_node()
+    node.speculate = mock.AsyncMock()
+    start(node)
+    node.trigger_on_token_callbacks("req", [0], True)
+    await asyncio.sleep(0)
+
+    self.assertNotIn("req", node.speculations)
+    node.speculate.assert_not_called()
+    # the draft model runs on the node's own engine, its kv cache is kept under its own request id
+    node.inference_engine.evict_request.assert_awaited_once_with("req/draft")
+
+  async def test_sampling_with_temperature_does_not_speculate(self):
+    node = make_node()
+    node.default_sample_temperature = 0.7
+    self.assertFalse(node.start_speculation(BASE_SHARD, "prompt", "req"))
+    node.default_sample_temperature = 0.0
+    with mock.patch("exo.orchestration.node.get_draft_model", return_value="llama-3.2-1b"), mock.patch("exo.orchestration.node.build_base_shard", return_value=Shard("llama-3.2-1b", 0, 0, 16)):
+      self.assertTrue(node.start_speculation(BASE_SHARD, "prompt", "req"))
+    await asyncio.sleep(0)
+    self.assertEqual(node.speculations["req"].draft_shard, DRAFT_SHARD)
+    node.inference_engine.infer_prompt.assert_awaited_once_with("req/draft", node.speculations["req"].draft_shard, "prompt")
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+from unittest import mock
+from exo.orchestration.status_bus import StatusBus
+
+
+def make_peer(peer_id):
+  peer = mock.AsyncMock()
+  peer.id = mock.Mock(return_value=peer_id)
+  return peer
+
+
+def progress(node_id, downloaded):
+  return {"type": "download_progress", "node_id": node_id, "progress": downloaded}
+
+
+class TestStatusBus(unittest.IsolatedAsyncioTestCase):
+  async def test_events_are_batched_per_interval(self):
+    bus = StatusBus(interval=0.01)
+    peers = [make_peer("a"), make_peer("b")]
+    for i in range(3):
+      bus.publish(peers, f"req{i}", {"type": "node_status", "node_id": "me", "status": f"s{i}"})
+    await asyncio.sleep(0.05)
+
+    for peer in peers:
+      peer.send_status_batch.assert_awaited_once()
+      self.assertEqual([request_id for request_id, _ in peer.send_status_batch.call_args.args[0]], ["req0", "req1", "req2"])
+    self.assertEqual(bus.stats()["batches_sent"], 2)
+
+  async def test_superseded_events_are_dropped(self):
+    bus = StatusBus(interval=0.01)
+    peer = make_peer("a")
+    for downloaded in range(5):
+      bus.publish([peer], "", progress("node1", downloaded))
+    bus.publish([peer], "", progress("node2", 0))
+    await asyncio.sleep(0.05)
+
+    events = peer.send_status_batch.call_args.args[0]
+    self.assertEqual([status["progress"] for _, status in events], [4, 0])
+    self.assertEqual(bus.superseded, 4)
+
+  async def test_slow_peer_accumulates_without_blocking_others(self):
+    bus = StatusBus(interval=0.01)
+    release = asyncio.Event()
+    slow, fast = make_peer("slow"), make_peer("fast")
+
+    async def wait_for_release(events):
+      await release.wait()
+
+    slow.send_status_batch.side_effect = wait_for_release
+    bus.publish([slow, fast], "req0", {"type": "node_status"})
+    await asyncio.sleep(0.03)
+    bus.publish([slow, fast], "req1", {"type": "node_status"})
+    bus.publish([slow, fast], "req2", {"type": "node_status"})
+    await asyncio.sleep(0.03)
+
+    self.assertEqual(fast.send_status_batch.await_count, 2)
+    self.assertEqual(slow.send_status_batch.await_count, 1)
+    release.set()
+    await asyncio.sleep(0.03)
+    self.assertEqual(slow.send_status_batch.await_count, 2)
+    self.assertEqual([request_id for request_id, _ in slow.send_status_batch.call_args.args[0]], ["req1", "req2"])
+
+  async def test_failed_sends_are_reported_not_raised(self):
+    bus = StatusBus(interval=0.01)
+    peer = make_peer("a")
+    peer.send_status_batch.side_effect = ConnectionError("gone")
+    bus.publish([peer], "req", {"type": "node_status"})
+    await asyncio.sleep(0.03)
+    self.assertEqual(bus.stats()["pending"], 0)
+    self.assertFalse(bus.sending)
+
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,20 @@
+from typing import Dict, Optional
+from unittest import mock
+import numpy as np
+from exo.orchestration.node import Node
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+def make_node(node_id: str, memories: Optional[Dict[str, int]] = None, vocab: int = 4, **node_kwargs) -> Node:
+  """
+  A node for the orchestration tests whose inference engine is a mock returning zeros of width vocab for every input position.
+  memories are the devices in the topology by node id, only the node itself by default. node_kwargs go to Node.
+  """
+  engine = mock.AsyncMock()
+  engine.infer_tensor = mock.AsyncMock(side_effect=lambda request_id, shard, x, state=None: (np.zeros((1, x.shape[1], vocab)), None))
+  node = Node(node_id, None, engine, mock.AsyncMock(), RingMemoryWeightedPartitioningStrategy(), **node_kwargs)
+  node.batch_scheduler = mock.Mock(infer_tensor=engine.infer_tensor)
+  for peer_id, memory in (memories or {node_id: 1000}).items():
+    node.topology.update_node(peer_id, DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+  return node
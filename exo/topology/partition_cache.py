@@ -0,0 +1,44 @@
+from typing import Dict, List, Optional, Tuple
+from .topology import Topology
+from .partitioning_strategy import Partition, PartitioningStrategy, map_partitions_to_shards
+from exo.inference.shard import Shard
+
+
+class PartitionCache:
+  """
+  Partitions, shards and partition indices derived from a topology, recomputed only when the topology's
+  fingerprint changes. A freshly collected topology with the same nodes and edges reuses the cached values.
+  """
+  def __init__(self, partitioning_strategy: PartitioningStrategy):
+    self.partitioning_strategy = partitioning_strategy
+    self.fingerprint: Optional[str] = None
+    self._partitions: List[Partition] = []
+    self._shards: Dict[Tuple[str, int], List[Shard]] = {}
+    self._indices: Dict[str, Optional[int]] = {}
+    self.misses = 0
+
+  def _validate(self, topology: Topology) -> None:
+    fingerprint = topology.fingerprint()
+    if fingerprint == self.fingerprint: return
+    self.misses += 1
+    self.fingerprint = fingerprint
+    self._partitions = self.partitioning_strategy.partition(topology)
+    self._shards = {}
+    self._indices = {}
+
+  def partitions(self, topology: Topology) -> List[Partition]:
+    self._validate(topology)
+    return self._partitions
+
+  def shards(self, topology: Topology, model_id: str, n_layers: int) -> List[Shard]:
+    self._validate(topology)
+    key = (model_id, n_layers)
+    if key not in self._shards:
+      self._shards[key] = map_partitions_to_shards(self._partitions, n_layers, model_id)
+    return self._shards[key]
+
+  def partition_index(self, topology: Topology, node_id: str) -> Optional[int]:
+    self._validate(topology)
+    if node_id not in self._indices:
+      self._indices[node_id] = next((i for i, p in enumerate(self._partitions) if p.node_id == node_id), None)
+    return self._indices[node_id]
@@ -0,0 +1,51 @@
+import unittest
+from unittest import mock
+from exo.topology.ring_memory_weighted_partitioning_strategy import RingMemoryWeightedPartitioningStrategy
+from exo.topology.partition_cache import PartitionCache
+from exo.topology.topology import Topology
+from exo.topology.device_capabilities import DeviceCapabilities, DeviceFlops
+
+
+def make_topology(memories):
+  topology = Topology()
+  for node_id, memory in memories.items():
+    topology.update_node(node_id, DeviceCapabilities(model="test", chip="test", memory=memory, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+  node_ids = list(memories)
+  for from_id, to_id in zip(node_ids, node_ids[1:] + node_ids[:1]):
+    topology.add_edge(from_id, to_id)
+  return topology
+
+
+class TestPartitionCache(unittest.TestCase):
+  def setUp(self):
+    self.strategy = RingMemoryWeightedPartitioningStrategy()
+    self.strategy.partition = mock.Mock(side_effect=self.strategy.partition)
+    self.cache = PartitionCache(self.strategy)
+
+  def test_repeated_lookups_partition_once(self):
+    topology = make_topology({"node1": 3000, "node2": 1000, "node3": 6000})
+    for _ in range(10):
+      self.cache.partitions(topology)
+      self.assertEqual(self.cache.partition_index(topology, "node1"), 1)
+      shards = self.cache.shards(topology, "model", 32)
+    self.assertEqual(self.strategy.partition.call_count, 1)
+    self.assertEqual([(shard.start_layer, shard.end_layer) for shard in shards], [(0, 18), (19, 27), (28, 31)])
+    self.assertIs(self.cache.shards(topology, "model", 32), shards)
+    self.assertEqual(len(self.cache.shards(topology, "model", 16)), 3)
+
+  def test_identical_collected_topology_reuses_cache(self):
+    self.cache.partitions(make_topology({"node1": 3000, "node2": 1000}))
+    self.cache.partitions(make_topology({"node1": 3000, "node2": 1000}))
+    self.assertEqual(self.cache.misses, 1)
+
+  def test_changed_topology_invalidates(self):
+    topology = make_topology({"node1": 3000, "node2": 1000})
+    self.assertEqual(self.cache.partition_index(topology, "node2"), 1)
+    topology.update_node("node2", DeviceCapabilities(model="test", chip="test", memory=9000, flops=DeviceFlops(fp32=0, fp16=0, int8=0)))
+    self.assertEqual(self.cache.partition_index(topology, "node2"), 0)
+    self.assertIsNone(self.cache.partition_index(topology, "node3"))
+    self.assertEqual(self.cache.misses, 2)
+
+
+if __name__ == "__main__":
+  unittest.main()
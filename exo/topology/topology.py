@@ -1,6 +1,8 @@
 from .device_capabilities import DeviceCapabilities
-from typing import Dict, Set, Optional
+from typing import Dict, Set, Optional, Tuple
 from dataclasses import dataclass
+import hashlib
+import json
 
 @dataclass
 class PeerConnection:
@@ -23,9 +25,13 @@ class Topology:
     self.nodes: Dict[str, DeviceCapabilities] = {}
     self.peer_graph: Dict[str, Set[PeerConnection]] = {}
     self.active_node_id: Optional[str] = None
+    # bumped on every change, so whatever is derived from the topology can be cached against it
+    self.version = 0
+    self._fingerprint: Optional[Tuple[int, str]] = None
 
   def update_node(self, node_id: str, device_capabilities: DeviceCapabilities):
     self.nodes[node_id] = device_capabilities
+    self.version += 1
 
   def get_node(self, node_id: str) -> DeviceCapabilities:
     return self.nodes.get(node_id)
@@ -38,6 +44,17 @@ class Topology:
       self.peer_graph[from_id] = set()
     conn = PeerConnection(from_id, to_id, description)
     self.peer_graph[from_id].add(conn)
+    self.version += 1
+
+  def fingerprint(self) -> str:
+    """Content hash of nodes and edges: equal for topologies that are the same, however they were built."""
+    if self._fingerprint is None or self._fingerprint[0] != self.version:
+      content = {
+        "nodes": sorted((node_id, capabilities.to_dict()) for node_id, capabilities in self.nodes.items()),
+        "peer_graph": sorted((conn.from_id, conn.to_id, conn.description or "") for connections in self.peer_graph.values() for conn in connections),
+      }
+      self._fingerprint = (self.version, hashlib.sha1(json.dumps(content, sort_keys=True).encode()).hexdigest())
+    return self._fingerprint[1]
 
   def merge(self, peer_node_id: str, other: "Topology"):
     for node_id, capabilities in other.nodes.items():